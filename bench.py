@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+生成合成的资源文件夹和RPY脚本，测量各阶段的吞吐量和峰值内存，
+并可以保存为基线，之后的运行与基线比较以发现性能退化
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import tracemalloc
+import contextlib
+from typing import List, Optional, Tuple
+
+import common
+import fix_rpy
+import mirror
+import rename
+
+# 预设规模
+SCALES = {
+    'small': {'depth': 2, 'fanout': 4, 'files_per_dir': 20, 'rpy_files': 20, 'lines_per_file': 2000},
+    'medium': {'depth': 3, 'fanout': 6, 'files_per_dir': 40, 'rpy_files': 100, 'lines_per_file': 5000},
+    'large': {'depth': 4, 'fanout': 8, 'files_per_dir': 60, 'rpy_files': 400, 'lines_per_file': 10000},
+}
+
+ASSET_EXTENSIONS = ['.ogg', '.mp3', '.wav', '.png', '.jpg', '.webp']
+ASCII_WORDS = ['bgm', 'voice', 'se', 'bg', 'cg', 'char', 'menu', 'title', 'night', 'day', 'room']
+DIALOGUE_ENDINGS = ['。', '！', '？', '……', '']
+
+def random_cjk_name(rng: random.Random, chars: List[str]) -> str:
+    """由字典中的汉字组成的名称，偶尔夹杂英文、数字、空格和中文符号"""
+    parts = [''.join(rng.choice(chars) for _ in range(rng.randint(2, 5)))]
+    roll = rng.random()
+    if roll < 0.3:
+        parts.append('_%d' % rng.randint(1, 99))
+    elif roll < 0.4:
+        parts.append(rng.choice([' ', '（', '，', '…']) + rng.choice(chars))
+    return ''.join(parts)
+
+def random_ascii_name(rng: random.Random) -> str:
+    return '%s_%d' % (rng.choice(ASCII_WORDS), rng.randint(1, 9999))
+
+def generate_asset_tree(root: str, depth: int, fanout: int, files_per_dir: int,
+                        cjk_density: float, chars: List[str], seed: int = 0) -> Tuple[int, List[str]]:
+    """
+    生成合成的资源文件夹
+    depth 为文件夹层数，fanout 为每个文件夹的子文件夹数，cjk_density 为含中文的名称所占比例
+    返回 (条目总数, 所有文件的相对路径)
+    """
+    rng = random.Random(seed)
+    entries = 0
+    files = []
+
+    def make_name(existing: set, extension: str = '') -> str:
+        while True:
+            if rng.random() < cjk_density:
+                name = random_cjk_name(rng, chars) + extension
+            else:
+                name = random_ascii_name(rng) + extension
+            if name not in existing:
+                existing.add(name)
+                return name
+
+    def fill(dir_path: str, rel_dir: str, level: int):
+        nonlocal entries
+        existing = set()
+        for _ in range(files_per_dir):
+            name = make_name(existing, rng.choice(ASSET_EXTENSIONS))
+            with open(os.path.join(dir_path, name), 'wb'):
+                pass
+            files.append(os.path.join(rel_dir, name) if rel_dir else name)
+            entries += 1
+        if level < depth:
+            for _ in range(fanout):
+                name = make_name(existing)
+                sub_path = os.path.join(dir_path, name)
+                os.mkdir(sub_path)
+                entries += 1
+                fill(sub_path, os.path.join(rel_dir, name) if rel_dir else name, level + 1)
+
+    os.makedirs(root, exist_ok=True)
+    fill(root, '', 1)
+    return entries, files
+
+def generate_rpy_corpus(root: str, asset_files: List[str], chars: List[str], file_count: int,
+                        lines_per_file: int, ref_density: float, asset_prefix: str = 'audio/',
+                        seed: int = 0) -> Tuple[int, int]:
+    """
+    生成与资源文件夹对应的RPY脚本
+    ref_density 为引用资源文件的行所占比例，其余为对话和普通脚本行
+    返回 (总行数, 总字节数)
+    """
+    rng = random.Random(seed)
+    total_lines = 0
+    total_bytes = 0
+    os.makedirs(root, exist_ok=True)
+    for file_index in range(file_count):
+        sub_dir = os.path.join(root, 'chapter%d' % (file_index % 8))
+        os.makedirs(sub_dir, exist_ok=True)
+        lines = ['label scene_%d:\n' % file_index]
+        for line_index in range(lines_per_file - 1):
+            roll = rng.random()
+            if asset_files and roll < ref_density:
+                asset = rng.choice(asset_files).replace(os.sep, '/')
+                lines.append('    play sound "%s%s"\n' % (asset_prefix, asset))
+            elif roll < ref_density + (1 - ref_density) * 0.6:
+                text = ''.join(rng.choice(chars) for _ in range(rng.randint(8, 30)))
+                lines.append('    e "%s%s"\n' % (text, rng.choice(DIALOGUE_ENDINGS)))
+            else:
+                lines.append('    $ renpy.pause(%d.%d)\n' % (rng.randint(0, 3), rng.randint(0, 9)))
+        data = ''.join(lines).encode('utf-8')
+        with open(os.path.join(sub_dir, 'script_%d.rpy' % file_index), 'wb') as f:
+            f.write(data)
+        total_lines += len(lines)
+        total_bytes += len(data)
+    return total_lines, total_bytes
+
+class Phase:
+    """一个基准阶段：setup 准备全新的输入，run 执行被测操作"""
+
+    def __init__(self, name: str, setup, run, units: str, count: int, size: int = 0):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.units = units
+        self.count = count
+        self.size = size
+
+def measure(phase: Phase, repeat: int, trace_memory: bool = True) -> dict:
+    """多次运行取最短时间，再单独运行一次用 tracemalloc 测量峰值内存"""
+    best = None
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            state = phase.setup()
+            start = time.perf_counter()
+            phase.run(state)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        peak = None
+        if trace_memory:
+            state = phase.setup()
+            tracemalloc.start()
+            try:
+                phase.run(state)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    result = {
+        'seconds': round(best, 6),
+        'count': phase.count,
+        'units': phase.units,
+        'per_second': round(phase.count / best, 1) if best else None,
+    }
+    if phase.size:
+        result['mb_per_second'] = round(phase.size / (1024 * 1024) / best, 3) if best else None
+    if peak is not None:
+        result['peak_memory_kb'] = round(peak / 1024, 1)
+    return result
+
+def build_phases(config: dict, workdir: str, chars: List[str]) -> List[Phase]:
+    """生成测试数据并构建各阶段"""
+    assets_dir = os.path.join(workdir, 'assets')
+    scripts_dir = os.path.join(workdir, 'scripts')
+
+    entries, asset_files = generate_asset_tree(
+        assets_dir, config['depth'], config['fanout'], config['files_per_dir'],
+        config['cjk_density'], chars, config['seed'])
+
+    # 由资源文件夹的重命名计划得到RPY扫描使用的映射
+    plan_file = os.path.join(workdir, 'rename_plan.jsonl')
+    with contextlib.redirect_stdout(io.StringIO()):
+        rename.generate_preview_log(assets_dir, None, rename.scan_tree(assets_dir), plan_file)
+        rename_mapping = fix_rpy.load_rename_mapping_from_plan(plan_file)
+        mirror_names = {record['old']: record['new_name'] for record in common.iter_plan_file(plan_file)
+                        if record['new_name'] != record['name']}
+
+    total_lines, total_bytes = generate_rpy_corpus(
+        scripts_dir, asset_files, chars, config['rpy_files'], config['lines_per_file'],
+        config['ref_density'], seed=config['seed'])
+
+    names = [os.path.basename(path) for path in asset_files]
+    workers = config['workers']
+    in_flight = config.get('in_flight', 0)
+
+    def fresh_copy(source: str, name: str) -> str:
+        target = os.path.join(workdir, name)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target)
+        return target
+
+    def setup_mirror() -> str:
+        mirror_dir = os.path.join(workdir, 'mirror')
+        shutil.rmtree(mirror_dir, ignore_errors=True)
+        state_file = mirror.mirror_state_file(mirror_dir)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        return mirror_dir
+
+    def setup_refs():
+        refs = fix_rpy.AssetRefIndex(common.FileStateIndex())
+        refs.refresh(scripts_dir)
+        return refs
+
+    def setup_update():
+        target = fresh_copy(scripts_dir, 'scripts_update')
+        mapping_file = os.path.join(workdir, 'rename_mapping.json')
+        fix_rpy.generate_rpy_mapping(target, mapping_file, os.path.join(workdir, 'rename_log.txt'),
+                                     workers, plan_file=plan_file, in_flight=in_flight)
+        return mapping_file
+
+    return [
+        Phase('normalize_filename',
+              lambda: rename.FilenameNormalizer(rename.CHINESE_TO_PINYIN),
+              lambda normalizer: normalizer.normalize_many(names),
+              'names', len(names)),
+        Phase('generate_preview_log',
+              lambda: None,
+              lambda _: rename.generate_preview_log(
+                  assets_dir, os.path.join(workdir, 'rename_log.txt'),
+                  plan_file=os.path.join(workdir, 'preview_plan.jsonl')),
+              'entries', entries),
+        Phase('stream_preview',
+              lambda: None,
+              lambda _: rename.stream_preview(
+                  assets_dir, os.path.join(workdir, 'stream_plan.jsonl'),
+                  os.path.join(workdir, 'stream_log.txt'), progress_interval=None),
+              'entries', entries),
+        Phase('rename_files',
+              lambda: fresh_copy(assets_dir, 'assets_rename'),
+              lambda target: rename.rename_files(target),
+              'entries', entries),
+        Phase('mirror_tree',
+              setup_mirror,
+              lambda mirror_dir: mirror.mirror_tree(assets_dir, mirror_dir, mirror_names, mirror.FileLinker()),
+              'entries', entries),
+        Phase('scan_rpy_files',
+              lambda: None,
+              lambda _: fix_rpy.scan_rpy_files(scripts_dir, rename_mapping, workers, in_flight=in_flight),
+              'lines', total_lines, total_bytes),
+        Phase('build_asset_refs',
+              lambda: fix_rpy.AssetRefIndex(common.FileStateIndex()),
+              lambda refs: refs.refresh(scripts_dir),
+              'lines', total_lines, total_bytes),
+        Phase('scan_rpy_refs',
+              setup_refs,
+              lambda refs: fix_rpy.scan_rpy_refs(scripts_dir, rename_mapping, refs),
+              'lines', total_lines, total_bytes),
+        Phase('update_rpy_files',
+              setup_update,
+              lambda mapping_file: fix_rpy.update_rpy_files(mapping_file, rename_mapping, in_flight),
+              'lines', total_lines, total_bytes),
+    ]
+
+def run_benchmarks(config: dict, phases_to_run: Optional[List[str]] = None) -> dict:
+    """生成数据、运行所有阶段，返回结果"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        rename.load_dictionary(config['dict_file'])
+    chars = sorted(rename.CHINESE_TO_PINYIN)
+    if not chars:
+        raise RuntimeError(f"字典文件为空或不存在: {config['dict_file']}")
+
+    workdir = tempfile.mkdtemp(prefix='cn2en-bench-')
+    try:
+        phases = build_phases(config, workdir, chars)
+        results = {}
+        for phase in phases:
+            if phases_to_run and phase.name not in phases_to_run:
+                continue
+            print(f"运行阶段: {phase.name} ...")
+            results[phase.name] = measure(phase, config['repeat'], config['trace_memory'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'config': {key: value for key, value in config.items() if key != 'dict_file'},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'phases': results,
+    }
+
+def print_results(results: dict):
+    print(f"\n{'阶段':<22}{'耗时(s)':>10}{'吞吐量':>22}{'MB/s':>10}{'峰值内存(KB)':>16}")
+    for name, result in results['phases'].items():
+        throughput = f"{result['per_second']:.0f} {result['units']}/s"
+        mb = f"{result['mb_per_second']:.2f}" if 'mb_per_second' in result else '-'
+        peak = f"{result['peak_memory_kb']:.0f}" if 'peak_memory_kb' in result else '-'
+        print(f"{name:<22}{result['seconds']:>10.3f}{throughput:>22}{mb:>10}{peak:>16}")
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """与基线比较，返回退化项的说明"""
+    regressions = []
+    for name, result in results['phases'].items():
+        base = baseline.get('phases', {}).get(name)
+        if not base:
+            continue
+        if base.get('per_second') and result['per_second'] is not None:
+            ratio = result['per_second'] / base['per_second']
+            print(f"{name}: 吞吐量为基线的 {ratio:.2%}")
+            if ratio < 1 - tolerance:
+                regressions.append(f"{name} 吞吐量下降到基线的 {ratio:.2%}")
+        if base.get('peak_memory_kb') and result.get('peak_memory_kb') is not None:
+            ratio = result['peak_memory_kb'] / base['peak_memory_kb']
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} 峰值内存增加到基线的 {ratio:.2%}")
+    ignored = ('repeat', 'trace_memory')
+    config = {key: value for key, value in results['config'].items() if key not in ignored}
+    base_config = {key: value for key, value in baseline.get('config', {}).items() if key not in ignored}
+    if base_config != config:
+        print("注意：基线的测试配置与本次不同，比较结果仅供参考")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="cn2en 性能基准测试")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="预设规模")
+    parser.add_argument('--depth', type=int, help="资源文件夹层数")
+    parser.add_argument('--fanout', type=int, help="每个文件夹的子文件夹数")
+    parser.add_argument('--files-per-dir', type=int, help="每个文件夹中的文件数")
+    parser.add_argument('--cjk-density', type=float, default=0.6, help="含中文的名称所占比例")
+    parser.add_argument('--rpy-files', type=int, help="RPY文件数")
+    parser.add_argument('--lines-per-file', type=int, help="每个RPY文件的行数")
+    parser.add_argument('--ref-density', type=float, default=0.1, help="引用资源文件的行所占比例")
+    parser.add_argument('--workers', type=int, default=1, help="扫描RPY文件的进程数")
+    parser.add_argument('--in-flight', type=int, default=0,
+                        help="RPY扫描和更新使用异步流水线时同时处理的文件数")
+    parser.add_argument('--repeat', type=int, default=3, help="每个阶段重复运行的次数（取最短时间）")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--phase', action='append', help="只运行指定阶段，可重复")
+    parser.add_argument('--no-memory', action='store_true', help="不测量峰值内存")
+    parser.add_argument('--dict-file', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'chinese_dictionary.json'))
+    parser.add_argument('--save-baseline', metavar='FILE', help="把结果保存为基线")
+    parser.add_argument('--compare', metavar='FILE', help="与基线比较，有退化时返回非零退出码")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的退化比例")
+    parser.add_argument('--output', metavar='FILE', help="把结果保存为JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    config = dict(SCALES[args.scale])
+    for key in ('depth', 'fanout', 'files_per_dir', 'rpy_files', 'lines_per_file'):
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    config.update({
+        'scale': args.scale,
+        'cjk_density': args.cjk_density,
+        'ref_density': args.ref_density,
+        'workers': args.workers,
+        'in_flight': args.in_flight,
+        'repeat': max(1, args.repeat),
+        'seed': args.seed,
+        'trace_memory': not args.no_memory,
+        'dict_file': args.dict_file,
+    })
+
+    results = run_benchmarks(config, args.phase)
+    print_results(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"结果已保存到: {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n=== 与基线比较: {args.compare} ===")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("发现性能退化：")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("没有发现性能退化")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rename.py 的命令行
+python rename.py 的参数在这里解析，再分派给重命名、RPY修复、镜像、批量处理和监视模式
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import List, Optional
+
+import watch
+from common import DICT_FILE, INDEX_FILE, JOURNAL_DIR, LOG_FILE, PLAN_FILE, run_instrumented
+from fix_rpy import FIX_OK_STATUSES
+from mirror import MIRROR_LINK_MODES, MIRROR_THREADS, run_mirror
+from pipeline import load_projects, resume_journal, run_batch, run_pipeline
+from rename import RENAME_OK_STATUSES, confirm_rename, interactive, rollback_journal, run_rename
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="将文件夹中的中文文件名和文件夹名转换为拼音。不带参数运行时进入交互模式")
+    parser.add_argument('target', nargs='?', help="目标文件夹")
+    parser.add_argument('--dict', dest='dict_file', default=DICT_FILE, help="字典文件")
+    parser.add_argument('--rpy', metavar='PATH',
+                        help="同时更新该目录下RPY文件中的引用（一次完成，计划和日志文件变为可选输出）")
+    parser.add_argument('--plan', dest='plan_file', help=f"重命名计划文件，默认为 {PLAN_FILE}")
+    parser.add_argument('--log', dest='log_file', help=f"预览日志文件，默认为 {LOG_FILE}")
+    parser.add_argument('--mapping', dest='mapping_file', help="与 --rpy 一起使用时保存RPY更新映射")
+    parser.add_argument('--incremental', action='store_true',
+                        help="使用增量索引，跳过修改时间未变的文件夹（网络共享上文件夹的修改时间可能不可靠，默认完整扫描）")
+    parser.add_argument('--index', dest='index_file', default=INDEX_FILE, help="增量索引和资源引用索引的文件")
+    parser.add_argument('-y', '--yes', action='store_true', help="不询问，直接执行")
+    parser.add_argument('--dry-run', action='store_true', help="只生成计划和日志，不执行重命名")
+    parser.add_argument('--stream', action='store_true',
+                        help="流式预览：边遍历边写计划文件并显示进度，内存占用与文件数量无关（不能与 --rpy 同时使用）")
+    parser.add_argument('--mirror', metavar='DIR',
+                        help="不修改目标文件夹，在 DIR 中建立按拼音命名的镜像（优先使用 reflink 或硬链接，重复运行时增量更新）")
+    parser.add_argument('--mirror-rpy', metavar='DIR',
+                        help="与 --mirror、--rpy 一起使用且RPY目录不在目标文件夹内时，改写后的RPY文件的位置")
+    parser.add_argument('--link', choices=sorted(MIRROR_LINK_MODES), default='auto',
+                        help="建立镜像时放置文件的方式，auto 依次尝试 reflink、硬链接、copy_file_range 和复制")
+    parser.add_argument('--watch', action='store_true',
+                        help="（仅 Linux）持续监视目标文件夹，新出现的中文名文件和文件夹立即转换，并更新 --rpy 目录中受影响的RPY文件")
+    parser.add_argument('--debounce', type=float, default=0.2, metavar='SECONDS',
+                        help="监视模式中最后一个事件之后等待多久再处理")
+    parser.add_argument('--journal', dest='journal_dir', default=JOURNAL_DIR, metavar='DIR',
+                        help="执行日志文件夹，记录完成的操作，用于中断后继续执行和回滚")
+    parser.add_argument('--no-journal', action='store_true', help="不记录执行日志")
+    parser.add_argument('--resume', action='store_true', help="根据执行日志继续上一次被中断的执行")
+    parser.add_argument('--rollback', action='store_true', help="根据执行日志撤销上一次执行")
+    parser.add_argument('--threads', type=int,
+                        help=f"执行重命名的线程数（默认为 1），网络文件系统上可以设大一些；"
+                             f"建立镜像时为同时放置文件的线程数（默认为 {MIRROR_THREADS}）")
+    parser.add_argument('--workers', type=int, help="与 --rpy 一起使用时扫描RPY文件的进程数，默认为CPU数")
+    parser.add_argument('--in-flight', type=int, default=0, metavar='N',
+                        help="与 --rpy 一起使用时以异步流水线读写RPY文件，同时最多 N 个")
+    parser.add_argument('--refs', action='store_true',
+                        help="与 --rpy 一起使用时用资源引用索引找出需要更新的RPY文件，只更新记录的资源路径字符串")
+    parser.add_argument('--batch', metavar='PROJECTS', help="批量处理项目列表（JSON）中的所有项目")
+    parser.add_argument('--jobs', type=int, help="批量处理时并行的进程数，默认为CPU数")
+    parser.add_argument('--report', metavar='FILE', help="批量处理时保存汇总报告（JSON）")
+    parser.add_argument('--metrics', metavar='FILE', default=os.environ.get('CN2EN_METRICS'),
+                        help="导出性能指标（JSON）")
+    parser.add_argument('--profile', metavar='FILE', default=os.environ.get('CN2EN_PROFILE'),
+                        help="用 cProfile 运行并保存统计")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主函数"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        # 设置环境变量 CN2EN_METRICS / CN2EN_PROFILE 时导出性能指标 / cProfile 统计
+        return run_instrumented(interactive, 'rename', os.environ.get('CN2EN_METRICS'),
+                                os.environ.get('CN2EN_PROFILE'))
+    
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    threads = args.threads or 1
+    
+    if args.batch:
+        if not (args.yes or args.dry_run):
+            parser.error("批量模式不会询问确认，需要指定 --yes 或 --dry-run")
+        try:
+            projects = load_projects(args.batch)
+        except Exception as e:
+            print(f"读取项目列表失败: {e}")
+            return 1
+        report = run_instrumented(lambda: run_batch(projects, args.dict_file, args.dry_run, args.jobs,
+                                                    threads, args.incremental),
+                                  'rename-batch', args.metrics, args.profile)
+        print(f"\n总计 {len(projects)} 个项目，成功 {report['succeeded']} 个，失败 {report['failed']} 个")
+        if args.report:
+            try:
+                with open(args.report, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+                print(f"汇总报告已保存到: {args.report}")
+            except Exception as e:
+                print(f"保存汇总报告失败: {e}")
+        return 0 if report['failed'] == 0 else 1
+    
+    if args.resume or args.rollback:
+        if args.resume and args.rollback:
+            parser.error("--resume 和 --rollback 不能同时使用")
+        if args.resume:
+            result = run_instrumented(lambda: resume_journal(args.journal_dir, threads, args.in_flight),
+                                      'resume', args.metrics, args.profile)
+            return 0 if result['status'] in ('resumed', 'nothing_to_resume') else 1
+        result = run_instrumented(lambda: rollback_journal(args.journal_dir), 'rollback',
+                                  args.metrics, args.profile)
+        return 0 if result['status'] in ('rolled_back', 'nothing_to_rollback') else 1
+    
+    if not args.target:
+        parser.error("需要指定目标文件夹，或使用 --batch、--resume、--rollback")
+    
+    confirm = None if args.yes else confirm_rename
+    index_file = args.index_file if args.incremental else None
+    journal_dir = None if args.no_journal else args.journal_dir
+    if args.watch:
+        for flag, used in (('--dry-run', args.dry_run), ('--stream', args.stream), ('--mirror', args.mirror),
+                           ('--mirror-rpy', args.mirror_rpy)):
+            if used:
+                parser.error(f"{flag} 不能与 --watch 同时使用")
+        if not args.yes:
+            parser.error("监视模式不会询问确认，需要指定 --yes")
+        return run_instrumented(
+            lambda: watch.run_watch(args.target, args.rpy, args.dict_file, threads, args.debounce,
+                                    plan_file=args.plan_file or PLAN_FILE, log_file=args.log_file or LOG_FILE,
+                                    index_file=index_file, journal_dir=journal_dir,
+                                    mapping_file=args.mapping_file, refs_file=args.index_file if args.refs else None,
+                                    workers=args.workers, in_flight=args.in_flight),
+            'watch', args.metrics, args.profile)
+    if args.mirror:
+        if args.stream:
+            parser.error("--stream 不能与 --mirror 同时使用")
+        result = run_instrumented(
+            lambda: run_mirror(args.target, args.mirror, args.dict_file, args.rpy, args.mirror_rpy,
+                               args.plan_file or PLAN_FILE, args.log_file or LOG_FILE, index_file,
+                               args.threads or MIRROR_THREADS, args.link, args.dry_run),
+            'mirror', args.metrics, args.profile)
+        return 0 if result['status'] in ('mirrored', 'dry_run') and not result['failures'] else 1
+    if args.rpy:
+        if args.stream:
+            parser.error("--stream 不能与 --rpy 同时使用")
+        rename_result, rpy_result = run_instrumented(
+            lambda: run_pipeline(args.target, args.rpy, args.dict_file, args.plan_file, args.log_file,
+                                 args.mapping_file, index_file, args.workers, threads,
+                                 args.dry_run, confirm, args.in_flight, journal_dir,
+                                 args.index_file if args.refs else None),
+            'pipeline', args.metrics, args.profile)
+        ok = (rename_result['status'] in RENAME_OK_STATUSES
+              and rpy_result['status'] in FIX_OK_STATUSES)
+        return 0 if ok else 1
+    
+    result = run_instrumented(
+        lambda: run_rename(args.target, args.dict_file, args.plan_file or PLAN_FILE,
+                           args.log_file or LOG_FILE, index_file, args.dry_run, confirm, threads,
+                           args.stream, journal_dir),
+        'rename', args.metrics, args.profile)
+    return 0 if result['status'] in RENAME_OK_STATUSES else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
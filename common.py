@@ -0,0 +1,664 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公共基础设施
+rename.py、fix_rpy.py 等工具共用的部分：默认文件路径、原子写入、性能指标、编译后的字典缓存、
+重命名计划及其文件格式、增量索引和执行日志。本模块不依赖其它工具模块
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import cProfile
+import hashlib
+import shutil
+import tempfile
+import threading
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 默认的字典文件、计划文件、日志文件和增量索引文件路径
+DICT_FILE = "chinese_dictionary.json"
+PLAN_FILE = "rename_plan.jsonl"
+LOG_FILE = "rename_log.txt"
+INDEX_FILE = "cn2en_index.json"
+
+# 当前进程的 umask，原子写入的临时文件按它设置权限（与直接创建文件时相同）
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+@contextmanager
+def atomic_write(file_path: str, mode: str = 'w'):
+    """
+    原子写入文件：在同一文件夹中创建唯一的临时文件，写完后替换目标文件
+    多个进程同时写同一个文件时不会共用临时文件；出错时删除临时文件，目标文件保持不变
+    """
+    directory, name = os.path.split(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+    try:
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            yield f
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# 性能指标文件格式
+METRICS_FORMAT = 'cn2en-metrics'
+METRICS_VERSION = 1
+
+class Metrics:
+    """
+    运行过程中各阶段的耗时和计数器
+    同一阶段可以多次进入，耗时和次数累加；结果导出为 JSON，供构建面板跨运行收集
+    可以在多个线程中同时使用
+    """
+
+    def __init__(self, tool: str = ''):
+        self.lock = threading.Lock()
+        self.reset(tool)
+
+    def reset(self, tool: str = ''):
+        self.tool = tool
+        self.started = time.time()
+        self.phases = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """对一个阶段计时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                record = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                record['seconds'] += elapsed
+                record['calls'] += 1
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, counters: Dict[str, int]):
+        """合并其他进程中统计的计数器"""
+        for name, value in counters.items():
+            self.count(name, value)
+
+    def to_dict(self) -> dict:
+        return {
+            'format': METRICS_FORMAT,
+            'version': METRICS_VERSION,
+            'tool': self.tool,
+            'started': round(self.started, 3),
+            'phases': {name: {'seconds': round(record['seconds'], 6), 'calls': record['calls']}
+                       for name, record in self.phases.items()},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def save(self, metrics_file: str):
+        """保存指标（先写临时文件再替换）"""
+        try:
+            with atomic_write(metrics_file) as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            print(f"性能指标已保存到: {metrics_file}")
+        except Exception as e:
+            print(f"保存性能指标失败: {e}")
+
+# 当前进程的性能指标
+METRICS = Metrics()
+
+def run_instrumented(func, tool: str, metrics_file: Optional[str] = None,
+                     profile_file: Optional[str] = None):
+    """
+    运行主函数并记录总耗时
+    指定 metrics_file 时导出性能指标，指定 profile_file 时用 cProfile 运行并保存统计（可用 pstats 查看）
+    """
+    METRICS.reset(tool)
+    profiler = cProfile.Profile() if profile_file else None
+    try:
+        with METRICS.phase('total'):
+            if profiler is not None:
+                return profiler.runcall(func)
+            return func()
+    finally:
+        if profiler is not None:
+            try:
+                profiler.dump_stats(profile_file)
+                print(f"cProfile 统计已保存到: {profile_file}")
+            except Exception as e:
+                print(f"保存 cProfile 统计失败: {e}")
+        if metrics_file:
+            METRICS.save(metrics_file)
+
+# 编译后的字典缓存文件格式：
+# 文件头 + 按码位索引的字符串结束偏移数组（uint32）+ UTF-8 字符串表
+# 文件头记录 JSON 字典的修改时间、大小和 SHA-1，任一不符且内容哈希也不符时重新生成
+COMPILED_DICT_MAGIC = b'CNPY'
+COMPILED_DICT_VERSION = 1
+COMPILED_DICT_HEADER = struct.Struct('<4sHHqq20sIII')
+
+class CompiledDictionary(Mapping):
+    """
+    编译后的只读拼音字典
+    按码位直接索引，查找为常数时间，内存中只保留两块紧凑的数组
+    """
+
+    def __init__(self, base: int, offsets: array, strings: bytes, size: int):
+        self.base = base
+        self.offsets = offsets
+        self.strings = strings
+        self.size = size
+
+    def _lookup(self, char):
+        if not isinstance(char, str) or len(char) != 1:
+            return None
+        index = ord(char) - self.base
+        if index < 0 or index + 1 >= len(self.offsets):
+            return None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        if start == end:
+            return None
+        return self.strings[start:end].decode('utf-8')
+
+    def __getitem__(self, char: str) -> str:
+        pinyin = self._lookup(char)
+        if pinyin is None:
+            raise KeyError(char)
+        return pinyin
+
+    def __contains__(self, char) -> bool:
+        return self._lookup(char) is not None
+
+    def get(self, char, default=None):
+        pinyin = self._lookup(char)
+        return default if pinyin is None else pinyin
+
+    def __iter__(self):
+        offsets = self.offsets
+        for index in range(len(offsets) - 1):
+            if offsets[index] != offsets[index + 1]:
+                yield chr(self.base + index)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def from_dict(cls, dictionary: Dict[str, str]) -> 'CompiledDictionary':
+        if not dictionary:
+            return cls(0, array('I', [0]), b'', 0)
+        codepoints = {ord(char): pinyin for char, pinyin in dictionary.items()}
+        base = min(codepoints)
+        offsets = array('I', [0])
+        strings = bytearray()
+        for codepoint in range(base, max(codepoints) + 1):
+            pinyin = codepoints.get(codepoint)
+            if pinyin:
+                strings += pinyin.encode('utf-8')
+            offsets.append(len(strings))
+        return cls(base, offsets, bytes(strings), len(dictionary))
+
+    def to_bytes(self, source_mtime_ns: int, source_size: int, source_digest: bytes) -> bytes:
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array('I', offsets)
+            offsets.byteswap()
+        header = COMPILED_DICT_HEADER.pack(
+            COMPILED_DICT_MAGIC, COMPILED_DICT_VERSION, 0, source_mtime_ns, source_size,
+            source_digest, self.base, len(self.offsets), self.size)
+        return header + offsets.tobytes() + self.strings
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Tuple['CompiledDictionary', int, int, bytes]:
+        """解析缓存文件，返回 (字典, 源文件修改时间, 源文件大小, 源文件哈希)"""
+        (magic, version, _, source_mtime_ns, source_size, source_digest,
+         base, offset_count, size) = COMPILED_DICT_HEADER.unpack_from(data)
+        if magic != COMPILED_DICT_MAGIC or version != COMPILED_DICT_VERSION:
+            raise ValueError("字典缓存格式不匹配")
+        start = COMPILED_DICT_HEADER.size
+        end = start + offset_count * 4
+        if offset_count < 1 or len(data) < end:
+            raise ValueError("字典缓存不完整")
+        offsets = array('I')
+        offsets.frombytes(data[start:end])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        # 被截断或多出内容的缓存不能使用，否则截掉的拼音会被当成空字符串
+        if offsets[0] != 0 or len(data) != end + offsets[-1]:
+            raise ValueError("字典缓存不完整")
+        return cls(base, offsets, data[end:], size), source_mtime_ns, source_size, source_digest
+
+def compiled_dictionary_path(dict_file: str) -> str:
+    """JSON 字典对应的编译缓存文件路径"""
+    return os.path.splitext(dict_file)[0] + '.bin'
+
+def _write_compiled_dictionary(cache_file: str, compiled: CompiledDictionary,
+                               stat: os.stat_result, digest: bytes):
+    """写入字典缓存（先写临时文件再替换），目录不可写时只提示不报错"""
+    try:
+        with atomic_write(cache_file, 'wb') as f:
+            f.write(compiled.to_bytes(stat.st_mtime_ns, stat.st_size, digest))
+    except OSError as e:
+        print(f"无法写入字典缓存: {e}")
+
+def load_compiled_dictionary(dict_file: str) -> Mapping:
+    """
+    加载字典，优先使用 JSON 旁边的编译缓存
+    缓存不存在或已过期时解析 JSON 并重新生成缓存；
+    字典中有非单字的键或空拼音时无法按码位索引，直接返回解析出的 dict
+    """
+    cache_file = compiled_dictionary_path(dict_file)
+    stat = os.stat(dict_file)
+    digest = None
+    
+    try:
+        with open(cache_file, 'rb') as f:
+            cached, mtime_ns, size, cached_digest = CompiledDictionary.from_bytes(f.read())
+        if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+            METRICS.count('dictionary_cache_hits')
+            return cached
+        # 修改时间变了但内容可能没变（例如重新检出），再比较内容哈希
+        with open(dict_file, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).digest()
+        if digest == cached_digest:
+            _write_compiled_dictionary(cache_file, cached, stat, digest)
+            METRICS.count('dictionary_cache_hits')
+            return cached
+    except (OSError, ValueError, struct.error):
+        pass
+    
+    METRICS.count('dictionary_cache_misses')
+    with open(dict_file, 'rb') as f:
+        raw = f.read()
+    if digest is None:
+        digest = hashlib.sha1(raw).digest()
+    dictionary = json.loads(raw.decode('utf-8'))
+    if not all(isinstance(char, str) and len(char) == 1 and isinstance(pinyin, str) and pinyin
+               for char, pinyin in dictionary.items()):
+        return dictionary
+    
+    compiled = CompiledDictionary.from_dict(dictionary)
+    _write_compiled_dictionary(cache_file, compiled, stat, digest)
+    return compiled
+
+def read_dictionary(dict_file: str) -> Mapping:
+    """加载字典（自动使用编译缓存），不修改全局字典；失败时返回空字典"""
+    if not os.path.exists(dict_file):
+        print(f"字典文件不存在: {dict_file}")
+        return {}
+    try:
+        with METRICS.phase('load_dictionary'):
+            dictionary = load_compiled_dictionary(dict_file)
+        print(f"已加载字典文件: {dict_file}")
+        print(f"字典中包含 {len(dictionary)} 个字符")
+        return dictionary
+    except Exception as e:
+        print(f"加载字典文件失败: {e}")
+        return {}
+
+def paths_overlap(path_a: str, path_b: str) -> bool:
+    """两个路径是否相同或一个包含另一个"""
+    path_a = os.path.join(os.path.realpath(path_a), '')
+    path_b = os.path.join(os.path.realpath(path_b), '')
+    return path_a.startswith(path_b) or path_b.startswith(path_a)
+
+class PlanEntry(NamedTuple):
+    """重命名计划中的一个条目"""
+    rel_path: str       # 相对目标文件夹的路径
+    name: str           # 原名称
+    is_dir: bool
+    depth: int          # 相对目标文件夹的深度，直接子项为 0
+    new_name: str       # 执行重命名时使用的新名称（名称本身不含中文时与原名称相同）
+    new_rel_path: str   # 预览日志中显示的标准化后的相对路径
+
+class RenamePlan:
+    """
+    一次扫描目标文件夹得到的重命名计划
+    只保存相对路径中含中文的条目，预览和执行都使用它，不再重复遍历磁盘
+    """
+
+    def __init__(self, target_path: str):
+        self.target_path = target_path
+        self.entries = []          # type: List[PlanEntry]
+        self.missing_chars = set()
+
+    @property
+    def folder_renames(self) -> List[Tuple[str, str]]:
+        return [(entry.rel_path, entry.new_rel_path) for entry in self.entries
+                if entry.is_dir and entry.rel_path != entry.new_rel_path]
+
+    @property
+    def file_renames(self) -> List[Tuple[str, str]]:
+        return [(entry.rel_path, entry.new_rel_path) for entry in self.entries
+                if not entry.is_dir and entry.rel_path != entry.new_rel_path]
+
+# 增量模式的文件状态索引
+INDEX_VERSION = 1
+
+def file_digest(file_path: str) -> str:
+    """计算文件内容的 SHA-1"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FileStateIndex:
+    """
+    持久化的文件状态索引，供 rename.py 和 fix_rpy.py 的增量模式使用
+    trees: 每个目标文件夹下各文件夹的修改时间和子文件夹列表，以及其中的文件名是否都无需处理
+    rpy:   每个RPY文件的大小、修改时间、内容哈希和上次扫描结果
+    refs:  每个RPY文件中资源路径字符串所在的行（见 fix_rpy.AssetRefIndex）
+    """
+
+    def __init__(self, index_file: Optional[str] = None):
+        self.index_file = index_file
+        self.data = {'version': INDEX_VERSION, 'trees': {}, 'rpy': {}}
+        if index_file and os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self.data = data
+                else:
+                    print(f"索引文件版本不匹配，将重新建立: {index_file}")
+            except Exception as e:
+                print(f"读取索引文件失败，将重新建立: {e}")
+
+    def tree(self, target_path: str) -> dict:
+        """某个目标文件夹的文件夹索引（相对路径 -> 记录）"""
+        return self.data['trees'].setdefault(os.path.abspath(target_path), {})
+
+    def section(self, name: str) -> dict:
+        return self.data.setdefault(name, {})
+
+    def save(self):
+        """保存索引（先写临时文件再替换）"""
+        if not self.index_file:
+            return
+        try:
+            with atomic_write(self.index_file) as f:
+                json.dump(self.data, f, ensure_ascii=False, separators=(',', ':'))
+        except Exception as e:
+            print(f"保存索引文件失败: {e}")
+
+# 重命名计划文件（JSONL）：第一行是带版本号的文件头，之后每行一条记录，最后一行是汇总记录
+PLAN_FORMAT = 'cn2en-rename-plan'
+PLAN_VERSION = 1
+
+def entry_to_record(entry: PlanEntry) -> dict:
+    # "type" 放在第一个键，读取时可以只看行首就跳过不需要的记录
+    return {
+        'type': 'folder' if entry.is_dir else 'file',
+        'old': entry.rel_path,
+        'new': entry.new_rel_path,
+        'name': entry.name,
+        'new_name': entry.new_name,
+        'depth': entry.depth,
+    }
+
+def record_to_entry(record: dict) -> PlanEntry:
+    return PlanEntry(record['old'], record['name'], record['type'] == 'folder',
+                     record['depth'], record['new_name'], record['new'])
+
+class PlanWriter:
+    """流式写入重命名计划文件"""
+
+    def __init__(self, plan_file: str, target_path: str):
+        self.plan_file = plan_file
+        self.f = open(plan_file, 'w', encoding='utf-8')
+        self.folder_renames = 0
+        self.file_renames = 0
+        self._write({'format': PLAN_FORMAT, 'version': PLAN_VERSION,
+                     'target': os.path.abspath(target_path)})
+
+    def _write(self, record: dict):
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def write(self, entry: PlanEntry):
+        if entry.rel_path != entry.new_rel_path:
+            if entry.is_dir:
+                self.folder_renames += 1
+            else:
+                self.file_renames += 1
+        self._write(entry_to_record(entry))
+
+    def close(self, missing_chars, missing_counts: Optional[Dict[str, int]] = None):
+        summary = {'type': 'end', 'folders': self.folder_renames,
+                   'files': self.file_renames, 'missing_chars': sorted(missing_chars)}
+        if missing_counts is not None:
+            summary['missing_counts'] = missing_counts
+        self._write(summary)
+        self.f.close()
+
+def write_plan_file(plan: RenamePlan, plan_file: str):
+    """把内存中的重命名计划写入计划文件（先文件夹后文件）"""
+    writer = PlanWriter(plan_file, plan.target_path)
+    try:
+        for entry in plan.entries:
+            if entry.is_dir:
+                writer.write(entry)
+        for entry in plan.entries:
+            if not entry.is_dir:
+                writer.write(entry)
+    finally:
+        writer.close(plan.missing_chars)
+
+def read_plan_header(f) -> dict:
+    """读取并检查计划文件头"""
+    header = json.loads(f.readline())
+    if header.get('format') != PLAN_FORMAT:
+        raise ValueError("不是重命名计划文件")
+    if header.get('version') != PLAN_VERSION:
+        raise ValueError(f"不支持的重命名计划文件版本: {header.get('version')}")
+    return header
+
+def iter_plan_file(plan_file: str, record_type: Optional[str] = None):
+    """
+    逐行读取计划文件中的记录，不把整个文件读入内存
+    指定 record_type（'folder' 或 'file'）时，其它类型的行不做 JSON 解析
+    """
+    prefix = json.dumps({'type': record_type})[:-1] if record_type else None
+    with open(plan_file, 'r', encoding='utf-8') as f:
+        read_plan_header(f)
+        for line in f:
+            if prefix is not None and not line.startswith(prefix):
+                continue
+            record = json.loads(line)
+            if record['type'] == 'end':
+                break
+            yield record
+
+def read_plan_summary(plan_file: str) -> dict:
+    """读取计划文件末尾的汇总记录（只读取文件末尾）"""
+    with open(plan_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = 4096
+        while True:
+            start = max(0, size - block)
+            f.seek(start)
+            tail = f.read()
+            lines = tail.rstrip(b'\n').rsplit(b'\n', 1)
+            if len(lines) == 2 or start == 0:
+                break
+            block *= 2
+    summary = json.loads(lines[-1].decode('utf-8'))
+    if summary.get('type') != 'end':
+        raise ValueError("重命名计划文件不完整")
+    return summary
+
+def load_plan_file(plan_file: str) -> RenamePlan:
+    """从计划文件恢复重命名计划"""
+    with open(plan_file, 'r', encoding='utf-8') as f:
+        header = read_plan_header(f)
+    plan = RenamePlan(header['target'])
+    plan.entries = [record_to_entry(record) for record in iter_plan_file(plan_file)]
+    plan.missing_chars = set(read_plan_summary(plan_file)['missing_chars'])
+    return plan
+
+# 执行日志：记录已完成的重命名和RPY改写，用于中断后继续执行和回滚
+JOURNAL_FORMAT = 'cn2en-journal'
+JOURNAL_VERSION = 1
+JOURNAL_DIR = "cn2en_journal"
+
+class Journal:
+    """
+    追加写入的执行日志（JSONL），保存在单独的文件夹中，同一文件夹中还保存本次执行的计划、RPY更新映射和RPY文件备份，
+    继续执行和回滚只需要这个文件夹，不再重新扫描目标文件夹
+
+    每条记录写入后立即 flush，进程被中断也不会丢失；每 sync_every 条或每 sync_interval 秒 fsync 一次，
+    断电时最多丢失最后一批记录（继续执行时这些条目会被识别为已完成）
+    可以在多个线程中同时写入
+    """
+    JOURNAL_NAME = 'journal.jsonl'
+    PLAN_NAME = 'plan.jsonl'
+    MAPPING_NAME = 'rpy_mapping.json'
+    BACKUP_DIR = 'backup'
+
+    def __init__(self, journal_dir: str, sync_every: int = 256, sync_interval: float = 1.0):
+        self.journal_dir = journal_dir
+        self.path = os.path.join(journal_dir, self.JOURNAL_NAME)
+        self.plan_file = os.path.join(journal_dir, self.PLAN_NAME)
+        self.mapping_file = os.path.join(journal_dir, self.MAPPING_NAME)
+        self.backup_dir = os.path.join(journal_dir, self.BACKUP_DIR)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.f = None
+        self.unsynced = 0
+        self.last_sync = time.perf_counter()
+
+    @classmethod
+    def create(cls, journal_dir: str, target_path: Optional[str], rpy_path: Optional[str] = None) -> 'Journal':
+        """开始新的执行日志，清除上一次（已完成的）日志和备份"""
+        journal = cls(journal_dir)
+        os.makedirs(journal_dir, exist_ok=True)
+        for path in (journal.path, journal.plan_file, journal.mapping_file):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(journal.backup_dir, ignore_errors=True)
+        os.makedirs(journal.backup_dir)
+        journal.f = open(journal.path, 'w', encoding='utf-8')
+        journal.record({'format': JOURNAL_FORMAT, 'version': JOURNAL_VERSION, 'cwd': os.getcwd(),
+                        'target': os.path.abspath(target_path) if target_path else None,
+                        'rpy': os.path.abspath(rpy_path) if rpy_path else None})
+        journal.sync()
+        return journal
+
+    @classmethod
+    def reopen(cls, journal_dir: str) -> 'Journal':
+        """打开已有的执行日志继续追加"""
+        journal = cls(journal_dir)
+        journal.f = open(journal.path, 'a', encoding='utf-8')
+        return journal
+
+    def record(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or time.perf_counter() - self.last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        with METRICS.phase('journal_fsync'):
+            os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.last_sync = time.perf_counter()
+
+    def sync(self):
+        with self.lock:
+            self.f.flush()
+            self._sync()
+
+    def backup(self, file_path: str):
+        """
+        改写文件前保存原文件（优先用硬链接，原文件随后被整体替换，硬链接保留的就是原内容）
+        同一文件只备份一次，继续执行时不会用改写过的内容覆盖备份
+        """
+        path = os.path.abspath(file_path)
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + '_' + os.path.basename(path)
+        backup_path = os.path.join(self.backup_dir, name)
+        if os.path.exists(backup_path):
+            return
+        try:
+            os.link(path, backup_path)
+        except OSError:
+            shutil.copy2(path, backup_path)
+        self.record({'op': 'backup', 'path': path, 'backup': name})
+
+    def close(self, complete: bool = False):
+        """关闭执行日志，complete 时记录本次执行已全部完成"""
+        if complete:
+            self.record({'op': 'end'})
+        self.sync()
+        self.f.close()
+
+def read_journal(journal_dir: str) -> Optional[dict]:
+    """
+    读取执行日志，返回状态：文件头、已完成的重命名记录（原相对路径到记录，按完成顺序）、已改写的RPY文件、
+    RPY备份、是否已全部完成；回滚时已撤销的重命名和已恢复的RPY文件不再计入
+    没有执行日志时返回 None；最后一行不完整（写入时被中断）时忽略它
+    """
+    journal_file = os.path.join(journal_dir, Journal.JOURNAL_NAME)
+    if not os.path.exists(journal_file):
+        return None
+    state = {'header': None, 'renames': {}, 'rewritten': set(), 'backups': {}, 'complete': False}
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if state['header'] is None:
+                if record.get('format') != JOURNAL_FORMAT:
+                    raise ValueError("不是执行日志文件")
+                if record.get('version') != JOURNAL_VERSION:
+                    raise ValueError(f"不支持的执行日志版本: {record.get('version')}")
+                state['header'] = record
+                continue
+            op = record['op']
+            if op == 'rename':
+                # 撤销后再次执行的重命名排在最后
+                state['renames'].pop(record['path'], None)
+                state['renames'][record['path']] = record
+            elif op == 'rpy':
+                state['rewritten'].add(record['path'])
+            elif op == 'backup':
+                state['backups'][record['path']] = record['backup']
+            elif op == 'undo':
+                state['renames'].pop(record['path'], None)
+            elif op == 'restore':
+                state['backups'].pop(record['path'], None)
+                state['rewritten'].discard(record['path'])
+            elif op == 'end':
+                state['complete'] = True
+    if state['header'] is None:
+        return None
+    return state
+
+def check_journal(journal_dir: Optional[str]) -> bool:
+    """开始新的执行前检查：上一次执行没有完成时提示继续执行或回滚，返回 False"""
+    if not journal_dir:
+        return True
+    try:
+        state = read_journal(journal_dir)
+    except Exception as e:
+        print(f"读取执行日志失败: {e}")
+        return False
+    if state is not None and not state['complete']:
+        print(f"错误：上一次执行没有完成（执行日志: {journal_dir}）")
+        print(f"请先运行 python rename.py --resume --journal {journal_dir} 继续执行，"
+              f"或运行 python rename.py --rollback --journal {journal_dir} 撤销已完成的操作")
+        return False
+    return True
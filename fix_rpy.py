@@ -6,28 +6,32 @@ RPY文件修复工具
 """
 
 import os
+import re
+import sys
+import asyncio
 import json
-from typing import Dict, List
+import mmap
+import heapq
+import shutil
+import hashlib
+import argparse
+import tempfile
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from common import (DICT_FILE, INDEX_FILE, JOURNAL_DIR, LOG_FILE, METRICS, PLAN_FILE, FileStateIndex, Journal,
+                    check_journal, file_digest, iter_plan_file, read_dictionary, run_instrumented)
 
 # 全局变量
 CHINESE_TO_PINYIN = {}
 
-def load_dictionary(dict_file: str) -> Dict[str, str]:
-    """从JSON文件加载字典"""
+def load_dictionary(dict_file: str) -> Mapping:
+    """加载字典到全局变量（自动使用编译缓存）"""
     global CHINESE_TO_PINYIN
-    if os.path.exists(dict_file):
-        try:
-            with open(dict_file, 'r', encoding='utf-8') as f:
-                CHINESE_TO_PINYIN = json.load(f)
-                print(f"已加载字典文件: {dict_file}")
-                print(f"字典中包含 {len(CHINESE_TO_PINYIN)} 个字符")
-                return CHINESE_TO_PINYIN
-        except Exception as e:
-            print(f"加载字典文件失败: {e}")
-            CHINESE_TO_PINYIN = {}
-    else:
-        print(f"字典文件不存在: {dict_file}")
-        CHINESE_TO_PINYIN = {}
+    CHINESE_TO_PINYIN = read_dictionary(dict_file)
     return CHINESE_TO_PINYIN
 
 def extract_chinese_characters(text: str) -> set:
@@ -64,78 +68,694 @@ def load_rename_mapping_from_log(log_file: str) -> Dict[str, str]:
         print(f"读取重命名日志文件失败: {e}")
         return mapping
 
+def load_rename_mapping_from_plan(plan_file: str) -> Dict[str, str]:
+    """从重命名计划文件中流式加载文件重命名映射，只解析文件记录"""
+    mapping = {}
+    
+    try:
+        for record in iter_plan_file(plan_file, 'file'):
+            if record['old'] != record['new']:
+                mapping[record['old']] = record['new']
+        print(f"从计划文件加载了 {len(mapping)} 个重命名映射")
+    except Exception as e:
+        print(f"读取重命名计划文件失败: {e}")
+    return mapping
+
+def load_rename_mapping(log_file: Optional[str], plan_file: Optional[str] = None) -> Dict[str, str]:
+    """加载文件重命名映射：优先使用计划文件，没有时再解析重命名日志"""
+    if plan_file and os.path.exists(plan_file):
+        return load_rename_mapping_from_plan(plan_file)
+    if not log_file:
+        return {}
+    return load_rename_mapping_from_log(log_file)
+
 def normalize_text(text: str) -> str:
     """
     已弃用：现在使用重命名日志文件中的映射关系
     """
     return text
 
-def scan_rpy_files(rpy_path: str, rename_mapping: Dict[str, str]) -> Dict[str, List[str]]:
-    """扫描RPY文件，找出需要更新的文件引用"""
+# 字典树某一层的分支数超过该值时按字符范围二分
+BRANCH_SPLIT_SIZE = 8
+
+def build_trie_pattern(keys) -> str:
+    """
+    把所有关键字组织成字典树，再转换成等价的正则表达式
+    同一前缀只匹配一次，且较长的关键字优先于它的前缀
+    """
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[''] = True  # 关键字结束标记
+
+    def branch_to_pattern(children: list) -> str:
+        # 正则的分支是逐个尝试的，分支很多时按字符范围二分，
+        # 用前瞻先判断首字符落在哪一半，避免在每个位置尝试成千上万个分支
+        if len(children) <= BRANCH_SPLIT_SIZE:
+            return '|'.join(re.escape(char) + node_to_pattern(child)
+                            for char, child in children)
+        mid = len(children) // 2
+        left, right = children[:mid], children[mid:]
+        return '(?=[%s-%s])(?:%s)|(?:%s)' % (
+            re.escape(left[0][0]), re.escape(left[-1][0]),
+            branch_to_pattern(left), branch_to_pattern(right))
+
+    def node_to_pattern(node: dict) -> str:
+        is_end = '' in node
+        children = sorted(((char, child) for char, child in node.items() if char != ''),
+                          key=lambda item: item[0])
+        if not children:
+            return ''
+
+        # 所有分支都是到此结束的单个字符时合并成字符集，否则用分支
+        if len(children) > 1 and all(len(child) == 1 and '' in child for _, child in children):
+            pattern = '[' + ''.join(re.escape(char) for char, _ in children) + ']'
+        elif len(children) == 1:
+            char, child = children[0]
+            pattern = re.escape(char) + node_to_pattern(child)
+            if is_end:
+                pattern = '(?:' + pattern + ')'
+        else:
+            pattern = '(?:' + branch_to_pattern(children) + ')'
+
+        if is_end:
+            # 当前位置已构成一个关键字，更长的部分可选（贪婪匹配保证取最长）
+            pattern += '?'
+        return pattern
+
+    return node_to_pattern(trie)
+
+class RenameMatcher:
+    """
+    重命名映射的多模式匹配器
+    由映射一次性编译成 UTF-8 字节层面的字典树正则，每行只需线性扫描一遍即可找到并替换所有引用，
+    关键字互相重叠时取最长的那个
+    """
+
+    def __init__(self, rename_mapping: Dict[str, str]):
+        self.mapping = {key: value for key, value in rename_mapping.items() if key}
+        # 所有关键字都含非ASCII字符时，纯ASCII的内容不可能匹配
+        self.all_non_ascii = all(not key.isascii() for key in self.mapping)
+        self._bytes_pattern = None
+
+    @property
+    def empty(self) -> bool:
+        """映射为空时不会有任何匹配"""
+        return not self.mapping
+
+    @property
+    def bytes_pattern(self):
+        """
+        UTF-8 字节层面的字典树正则（首次用到时编译）
+        UTF-8 中每个字节层的分支最多只有几十个，整体编译成一个正则即可直接在字节上查找
+        """
+        if self._bytes_pattern is None:
+            # 用 latin-1 把每个字节映射成一个字符来构建字典树，再转换回字节正则
+            keys = [key.encode('utf-8').decode('latin-1') for key in self.mapping]
+            self.bytes_mapping = {key.encode('utf-8'): (key, value, value.encode('utf-8'))
+                                  for key, value in self.mapping.items()}
+            self._bytes_pattern = re.compile(build_trie_pattern(keys).encode('latin-1'))
+        return self._bytes_pattern
+
+    def _bytes_replacement(self, match) -> bytes:
+        return self.bytes_mapping[match.group()][2]
+
+    def replace_bytes(self, line: bytes) -> Tuple[bytes, int]:
+        """在字节层面替换一行中的所有引用，返回 (新行, 替换次数)"""
+        if self.empty:
+            return line, 0
+        return self.bytes_pattern.subn(self._bytes_replacement, line)
+
+    def search_bytes(self, data, pos: int = 0):
+        """在字节内容（bytes 或 mmap）中查找下一个引用，返回匹配对象或 None"""
+        if self.empty:
+            return None
+        return self.bytes_pattern.search(data, pos)
+
+def list_rpy_files(rpy_path: str) -> List[str]:
+    """按 os.walk 的顺序列出目录下所有RPY文件"""
+    rpy_files = []
+    for root, dirs, files in os.walk(rpy_path):
+        for file in files:
+            if file.endswith('.rpy'):
+                rpy_files.append(os.path.join(root, file))
+    return rpy_files
+
+# 不小于该大小的文件使用 mmap 读取
+MMAP_THRESHOLD = 1024 * 1024
+# 非ASCII字节
+NON_ASCII_PATTERN = re.compile(b'[\x80-\xff]')
+
+def _count_newlines(data, start: int, end: int) -> int:
+    if isinstance(data, bytes):
+        return data.count(b'\n', start, end)
+    # mmap 没有 count 方法，只能复制这一段
+    return data[start:end].count(b'\n')
+
+@contextmanager
+def read_rpy_data(file_path: str):
+    """
+    按字节读取RPY文件，产生 (内容, 文件状态)；大文件用 mmap，退出时关闭
+    内容可以直接用于正则匹配和计算哈希
+    """
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            data = b''
+        elif stat.st_size >= MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+    try:
+        yield data, stat
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+def scan_rpy_file(file_path: str, matcher: RenameMatcher, state: Optional[dict] = None,
+                  stats: Optional[Dict[str, int]] = None) -> Optional[dict]:
+    """
+    扫描单个RPY文件，返回修改摘要：{'lines': [行号], 'replacements': [[原引用, 新引用, 次数]]}，
+    没有需要更新的引用时返回 None
+    文件按字节读取（大文件用 mmap），不含非ASCII字节或不含任何关键字的文件直接跳过，
+    匹配全部在字节层面完成，不做解码
+    提供 state 时填入文件的大小、修改时间、内容哈希和是否纯ASCII，供增量索引使用；
+    提供 stats 时累加读取的字节数和跳过的纯ASCII文件数
+    """
+    with read_rpy_data(file_path) as (data, stat):
+        size = stat.st_size
+        if stats is not None:
+            stats['rpy_bytes_read'] = stats.get('rpy_bytes_read', 0) + size
+        
+        ascii_only = None
+        if state is not None:
+            ascii_only = NON_ASCII_PATTERN.search(data) is None
+            state.update({
+                'size': size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha1': hashlib.sha1(data).hexdigest(),
+                'ascii_only': ascii_only,
+            })
+        if not data:
+            return None
+        if matcher.all_non_ascii:
+            if ascii_only is None:
+                ascii_only = NON_ASCII_PATTERN.search(data) is None
+            if ascii_only:
+                if stats is not None:
+                    stats['rpy_ascii_skipped'] = stats.get('rpy_ascii_skipped', 0) + 1
+                return None
+        
+        # 只记录紧凑的修改摘要：涉及的行号，以及每个被替换的引用和次数
+        lines = []
+        replacements = {}
+        bytes_pattern = None if matcher.empty else matcher.bytes_pattern
+        line_num = 1
+        counted = 0
+        pos = 0
+        while True:
+            found = matcher.search_bytes(data, pos)
+            if found is None:
+                break
+            
+            # 定位匹配所在的行并计算行号
+            line_start = data.rfind(b'\n', 0, found.start()) + 1
+            line_end = data.find(b'\n', found.end())
+            if line_end == -1:
+                line_end = len(data)
+            line_num += _count_newlines(data, counted, line_start)
+            counted = line_start
+            
+            lines.append(line_num)
+            for match in bytes_pattern.finditer(data, found.start(), line_end):
+                old_name, new_name, _ = matcher.bytes_mapping[match.group()]
+                if old_name in replacements:
+                    replacements[old_name][2] += 1
+                else:
+                    replacements[old_name] = [old_name, new_name, 1]
+            pos = line_end + 1
+        
+        if not lines:
+            return None
+        return {'lines': lines, 'replacements': list(replacements.values())}
+
+def mapping_digest(rename_mapping: Dict[str, str]) -> str:
+    """重命名映射的摘要，映射不变时摘要不变"""
+    digest = hashlib.sha1()
+    for old_name, new_name in sorted(rename_mapping.items()):
+        digest.update(old_name.encode('utf-8') + b'\0' + new_name.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+def file_changed(file_path: str, record: dict) -> bool:
+    """文件的大小或内容与索引记录不同时返回 True；只有修改时间变了时更新记录中的修改时间"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return True
+    if stat.st_size != record['size']:
+        return True
+    if stat.st_mtime_ns != record['mtime_ns']:
+        # 修改时间变了但内容可能没变
+        if file_digest(file_path) != record['sha1']:
+            return True
+        record['mtime_ns'] = stat.st_mtime_ns
+    return False
+
+class RpyScanIndex:
+    """
+    RPY文件的增量扫描索引，保存在 FileStateIndex 的 rpy 部分
+    每个文件记录大小、修改时间、SHA-1、是否纯ASCII、上次是否有需要更新的行，以及上次扫描所用映射的摘要
+    内容未变的文件，如果是纯ASCII，或者上次用同一映射扫描时没有需要更新的行，则直接跳过
+    """
+
+    def __init__(self, index: FileStateIndex, rename_mapping: Dict[str, str]):
+        self.files = index.section('rpy')
+        self.mapping_digest = mapping_digest(rename_mapping)
+
+    def needs_scan(self, file_path: str, all_non_ascii: bool) -> bool:
+        record = self.files.get(file_path)
+        if record is None or record['updates'] or file_changed(file_path, record):
+            return True
+        if record['ascii_only'] and all_non_ascii:
+            return False
+        return record['mapping'] != self.mapping_digest
+
+    def record(self, file_path: str, state: dict, updates):
+        self.files[file_path] = dict(state, updates=bool(updates), mapping=self.mapping_digest)
+
+    def prune(self, rpy_path: str, rpy_files: List[str]):
+        """删除该目录下已经不存在的文件的记录"""
+        prefix = os.path.join(rpy_path, '')
+        existing = set(rpy_files)
+        for file_path in [path for path in self.files if path.startswith(prefix) and path not in existing]:
+            del self.files[file_path]
+
+# 资源引用索引记录的文件类型：以这些扩展名结尾的字符串视为资源路径
+ASSET_EXTENSIONS = frozenset([
+    'png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp', 'avif', 'svg',
+    'ogg', 'opus', 'mp3', 'wav', 'flac', 'm4a',
+    'webm', 'mp4', 'mkv', 'ogv', 'avi',
+    'ttf', 'otf', 'ttc', 'woff', 'woff2',
+    'json', 'txt', 'csv', 'yaml', 'yml', 'xml', 'atl', 'live2d', 'moc3',
+])
+# 单行的字符串字面量和注释；注释也作为记号匹配，其中的引号不会被当成字符串
+# 字符串内容写成展开的循环形式（普通字符连续匹配，转义字符单独处理），比逐字符选择快得多
+RPY_TOKEN_PATTERN = re.compile(rb'#[^\n]*|"([^"\\\n]*(?:\\.[^"\\\n]*)*)"|\'([^\'\\\n]*(?:\\.[^\'\\\n]*)*)\'')
+# 检查资源是否存在时依次尝试的子文件夹（Ren'Py 也会在 images 和 audio 中查找）
+RENPY_SEARCH_DIRS = ('', 'images', 'audio')
+
+def is_asset_path(path: str) -> bool:
+    """路径是否以已知的资源扩展名结尾"""
+    base, dot, extension = path.rpartition('.')
+    return bool(base) and extension.lower() in ASSET_EXTENSIONS
+
+def asset_literal_group(token) -> int:
+    """
+    RPY_TOKEN_PATTERN 的匹配是以资源扩展名结尾的字符串字面量时返回内容所在的分组号，否则返回 0
+    （注释、空字符串和其它字符串）
+    """
+    group = 1 if token.group(1) is not None else 2
+    literal = token.group(group)
+    if not literal:
+        return 0
+    base, dot, extension = literal.rpartition(b'.')
+    if not base or extension.lower().decode('ascii', 'replace') not in ASSET_EXTENSIONS:
+        return 0
+    return group
+
+def scan_asset_refs(file_path: str) -> Tuple[dict, List[list]]:
+    """
+    解析单个RPY文件中的字符串字面量，返回 (文件状态, [[行号, 资源路径], ...])
+    只遍历一遍字节内容，跳过注释，以已知资源扩展名结尾的字符串才会记录
+    """
+    with read_rpy_data(file_path) as (data, stat):
+        METRICS.count('rpy_bytes_read', stat.st_size)
+        state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': hashlib.sha1(data).hexdigest()}
+        refs = []
+        line_num = 1
+        counted = 0
+        for token in RPY_TOKEN_PATTERN.finditer(data):
+            group = asset_literal_group(token)
+            if not group:
+                continue
+            line_num += _count_newlines(data, counted, token.start())
+            counted = token.start()
+            refs.append([line_num, token.group(group).decode('utf-8', 'replace')])
+        return state, refs
+
+def replace_asset_literals(line: bytes, matcher: RenameMatcher) -> Tuple[bytes, int]:
+    """
+    只替换一行中以资源扩展名结尾的字符串字面量（即资源引用索引记录的字符串）里的引用，
+    注释和其它部分原样保留，返回 (新的行, 替换次数)
+    """
+    pieces = []
+    pos = 0
+    total = 0
+    for token in RPY_TOKEN_PATTERN.finditer(line):
+        group = asset_literal_group(token)
+        if not group:
+            continue
+        new_literal, count = matcher.replace_bytes(token.group(group))
+        if count:
+            pieces.append(line[pos:token.start(group)])
+            pieces.append(new_literal)
+            pos = token.end(group)
+            total += count
+    if not total:
+        return line, 0
+    pieces.append(line[pos:])
+    return b''.join(pieces), total
+
+class AssetRefIndex:
+    """
+    资源引用索引，保存在 FileStateIndex 的 refs 部分
+    每个RPY文件记录大小、修改时间、SHA-1，以及其中每个资源路径字符串所在的行号；
+    内容未变的文件不再读取。重命名时只检查记录的字符串，
+    查询某个文件在哪里被引用、哪些引用的资源不存在时也不需要扫描RPY文件
+    """
+
+    def __init__(self, index: FileStateIndex):
+        self.index = index
+        self.files = index.section('refs')
+        self._by_asset = None
+
+    @classmethod
+    def open(cls, refs_file: Optional[str], index: Optional[FileStateIndex] = None) -> Optional['AssetRefIndex']:
+        """打开保存在 refs_file 中的资源引用索引；与增量索引是同一个文件时共用 index"""
+        if not refs_file:
+            return None
+        if index is None or os.path.abspath(index.index_file) != os.path.abspath(refs_file):
+            index = FileStateIndex(refs_file)
+        return cls(index)
+
+    def refresh(self, rpy_path: str) -> List[str]:
+        """重新解析该目录下新增或有变化的RPY文件，删除已不存在的文件的记录，返回全部RPY文件"""
+        rpy_files = list_rpy_files(rpy_path)
+        prefix = os.path.join(rpy_path, '')
+        existing = set(rpy_files)
+        stale = [path for path in self.files if path.startswith(prefix) and path not in existing]
+        for file_path in stale:
+            del self.files[file_path]
+        
+        parsed = 0
+        for file_path in rpy_files:
+            record = self.files.get(file_path)
+            if record is not None and not file_changed(file_path, record):
+                continue
+            try:
+                state, refs = scan_asset_refs(file_path)
+            except Exception as e:
+                print(f"读取文件失败: {file_path}, 错误: {e}")
+                self.files.pop(file_path, None)
+                continue
+            self.files[file_path] = dict(state, refs=refs)
+            parsed += 1
+        if stale or parsed:
+            self._by_asset = None
+        METRICS.count('rpy_files_listed', len(rpy_files))
+        METRICS.count('rpy_refs_parsed', parsed)
+        print(f"资源引用索引：{len(rpy_files)} 个RPY文件中重新解析了 {parsed} 个")
+        return rpy_files
+
+    def updates(self, file_path: str, matcher: RenameMatcher) -> Optional[dict]:
+        """
+        由记录的资源路径得到文件的修改摘要（格式同 scan_rpy_file），不读取文件
+        摘要带有 refs_only 标记，改写时只替换记录的行
+        """
+        record = self.files.get(file_path)
+        if record is None or matcher.empty:
+            return None
+        lines = []
+        replacements = {}
+        for line_num, literal in record['refs']:
+            if matcher.all_non_ascii and literal.isascii():
+                continue
+            for match in matcher.bytes_pattern.finditer(literal.encode('utf-8')):
+                old_name, new_name, _ = matcher.bytes_mapping[match.group()]
+                if old_name in replacements:
+                    replacements[old_name][2] += 1
+                else:
+                    replacements[old_name] = [old_name, new_name, 1]
+                if not lines or lines[-1] != line_num:
+                    lines.append(line_num)
+        if not lines:
+            return None
+        return {'lines': lines, 'replacements': list(replacements.values()), 'refs_only': True}
+
+    @property
+    def by_asset(self) -> Dict[str, List[Tuple[str, int]]]:
+        """资源路径 -> [(RPY文件, 行号)]，首次用到时由各文件的记录建立"""
+        if self._by_asset is None:
+            by_asset = {}
+            for file_path, record in self.files.items():
+                for line_num, literal in record['refs']:
+                    by_asset.setdefault(literal, []).append((file_path, line_num))
+            self._by_asset = by_asset
+        return self._by_asset
+
+    def where_used(self, asset_path: str) -> List[Tuple[str, str, int]]:
+        """
+        查找引用了 asset_path 的位置，返回 [(资源路径, RPY文件, 行号)]
+        RPY中的路径与 asset_path 相同或是它的结尾部分（例如 images/bg.png 与 game/images/bg.png）即视为引用
+        """
+        path = asset_path.replace(os.sep, '/')
+        candidates = [path] + [path[pos + 1:] for pos, char in enumerate(path) if char == '/']
+        found = []
+        for candidate in candidates:
+            for file_path, line_num in self.by_asset.get(candidate, ()):
+                found.append((candidate, file_path, line_num))
+        return found
+
+    def missing(self, game_dir: str) -> List[Tuple[str, List[Tuple[str, int]]]]:
+        """引用了但在 game_dir（及其 images、audio 子文件夹）中不存在的资源，返回 [(资源路径, 引用位置)]"""
+        missing = []
+        for literal, locations in sorted(self.by_asset.items()):
+            relative = literal.lstrip('/')
+            if not any(os.path.exists(os.path.join(game_dir, sub_dir, relative)) for sub_dir in RENPY_SEARCH_DIRS):
+                missing.append((literal, locations))
+        return missing
+
+# 并行扫描时每个工作进程持有的匹配器，由进程初始化函数构建一次
+_WORKER_MATCHER = None
+
+def _init_scan_worker(rename_mapping: Dict[str, str]):
+    global _WORKER_MATCHER
+    _WORKER_MATCHER = RenameMatcher(rename_mapping)
+
+def _scan_files(file_paths: List[str], matcher: RenameMatcher, with_state: bool = False):
+    """扫描一组文件，返回 ((文件路径, 更新, 错误信息, 文件状态) 列表, 计数器)"""
+    results = []
+    stats = {}
+    for file_path in file_paths:
+        state = {} if with_state else None
+        try:
+            results.append((file_path, scan_rpy_file(file_path, matcher, state, stats), None, state))
+        except Exception as e:
+            results.append((file_path, None, str(e), None))
+    return results, stats
+
+def _scan_one(file_path: str, matcher: RenameMatcher, with_state: bool = False):
+    """扫描单个文件，返回 ((文件路径, 更新, 错误信息, 文件状态), 计数器)，供异步流水线在线程中调用"""
+    results, stats = _scan_files([file_path], matcher, with_state)
+    return results[0], stats
+
+def run_ordered(func, arg_list, in_flight: int, consume):
+    """
+    异步流水线：用 asyncio 事件循环把 func 放到线程池中执行，同时最多 in_flight 个，
+    结果按输入顺序交给 consume。已完成但还没轮到的结果也计入 in_flight，
+    最早的任务没有完成时不再提交新任务，因此内存占用有上限，输出顺序也是确定的
+    """
+    async def pipeline(loop, executor):
+        pending = deque()
+        for args in arg_list:
+            if len(pending) >= in_flight:
+                consume(await pending.popleft())
+            pending.append(loop.run_in_executor(executor, func, *args))
+        while pending:
+            consume(await pending.popleft())
+    
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=in_flight) as executor:
+            loop.run_until_complete(pipeline(loop, executor))
+    finally:
+        loop.close()
+
+def _scan_chunk(file_paths: List[str], with_state: bool = False):
+    """在工作进程中扫描一组文件"""
+    return _scan_files(file_paths, _WORKER_MATCHER, with_state)
+
+def split_by_size(file_paths: List[str], chunk_count: int) -> List[List[str]]:
+    """按文件大小把文件分成总大小尽量均衡的若干组"""
+    def file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    
+    chunks = [(0, index, []) for index in range(chunk_count)]
+    # 从大到小依次放进当前总大小最小的一组
+    for size, path in sorted(((file_size(path), path) for path in file_paths), reverse=True):
+        total, index, chunk = heapq.heappop(chunks)
+        chunk.append(path)
+        heapq.heappush(chunks, (total + size, index, chunk))
+    return [chunk for _, _, chunk in sorted(chunks, key=lambda item: item[1]) if chunk]
+
+# 文件数少于该值时不启用多进程
+PARALLEL_MIN_FILES = 8
+# 每个工作进程分到的任务组数，多分几组便于负载均衡
+CHUNKS_PER_WORKER = 4
+
+def scan_rpy_files(rpy_path: str, rename_mapping: Dict[str, str],
+                   workers: Optional[int] = 1,
+                   index: Optional[FileStateIndex] = None,
+                   in_flight: int = 0, refs: Optional[AssetRefIndex] = None) -> Dict[str, dict]:
+    """
+    扫描RPY文件，找出需要更新的文件引用，返回 文件路径 -> 修改摘要
+    workers 大于 1 时使用多进程并行扫描（None 表示使用全部CPU），结果与串行扫描完全相同
+    in_flight 大于 0 时改用异步流水线，同时读取和匹配最多 in_flight 个文件，适合网络存储
+    提供 index 时为增量模式，内容未变且上次扫描后不会受影响的文件直接跳过
+    提供 refs 时改用资源引用索引，只检查记录的资源路径字符串（见 scan_rpy_refs）
+    """
     rpy_updates = {}
     
     if not os.path.exists(rpy_path):
         print(f"RPY路径不存在: {rpy_path}")
         return rpy_updates
     
-    for root, dirs, files in os.walk(rpy_path):
-        for file in files:
-            if file.endswith('.rpy'):
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                    
-                    updates = []
-                    for line_num, line in enumerate(lines, 1):
-                        # 直接在每一行中查找需要替换的文件名
-                        updated_line = line
-                        line_changed = False
-                        
-                        for old_filename, new_filename in rename_mapping.items():
-                            if old_filename in line:
-                                updated_line = updated_line.replace(old_filename, new_filename)
-                                line_changed = True
-                        
-                        if line_changed:
-                            updates.append({
-                                'line_num': line_num,
-                                'old_line': line.strip(),
-                                'new_line': updated_line.strip()
-                            })
-                    
-                    if updates:
-                        rpy_updates[file_path] = updates
-                        
-                except Exception as e:
-                    print(f"读取文件失败: {file_path}, 错误: {e}")
+    if refs is not None:
+        unknown = [key for key in rename_mapping if not is_asset_path(key)]
+        if not unknown:
+            return scan_rpy_refs(rpy_path, rename_mapping, refs)
+        print(f"有 {len(unknown)} 个重命名的文件不是已知的资源类型（例如 {unknown[0]}），改为完整扫描")
+    
+    rpy_files = list_rpy_files(rpy_path)
+    matcher = RenameMatcher(rename_mapping)
+    
+    scan_index = None
+    scan_files = rpy_files
+    if index is not None:
+        scan_index = RpyScanIndex(index, rename_mapping)
+        scan_index.prune(rpy_path, rpy_files)
+        scan_files = [file_path for file_path in rpy_files
+                      if scan_index.needs_scan(file_path, matcher.all_non_ascii)]
+        print(f"增量模式：{len(rpy_files)} 个RPY文件中有 {len(rpy_files) - len(scan_files)} 个无需扫描")
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    METRICS.count('rpy_files_listed', len(rpy_files))
+    METRICS.count('rpy_files_scanned', len(scan_files))
     
+    with_state = scan_index is not None
+    if in_flight > 0:
+        results = []
+        
+        def collect(scanned):
+            result, stats = scanned
+            results.append(result)
+            METRICS.merge(stats)
+        
+        run_ordered(_scan_one, [(file_path, matcher, with_state) for file_path in scan_files],
+                    in_flight, collect)
+    elif workers <= 1 or len(scan_files) < PARALLEL_MIN_FILES:
+        results, stats = _scan_files(scan_files, matcher, with_state)
+        METRICS.merge(stats)
+    else:
+        # 映射通过进程初始化函数只发送给每个工作进程一次
+        chunks = split_by_size(scan_files, workers * CHUNKS_PER_WORKER)
+        scanned = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker,
+                                 initargs=(rename_mapping,)) as executor:
+            for chunk_results, stats in executor.map(_scan_chunk, chunks, [with_state] * len(chunks)):
+                METRICS.merge(stats)
+                for result in chunk_results:
+                    scanned[result[0]] = result
+        # 按串行扫描的顺序合并结果
+        results = [scanned[file_path] for file_path in scan_files]
+    
+    for file_path, updates, error, state in results:
+        if error is not None:
+            print(f"读取文件失败: {file_path}, 错误: {error}")
+            continue
+        if scan_index is not None:
+            scan_index.record(file_path, state, updates)
+        if updates:
+            rpy_updates[file_path] = updates
+            METRICS.count('rpy_lines_matched', len(updates['lines']))
+            METRICS.count('rpy_replacements_found', sum(count for _, _, count in updates['replacements']))
+    
+    return rpy_updates
+
+def scan_rpy_refs(rpy_path: str, rename_mapping: Dict[str, str], refs: AssetRefIndex) -> Dict[str, dict]:
+    """
+    用资源引用索引找出需要更新的文件引用，返回 文件路径 -> 修改摘要
+    只重新解析有变化的RPY文件，其余文件直接使用记录的资源路径；
+    注释和字符串之外出现的名称不会被更新
+    """
+    rpy_updates = {}
+    with METRICS.phase('refresh_refs'):
+        rpy_files = refs.refresh(rpy_path)
+    matcher = RenameMatcher(rename_mapping)
+    for file_path in rpy_files:
+        updates = refs.updates(file_path, matcher)
+        if updates:
+            rpy_updates[file_path] = updates
+            METRICS.count('rpy_lines_matched', len(updates['lines']))
+            METRICS.count('rpy_replacements_found', sum(count for _, _, count in updates['replacements']))
     return rpy_updates
 
-def generate_rpy_mapping(rpy_path: str, mapping_file: str, log_file: str):
-    """生成RPY文件更新映射"""
-    # 从重命名日志文件加载映射
-    rename_mapping = load_rename_mapping_from_log(log_file)
+# RPY更新映射文件格式
+RPY_UPDATES_FORMAT = 'cn2en-rpy-updates'
+RPY_UPDATES_VERSION = 2
+
+def generate_rpy_mapping(rpy_path: str, mapping_file: str, log_file: str,
+                         workers: Optional[int] = 1, plan_file: Optional[str] = None,
+                         index: Optional[FileStateIndex] = None,
+                         in_flight: int = 0, refs: Optional[AssetRefIndex] = None) -> Optional[Dict[str, dict]]:
+    """
+    生成RPY文件更新映射，返回 文件路径 -> 修改摘要
+    没有需要更新的文件时返回空字典，保存失败时返回 None
+    """
+    # 从重命名计划文件（或日志文件）加载映射
+    with METRICS.phase('load_mapping'):
+        rename_mapping = load_rename_mapping(log_file, plan_file)
     
     if not rename_mapping:
         print("没有找到文件重命名映射")
-        return False
+        return {}
     
-    rpy_updates = scan_rpy_files(rpy_path, rename_mapping)
+    with METRICS.phase('scan_rpy'):
+        rpy_updates = scan_rpy_files(rpy_path, rename_mapping, workers, index, in_flight, refs)
     
     if not rpy_updates:
         print("未发现需要更新的RPY文件")
-        return False
+        return {}
     
-    # 保存映射到JSON文件
+    if not write_rpy_mapping(mapping_file, rpy_updates, plan_file, log_file):
+        return None
+    return rpy_updates
+
+def write_rpy_mapping(mapping_file: str, rpy_updates: Dict[str, dict], plan_file: Optional[str],
+                      log_file: Optional[str]) -> bool:
+    """保存修改摘要到JSON文件，同时记录重命名映射的来源，更新时据此重新加载映射"""
     try:
-        with open(mapping_file, 'w', encoding='utf-8') as f:
-            json.dump(rpy_updates, f, ensure_ascii=False, indent=2)
+        mapping_content = {
+            'format': RPY_UPDATES_FORMAT,
+            'version': RPY_UPDATES_VERSION,
+            'plan_file': os.path.abspath(plan_file) if plan_file and os.path.exists(plan_file) else None,
+            'log_file': os.path.abspath(log_file) if log_file else None,
+            'files': rpy_updates,
+        }
+        with METRICS.phase('write_mapping'), open(mapping_file, 'w', encoding='utf-8') as f:
+            json.dump(mapping_content, f, ensure_ascii=False, indent=2)
         print(f"RPY更新映射已保存到: {mapping_file}")
         
         # 显示统计信息
         total_files = len(rpy_updates)
-        total_lines = sum(len(updates) for updates in rpy_updates.values())
+        total_lines = sum(len(updates['lines']) for updates in rpy_updates.values())
         print(f"发现 {total_files} 个RPY文件需要更新，共 {total_lines} 行")
         return True
         
@@ -143,88 +763,354 @@ def generate_rpy_mapping(rpy_path: str, mapping_file: str, log_file: str):
         print(f"保存RPY映射失败: {e}")
         return False
 
-def update_rpy_files(mapping_file: str):
-    """根据映射文件更新RPY文件"""
+def rewrite_rpy_file(file_path: str, matcher: RenameMatcher, output_path: Optional[str] = None,
+                     lines: Optional[set] = None) -> Tuple[int, int]:
+    """
+    流式改写单个RPY文件：逐行经过匹配器写入同目录下的临时文件，完成后原子替换原文件
+    内存占用只有一行和读写缓冲区；没有任何替换时不改动原文件，也不 fsync 临时文件
+    指定 output_path 时原文件不变，结果（即使没有替换）原子写入 output_path
+    提供 lines 时（资源引用索引得到的摘要）只替换这些行号的行中记录的资源路径字符串，
+    注释、其它字符串和其余行原样写入
+    返回 (修改的行数, 替换次数)
+    """
+    directory, name = os.path.split(output_path or file_path)
+    changed_lines = 0
+    replacements = 0
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory or '.')
+    try:
+        with open(file_path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            for line_num, line in enumerate(src, 1):
+                if lines is None:
+                    new_line, count = matcher.replace_bytes(line)
+                elif line_num in lines:
+                    new_line, count = replace_asset_literals(line, matcher)
+                else:
+                    dst.write(line)
+                    continue
+                if count:
+                    changed_lines += 1
+                    replacements += count
+                dst.write(new_line)
+            if replacements or output_path:
+                dst.flush()
+                os.fsync(dst.fileno())
+        if output_path:
+            shutil.copymode(file_path, temp_path)
+            os.replace(temp_path, output_path)
+        elif replacements:
+            shutil.copymode(file_path, temp_path)
+            os.replace(temp_path, file_path)
+        else:
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return changed_lines, replacements
+
+def load_rpy_updates(mapping_file: str) -> Optional[dict]:
+    """读取RPY更新映射文件"""
     if not os.path.exists(mapping_file):
         print(f"映射文件不存在: {mapping_file}")
-        return
+        return None
     
     try:
         with open(mapping_file, 'r', encoding='utf-8') as f:
-            rpy_updates = json.load(f)
+            content = json.load(f)
     except Exception as e:
         print(f"读取映射文件失败: {e}")
-        return
+        return None
     
+    if (not isinstance(content, dict) or content.get('format') != RPY_UPDATES_FORMAT
+            or content.get('version') != RPY_UPDATES_VERSION):
+        print(f"映射文件格式不匹配，请重新生成: {mapping_file}")
+        return None
+    return content
+
+def update_rpy_files(mapping_file: str, rename_mapping: Optional[Dict[str, str]] = None,
+                     in_flight: int = 0, journal: Optional[Journal] = None) -> Tuple[int, int]:
+    """
+    根据映射文件更新RPY文件，返回 (更新的文件数, 更新的行数)
+    映射文件中只有修改摘要，实际替换由匹配器在流式改写时完成；
+    未提供 rename_mapping 时从映射文件记录的计划文件或日志文件重新加载
+    in_flight 大于 0 时使用异步流水线，提供 journal 时备份并记录每个改写的文件（见 apply_rpy_updates）
+    """
+    content = load_rpy_updates(mapping_file)
+    if content is None:
+        return 0, 0
+    rpy_updates = content['files']
+    
+    if rename_mapping is None:
+        with METRICS.phase('load_mapping'):
+            rename_mapping = load_rename_mapping(content['log_file'], content['plan_file'])
+    if not rename_mapping:
+        print("没有找到文件重命名映射")
+        return 0, 0
+    return apply_rpy_updates(rpy_updates, RenameMatcher(rename_mapping), in_flight, journal)
+
+def _rewrite_one(file_path: str, updates: dict, matcher: RenameMatcher, journal: Optional[Journal] = None):
+    """改写单个RPY文件，返回 (文件路径, 修改摘要, 修改的行数, 错误信息)；提供 journal 时先备份原文件"""
+    try:
+        if journal is not None:
+            journal.backup(file_path)
+        with METRICS.phase('rewrite_rpy'):
+            size = os.path.getsize(file_path)
+            # 由资源引用索引得到的摘要只涉及记录的行和其中的资源路径字符串
+            lines = set(updates['lines']) if updates.get('refs_only') else None
+            changed_lines, replacements = rewrite_rpy_file(file_path, matcher, lines=lines)
+        METRICS.count('rpy_bytes_rewritten', size)
+        METRICS.count('rpy_replacements_written', replacements)
+        return file_path, updates, changed_lines, None
+    except Exception as e:
+        return file_path, updates, 0, str(e)
+
+def apply_rpy_updates(rpy_updates: Dict[str, dict], matcher: RenameMatcher,
+                      in_flight: int = 0, journal: Optional[Journal] = None) -> Tuple[int, int]:
+    """
+    按修改摘要逐个改写RPY文件，返回 (更新的文件数, 更新的行数)
+    in_flight 大于 0 时用异步流水线同时改写最多 in_flight 个文件，输出顺序不变
+    提供 journal 时改写前备份原文件，改写完成后记录到执行日志
+    """
     updated_files = 0
     updated_lines = 0
     
-    for file_path, updates in rpy_updates.items():
-        try:
-            # 读取文件内容
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            # 应用更新（从后往前更新，避免行号变化）
-            for update in sorted(updates, key=lambda x: x['line_num'], reverse=True):
-                line_num = update['line_num'] - 1  # 转换为0基础索引
-                if line_num < len(lines):
-                    lines[line_num] = update['new_line'] + '\n'
-                    updated_lines += 1
-            
-            # 写回文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
-            
-            print(f"已更新RPY文件: {file_path}")
-            updated_files += 1
-            
-        except Exception as e:
-            print(f"更新RPY文件失败 {file_path}: {e}")
+    def report(rewritten):
+        nonlocal updated_files, updated_lines
+        file_path, updates, changed_lines, error = rewritten
+        if error is not None:
+            print(f"更新RPY文件失败 {file_path}: {error}")
+            return
+        if changed_lines != len(updates['lines']):
+            print(f"注意：{file_path} 在生成映射后被修改过，"
+                  f"实际更新 {changed_lines} 行（映射中为 {len(updates['lines'])} 行）")
+        
+        print(f"已更新RPY文件: {file_path}")
+        if journal is not None:
+            journal.record({'op': 'rpy', 'path': os.path.abspath(file_path)})
+        updated_lines += changed_lines
+        updated_files += 1
+    
+    arg_list = [(file_path, updates, matcher, journal) for file_path, updates in rpy_updates.items()]
+    if in_flight > 0:
+        run_ordered(_rewrite_one, arg_list, in_flight, report)
+    else:
+        for args in arg_list:
+            report(_rewrite_one(*args))
     
+    METRICS.count('rpy_files_updated', updated_files)
+    METRICS.count('rpy_lines_updated', updated_lines)
     print(f"\n总计更新了 {updated_files} 个RPY文件，{updated_lines} 行")
+    return updated_files, updated_lines
 
-def main():
-    """主函数"""
-    print("=== RPY文件修复工具 ===")
+# 默认的映射文件路径
+MAPPING_FILE = "rename_mapping.json"
+
+def save_indexes(index: Optional[FileStateIndex], refs: Optional[AssetRefIndex]):
+    """保存增量索引和资源引用索引（两者在同一个文件中时只保存一次）"""
+    with METRICS.phase('save_index'):
+        if index is not None:
+            index.save()
+        if refs is not None and refs.index is not index:
+            refs.index.save()
+
+# 视为成功的更新结果状态
+FIX_OK_STATUSES = ('updated', 'dry_run', 'nothing_to_update')
+
+def run_fix_rpy(rpy_path: str, plan_file: Optional[str] = PLAN_FILE, log_file: str = LOG_FILE,
+                mapping_file: str = MAPPING_FILE, index_file: Optional[str] = None,
+                workers: Optional[int] = None, dry_run: bool = False, confirm=None,
+                in_flight: int = 0, journal_dir: Optional[str] = None, refs_file: Optional[str] = None) -> dict:
+    """
+    非交互的RPY修复接口：生成RPY更新映射，确认后更新RPY文件，返回结果字典
+    confirm 为确认回调（参数为映射文件路径，返回 True 时继续），为 None 时直接执行；
+    dry_run 时只生成映射文件；in_flight 大于 0 时扫描和更新都使用异步流水线
+    指定 journal_dir 时备份并记录每个改写的文件，中断后可以继续或回滚（见 pipeline.resume_journal）
+    指定 index_file 时为增量模式；指定 refs_file 时使用保存在其中的资源引用索引，只检查和改写记录的资源路径
+    结果状态：updated / dry_run / nothing_to_update / cancelled / error
+    """
+    result = {
+        'rpy_path': rpy_path,
+        'status': 'error',
+        'files': 0,
+        'lines': 0,
+        'updated_files': 0,
+        'updated_lines': 0,
+        'mapping_file': mapping_file,
+    }
     
-    # 字典文件、映射文件和日志文件路径
-    dict_file = "chinese_dictionary.json"
-    mapping_file = "rename_mapping.json"
-    log_file = "rename_log.txt"
+    if not os.path.exists(rpy_path):
+        print(f"错误：RPY路径不存在: {rpy_path}")
+        result['error'] = f"RPY路径不存在: {rpy_path}"
+        return result
+    if not dry_run and not check_journal(journal_dir):
+        result['error'] = f"上一次执行没有完成: {journal_dir}"
+        return result
     
-    # 1. 加载字典
-    load_dictionary(dict_file)
+    # 生成RPY更新映射
+    print("\n=== 生成RPY更新映射 ===")
+    index = FileStateIndex(index_file) if index_file else None
+    refs = AssetRefIndex.open(refs_file, index)
+    rpy_updates = generate_rpy_mapping(rpy_path, mapping_file, log_file, workers,
+                                       plan_file=plan_file, index=index, in_flight=in_flight, refs=refs)
+    save_indexes(index, refs)
+    if rpy_updates is None:
+        result['error'] = f"保存RPY映射失败: {mapping_file}"
+        return result
+    if not rpy_updates:
+        print("没有需要更新的RPY文件")
+        result['status'] = 'nothing_to_update'
+        return result
+    result['files'] = len(rpy_updates)
+    result['lines'] = sum(len(updates['lines']) for updates in rpy_updates.values())
     
-    if not CHINESE_TO_PINYIN:
-        print("错误：字典文件为空或不存在，请先准备好字典文件")
-        return
+    if dry_run:
+        print("预演模式，不更新RPY文件")
+        result['status'] = 'dry_run'
+        return result
     
-    # 2. 获取RPY文件目录
-    rpy_path = input("请输入包含RPY文件的目录路径: ").strip().strip('"')
+    if confirm is not None and not confirm(mapping_file):
+        print("操作已取消")
+        result['status'] = 'cancelled'
+        return result
     
+    # 更新RPY文件
+    print("\n=== 更新RPY文件 ===")
+    journal = None
+    if journal_dir:
+        journal = Journal.create(journal_dir, None, rpy_path)
+        shutil.copyfile(mapping_file, journal.mapping_file)
+    try:
+        result['updated_files'], result['updated_lines'] = update_rpy_files(mapping_file, in_flight=in_flight,
+                                                                            journal=journal)
+    finally:
+        if journal is not None:
+            journal.close(complete=sys.exc_info()[0] is None)
+    result['status'] = 'updated'
+    return result
+
+def query_asset_refs(rpy_path: str, index_file: Optional[str] = INDEX_FILE,
+                     where_used: Optional[List[str]] = None, game_dir: Optional[str] = None) -> dict:
+    """
+    查询资源引用索引（先重新解析有变化的RPY文件），返回结果字典
+    where_used 中的每个文件列出引用它的位置；指定 game_dir 时列出引用了但不存在的资源
+    """
+    result = {'rpy_path': rpy_path, 'status': 'error', 'where_used': {}, 'missing': []}
     if not os.path.exists(rpy_path):
         print(f"错误：RPY路径不存在: {rpy_path}")
-        return
+        result['error'] = f"RPY路径不存在: {rpy_path}"
+        return result
     
-    # 3. 生成RPY更新映射
-    print("\n=== 生成RPY更新映射 ===")
-    if not generate_rpy_mapping(rpy_path, mapping_file, log_file):
-        print("没有需要更新的RPY文件")
-        return
+    index = FileStateIndex(index_file) if index_file else FileStateIndex()
+    refs = AssetRefIndex(index)
+    refs.refresh(rpy_path)
+    index.save()
+    
+    for asset_path in where_used or []:
+        found = refs.where_used(asset_path)
+        result['where_used'][asset_path] = [[file_path, line_num] for _, file_path, line_num in found]
+        if not found:
+            print(f"\n{asset_path} 没有被引用")
+            continue
+        print(f"\n{asset_path} 被引用了 {len(found)} 次:")
+        for literal, file_path, line_num in found:
+            print(f"  {file_path}:{line_num}  \"{literal}\"")
+    
+    if game_dir:
+        missing = refs.missing(game_dir)
+        result['missing'] = [[literal, [list(location) for location in locations]] for literal, locations in missing]
+        if missing:
+            print(f"\n引用的资源中有 {len(missing)} 个在 {game_dir} 中不存在:")
+            for literal, locations in missing:
+                file_path, line_num = locations[0]
+                more = f" 等 {len(locations)} 处" if len(locations) > 1 else ""
+                print(f"  {literal}  （{file_path}:{line_num}{more}）")
+        else:
+            print(f"\n引用的资源在 {game_dir} 中都存在")
     
-    # 4. 用户确认是否继续更新RPY文件
+    result['status'] = 'queried'
+    return result
+
+def confirm_update(mapping_file: str) -> bool:
+    """在控制台询问是否更新RPY文件"""
     print(f"\n请查看RPY更新映射: {mapping_file}")
-    choice = input("是否继续更新RPY文件？(y/n): ").strip().lower()
-    if choice != 'y':
-        print("操作已取消")
-        return
+    return input("是否继续更新RPY文件？(y/n): ").strip().lower() == 'y'
+
+def interactive() -> int:
+    """交互模式：在控制台输入路径并确认"""
+    print("=== RPY文件修复工具 ===")
     
-    # 5. 更新RPY文件
-    print("\n=== 更新RPY文件 ===")
-    update_rpy_files(mapping_file)
+    # 加载字典
+    load_dictionary(DICT_FILE)
+    
+    if not CHINESE_TO_PINYIN:
+        print("错误：字典文件为空或不存在，请先准备好字典文件")
+        return 1
+    
+    # 获取RPY文件目录
+    rpy_path = input("请输入包含RPY文件的目录路径: ").strip().strip('"')
+    
+    result = run_fix_rpy(rpy_path, confirm=confirm_update, journal_dir=JOURNAL_DIR)
+    if result['status'] == 'updated':
+        print("\n=== 所有操作完成 ===")
+    return 0 if result['status'] in FIX_OK_STATUSES else 1
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="根据重命名计划更新RPY文件中的文件引用。不带参数运行时进入交互模式")
+    parser.add_argument('rpy_path', help="包含RPY文件的目录")
+    parser.add_argument('--plan', dest='plan_file', default=PLAN_FILE, help="重命名计划文件")
+    parser.add_argument('--log', dest='log_file', default=LOG_FILE,
+                        help="重命名日志文件（没有计划文件时使用）")
+    parser.add_argument('--mapping', dest='mapping_file', default=MAPPING_FILE, help="RPY更新映射文件")
+    parser.add_argument('--incremental', action='store_true',
+                        help="使用增量索引，跳过内容未变且不受映射影响的RPY文件（默认完整扫描）")
+    parser.add_argument('--index', dest='index_file', default=INDEX_FILE, help="增量索引和资源引用索引的文件")
+    parser.add_argument('--refs', action='store_true',
+                        help="使用资源引用索引：只重新解析有变化的RPY文件，只更新记录的资源路径字符串")
+    parser.add_argument('--where-used', action='append', metavar='PATH',
+                        help="查询引用了该资源文件的RPY文件和行号（可重复），不更新RPY文件")
+    parser.add_argument('--missing-assets', nargs='?', const='', metavar='GAME_DIR',
+                        help="列出引用了但不存在的资源（相对 GAME_DIR 查找，默认为RPY目录），不更新RPY文件")
+    parser.add_argument('--workers', type=int, help="扫描RPY文件的进程数，默认为CPU数")
+    parser.add_argument('--in-flight', type=int, default=0, metavar='N',
+                        help="使用异步流水线，同时读写最多 N 个文件（适合网络存储，代替多进程扫描）")
+    parser.add_argument('--journal', dest='journal_dir', default=JOURNAL_DIR, metavar='DIR',
+                        help="执行日志文件夹，备份并记录改写的文件（用 rename.py --resume / --rollback 继续或撤销）")
+    parser.add_argument('--no-journal', action='store_true', help="不记录执行日志")
+    parser.add_argument('-y', '--yes', action='store_true', help="不询问，直接执行")
+    parser.add_argument('--dry-run', action='store_true', help="只生成映射文件，不更新RPY文件")
+    parser.add_argument('--metrics', metavar='FILE', default=os.environ.get('CN2EN_METRICS'),
+                        help="导出性能指标（JSON）")
+    parser.add_argument('--profile', metavar='FILE', default=os.environ.get('CN2EN_PROFILE'),
+                        help="用 cProfile 运行并保存统计")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主函数"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        # 设置环境变量 CN2EN_METRICS / CN2EN_PROFILE 时导出性能指标 / cProfile 统计
+        return run_instrumented(interactive, 'fix_rpy', os.environ.get('CN2EN_METRICS'),
+                                os.environ.get('CN2EN_PROFILE'))
     
-    print("\n=== 所有操作完成 ===")
+    args = build_parser().parse_args(argv)
+    if args.where_used or args.missing_assets is not None:
+        game_dir = None if args.missing_assets is None else args.missing_assets or args.rpy_path
+        result = run_instrumented(
+            lambda: query_asset_refs(args.rpy_path, args.index_file,
+                                     args.where_used, game_dir),
+            'refs', args.metrics, args.profile)
+        return 0 if result['status'] == 'queried' else 1
+    confirm = None if args.yes else confirm_update
+    result = run_instrumented(
+        lambda: run_fix_rpy(args.rpy_path, args.plan_file, args.log_file, args.mapping_file,
+                            args.index_file if args.incremental else None, args.workers,
+                            args.dry_run, confirm, args.in_flight,
+                            None if args.no_journal else args.journal_dir,
+                            args.index_file if args.refs else None),
+        'fix_rpy', args.metrics, args.profile)
+    return 0 if result['status'] in FIX_OK_STATUSES else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+镜像输出
+不修改目标文件夹，在另一个文件夹中按拼音名称建立镜像，RPY文件改写后放入镜像
+"""
+
+import os
+import sys
+import json
+import errno
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Optional, Tuple
+
+import fix_rpy
+from common import DICT_FILE, LOG_FILE, METRICS, PLAN_FILE, atomic_write, paths_overlap
+from rename import iter_tree, prepare_rename
+
+# 镜像输出：在另一个文件夹中按转换后的名称建立目标文件夹的镜像，原文件夹保持不变
+# 镜像状态保存在镜像文件夹旁边（<镜像文件夹>.cn2en-mirror.json），不混入镜像内容
+MIRROR_STATE_SUFFIX = '.cn2en-mirror.json'
+MIRROR_STATE_FORMAT = 'cn2en-mirror'
+MIRROR_STATE_VERSION = 1
+MIRROR_THREADS = 8
+# 放置文件的方式，按顺序尝试；auto 依次尝试全部方式
+MIRROR_LINK_MODES = {
+    'auto': ('reflink', 'hardlink', 'copy_file_range', 'copy'),
+    'reflink': ('reflink', 'copy_file_range', 'copy'),
+    'hardlink': ('hardlink', 'copy_file_range', 'copy'),
+    'copy': ('copy',),
+}
+# Linux 的 FICLONE ioctl（btrfs、XFS 等文件系统上共享数据块的写时复制副本）
+FICLONE = 0x40049409
+# 说明文件系统或平台不支持某种方式的错误，出现一次后不再尝试该方式
+LINK_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                           errno.ENOSYS, errno.EBADF}
+
+class FileLinker:
+    """
+    把源文件放到镜像中：依次尝试 reflink、硬链接、copy_file_range，最后普通复制
+    某种方式因为文件系统不支持失败后，之后的文件不再尝试它；可以在多个线程中同时使用
+    """
+
+    def __init__(self, methods=MIRROR_LINK_MODES['auto']):
+        self.methods = tuple(methods)
+        self.disabled = set()
+
+    def link(self, src: str, dst: str) -> str:
+        """放置一个文件，返回使用的方式"""
+        for method in self.methods:
+            if method in self.disabled:
+                continue
+            try:
+                if method == 'reflink':
+                    self._reflink(src, dst)
+                elif method == 'hardlink':
+                    os.link(src, dst)
+                elif method == 'copy_file_range':
+                    self._copy_file_range(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+                return method
+            except OSError as e:
+                if method == 'copy':
+                    raise
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                if e.errno in LINK_UNSUPPORTED_ERRORS:
+                    self.disabled.add(method)
+                elif e.errno != errno.EMLINK:
+                    raise
+        raise OSError(errno.ENOSYS, "没有可用的文件放置方式")
+
+    @staticmethod
+    def _reflink(src: str, dst: str):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.EOPNOTSUPP, "只有 Linux 支持 FICLONE")
+        # fcntl 在 Windows 上不存在
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    @staticmethod
+    def _copy_file_range(src: str, dst: str):
+        # Python 3.8 起才有 os.copy_file_range，由内核直接复制（部分文件系统和 NFS 上在服务器端完成）
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError(errno.ENOSYS, "不支持 copy_file_range")
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        shutil.copystat(src, dst)
+
+def mirror_state_file(mirror_path: str) -> str:
+    return os.path.abspath(mirror_path).rstrip(os.sep) + MIRROR_STATE_SUFFIX
+
+def load_mirror_state(mirror_path: str) -> dict:
+    """读取镜像状态（上次放置的文件），没有或格式不符时返回空状态"""
+    state_file = mirror_state_file(mirror_path)
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('format') == MIRROR_STATE_FORMAT and state.get('version') == MIRROR_STATE_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {'files': {}}
+
+def save_mirror_state(mirror_path: str, state: dict):
+    """保存镜像状态（先写临时文件再替换）"""
+    state_file = mirror_state_file(mirror_path)
+    try:
+        with atomic_write(state_file) as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+    except Exception as e:
+        print(f"保存镜像状态失败: {e}")
+
+def _mirror_one(src: str, dst: str, linker: FileLinker, matcher, rewrite: bool) -> Tuple[Optional[str], Optional[str]]:
+    """放置一个镜像文件，返回 (使用的方式, 错误信息)"""
+    try:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return 'symlink', None
+        if rewrite:
+            fix_rpy.rewrite_rpy_file(src, matcher, dst)
+            return 'rewrite', None
+        return linker.link(src, dst), None
+    except Exception as e:
+        return None, str(e)
+
+def mirror_tree(src_root: str, mirror_path: str, new_names: Dict[str, str], linker: FileLinker,
+                matcher=None, rpy_rel: Optional[str] = None, mapping_digest: Optional[str] = None,
+                threads: int = MIRROR_THREADS, only_rpy: bool = False) -> dict:
+    """
+    在 mirror_path 中建立 src_root 的镜像，new_names 为需要改名的条目（相对路径 -> 新名称）
+    rpy_rel 不为 None 时，该相对路径下的 .rpy 文件经过 matcher 改写后写入镜像，其它文件按 linker 放置；
+    only_rpy 时只镜像 .rpy 文件
+    
+    重复建立时为增量模式：源文件大小和修改时间都没变（RPY文件还要求重命名映射没变）的文件直接保留，
+    源文件已不存在的镜像文件被删除；只删除镜像状态中记录的、由本工具放置的文件
+    返回报告：各方式放置的文件数、未变化数、删除数和失败条目
+    """
+    old_state = load_mirror_state(mirror_path)
+    old_files = old_state['files'] if old_state.get('mapping_digest') == mapping_digest else {
+        dst_rel: record for dst_rel, record in old_state['files'].items() if record[3] != 'rewrite'}
+    new_files = {}
+    claimed = set()
+    report = {'placed': {}, 'unchanged': 0, 'removed': 0, 'failures': []}
+    rpy_prefix = None if rpy_rel is None else (os.path.join(rpy_rel, '') if rpy_rel else '')
+    dst_dirs = {'': ''}
+    
+    def collect(job, outcome):
+        dst_rel, record = job
+        method, error = outcome
+        if error is not None:
+            print(f"镜像文件失败: {record[0]} -> {dst_rel}, 错误: {error}")
+            report['failures'].append({'path': record[0], 'mirror_path': dst_rel, 'error': error})
+            return
+        record[3] = method
+        new_files[dst_rel] = record
+        report['placed'][method] = report['placed'].get(method, 0) + 1
+    
+    os.makedirs(mirror_path, exist_ok=True)
+    with METRICS.phase('mirror'), ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        running = {}
+        for rel_path, name, is_dir, _ in iter_tree(src_root):
+            parent_rel = os.path.dirname(rel_path)
+            dst_parent = dst_dirs.get(parent_rel)
+            if dst_parent is None:
+                continue
+            dst_rel = os.path.join(dst_parent, new_names.get(rel_path, name)) if dst_parent else \
+                new_names.get(rel_path, name)
+            src = os.path.join(src_root, rel_path)
+            dst = os.path.join(mirror_path, dst_rel)
+            if is_dir and not os.path.islink(src):
+                if not only_rpy:
+                    try:
+                        os.makedirs(dst, exist_ok=True)
+                    except OSError as e:
+                        print(f"创建镜像文件夹失败: {dst_rel}, 错误: {e}")
+                        report['failures'].append({'path': rel_path, 'mirror_path': dst_rel, 'error': str(e)})
+                        continue
+                dst_dirs[rel_path] = dst_rel
+                continue
+            
+            rewrite = (rpy_prefix is not None and name.endswith('.rpy') and rel_path.startswith(rpy_prefix))
+            if only_rpy and not rewrite:
+                continue
+            if dst_rel in claimed:
+                error = "与其它文件转换后重名"
+                print(f"镜像文件失败: {rel_path} -> {dst_rel}, 错误: {error}")
+                report['failures'].append({'path': rel_path, 'mirror_path': dst_rel, 'error': error})
+                continue
+            try:
+                st = os.lstat(src)
+            except OSError as e:
+                report['failures'].append({'path': rel_path, 'mirror_path': dst_rel, 'error': str(e)})
+                continue
+            claimed.add(dst_rel)
+            record = [rel_path, st.st_size, st.st_mtime_ns, None]
+            old = old_files.get(dst_rel)
+            if (old is not None and old[:3] == record[:3] and (old[3] == 'rewrite') == rewrite
+                    and os.path.lexists(dst)):
+                new_files[dst_rel] = old
+                report['unchanged'] += 1
+                continue
+            if only_rpy:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+            
+            running[executor.submit(_mirror_one, src, dst, linker, matcher, rewrite)] = (dst_rel, record)
+            if len(running) >= threads * 4:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(running.pop(future), future.result())
+        for future in as_completed(list(running)):
+            collect(running.pop(future), future.result())
+        
+        # 删除源文件已不存在的镜像文件，以及因此变空的文件夹
+        for dst_rel in old_state['files']:
+            if dst_rel in new_files:
+                continue
+            dst = os.path.join(mirror_path, dst_rel)
+            try:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                    report['removed'] += 1
+                parent = os.path.dirname(dst_rel)
+                while parent:
+                    os.rmdir(os.path.join(mirror_path, parent))
+                    parent = os.path.dirname(parent)
+            except OSError:
+                pass
+    
+    save_mirror_state(mirror_path, {'format': MIRROR_STATE_FORMAT, 'version': MIRROR_STATE_VERSION,
+                                    'source': os.path.abspath(src_root), 'mapping_digest': mapping_digest,
+                                    'files': new_files})
+    for method, count in report['placed'].items():
+        METRICS.count(f'mirror_{method}', count)
+    METRICS.count('mirror_unchanged', report['unchanged'])
+    METRICS.count('mirror_removed', report['removed'])
+    return report
+
+def print_mirror_report(mirror_path: str, report: dict):
+    placed = sum(report['placed'].values())
+    methods = '，'.join(f"{method} {count}" for method, count in sorted(report['placed'].items()))
+    print(f"\n镜像 {mirror_path}：放置了 {placed} 个文件" + (f"（{methods}）" if methods else ""))
+    print(f"未变化 {report['unchanged']} 个，删除 {report['removed']} 个")
+    if report['failures']:
+        print(f"有 {len(report['failures'])} 个文件镜像失败")
+
+def run_mirror(target_path: str, mirror_path: str, dict_file: str = DICT_FILE, rpy_path: Optional[str] = None,
+               rpy_mirror: Optional[str] = None, plan_file: Optional[str] = PLAN_FILE,
+               log_file: Optional[str] = LOG_FILE, index_file: Optional[str] = None,
+               threads: int = MIRROR_THREADS, link: str = 'auto', dry_run: bool = False) -> dict:
+    """
+    镜像输出接口：不修改目标文件夹，在 mirror_path 中建立按拼音命名的镜像
+    文件优先用 reflink 或硬链接放置（link 指定方式，见 MIRROR_LINK_MODES），多个线程同时进行
+    指定 rpy_path 时镜像中包含改写过引用的RPY文件：RPY目录在目标文件夹内时改写后的文件就在镜像中的对应位置，
+    否则写入 rpy_mirror（只包含 .rpy 文件）
+    重复运行时只处理有变化的文件。注意硬链接与原文件共享内容，不要直接修改镜像中的文件
+    结果状态：mirrored / dry_run / incomplete_dictionary / error
+    """
+    result = {'target': target_path, 'mirror': mirror_path, 'status': 'error', 'placed': 0, 'unchanged': 0,
+              'removed': 0, 'rpy_rewritten': 0, 'failures': []}
+    rpy_rel = None
+    if rpy_path:
+        if not os.path.exists(rpy_path):
+            print(f"错误：RPY路径不存在: {rpy_path}")
+            result['error'] = f"RPY路径不存在: {rpy_path}"
+            return result
+        rpy_real = os.path.realpath(rpy_path)
+        target_real = os.path.realpath(target_path)
+        if rpy_real == target_real:
+            rpy_rel = ''
+        elif rpy_real.startswith(os.path.join(target_real, '')):
+            rpy_rel = os.path.relpath(rpy_real, target_real)
+        elif not rpy_mirror:
+            print("错误：RPY目录不在目标文件夹内，需要指定RPY文件的镜像位置")
+            result['error'] = "需要指定 rpy_mirror"
+            return result
+    for path in filter(None, (mirror_path, rpy_mirror)):
+        if any(paths_overlap(path, source) for source in filter(None, (target_path, rpy_path))):
+            print(f"错误：镜像位置不能与源文件夹重叠: {path}")
+            result['error'] = f"镜像位置与源文件夹重叠: {path}"
+            return result
+    
+    rename_result, plan, _ = prepare_rename(target_path, dict_file, plan_file, log_file, index_file)
+    result['missing_chars'] = rename_result['missing_chars']
+    if rename_result['status'] not in ('planned', 'nothing_to_rename'):
+        result['status'] = rename_result['status']
+        result['error'] = rename_result.get('error')
+        return result
+    if dry_run:
+        print("预演模式，不建立镜像")
+        result['status'] = 'dry_run'
+        return result
+    
+    new_names = {}
+    rename_mapping = {}
+    if plan is not None:
+        new_names = {entry.rel_path: entry.new_name for entry in plan.entries if entry.new_name != entry.name}
+        rename_mapping = dict(plan.file_renames)
+    matcher = fix_rpy.RenameMatcher(rename_mapping) if rpy_path else None
+    mapping_digest = fix_rpy.mapping_digest(rename_mapping)
+    linker = FileLinker(MIRROR_LINK_MODES[link])
+    
+    print("\n=== 建立镜像 ===")
+    reports = [(mirror_path, mirror_tree(target_path, mirror_path, new_names, linker, matcher, rpy_rel,
+                                         mapping_digest, threads))]
+    if rpy_path and rpy_rel is None:
+        reports.append((rpy_mirror, mirror_tree(rpy_path, rpy_mirror, {}, linker, matcher, '', mapping_digest,
+                                                threads, only_rpy=True)))
+    for path, report in reports:
+        print_mirror_report(path, report)
+        result['rpy_rewritten'] += report['placed'].get('rewrite', 0)
+        result['placed'] += sum(report['placed'].values())
+        result['unchanged'] += report['unchanged']
+        result['removed'] += report['removed']
+        result['failures'] += report['failures']
+    result['status'] = 'mirrored'
+    return result
+
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+组合流程
+同时用到 rename.py 和 fix_rpy.py 的流程：一次完成重命名和RPY修复、根据执行日志继续执行、批量处理多个项目
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from typing import List, Optional, Tuple
+
+from common import (DICT_FILE, INDEX_FILE, JOURNAL_DIR, LOG_FILE, METRICS, PLAN_FILE, Journal, check_journal,
+                    load_plan_file, paths_overlap, read_journal, write_plan_file)
+from fix_rpy import (FIX_OK_STATUSES, MAPPING_FILE, AssetRefIndex, RenameMatcher, apply_rpy_updates,
+                     load_rename_mapping, load_rename_mapping_from_plan, load_rpy_updates, save_indexes,
+                     scan_rpy_files, write_rpy_mapping)
+from rename import RENAME_OK_STATUSES, execute_renames, prepare_rename, print_rename_report, run_rename
+
+def run_pipeline(target_path: str, rpy_path: str, dict_file: str = DICT_FILE,
+                 plan_file: Optional[str] = None, log_file: Optional[str] = None,
+                 mapping_file: Optional[str] = None, index_file: Optional[str] = None,
+                 workers: Optional[int] = None, threads: int = 1, dry_run: bool = False,
+                 confirm=None, in_flight: int = 0, journal_dir: Optional[str] = None,
+                 refs_file: Optional[str] = None) -> Tuple[dict, dict]:
+    """
+    一次完成重命名和RPY修复：重命名计划直接在内存中构建匹配器，不经过日志和映射文件
+    计划、日志和映射文件都是可选的输出。RPY目录与目标文件夹不重叠时，
+    扫描和改写RPY文件与重命名同时进行；重叠时先改写RPY文件再重命名，避免改写时文件夹被改名
+    confirm 为确认回调（参数为日志文件路径），确认一次后同时执行两部分
+    指定 journal_dir 时两部分都记录到同一个执行日志，中断后可以继续或回滚（见 resume_journal）
+    指定 refs_file 时用保存在其中的资源引用索引找出需要更新的RPY文件（见 scan_rpy_refs）
+    返回 (重命名结果, RPY修复结果)，格式与 run_rename / run_fix_rpy 的结果相同
+    """
+    rpy_result = {
+        'rpy_path': rpy_path,
+        'status': 'error',
+        'files': 0,
+        'lines': 0,
+        'updated_files': 0,
+        'updated_lines': 0,
+        'mapping_file': mapping_file,
+    }
+    if not os.path.exists(rpy_path):
+        print(f"错误：RPY路径不存在: {rpy_path}")
+        rpy_result['error'] = f"RPY路径不存在: {rpy_path}"
+        return {'target': target_path, 'status': 'error', 'error': rpy_result['error']}, rpy_result
+    if not dry_run and not check_journal(journal_dir):
+        rpy_result['error'] = f"上一次执行没有完成: {journal_dir}"
+        return {'target': target_path, 'status': 'error', 'error': rpy_result['error']}, rpy_result
+    
+    rename_result, plan, index = prepare_rename(target_path, dict_file, plan_file, log_file, index_file)
+    if plan is None:
+        # 没有可用的计划时不处理RPY文件，失败原因见重命名结果
+        rpy_result['status'] = 'nothing_to_update' if rename_result['status'] == 'nothing_to_rename' else 'skipped'
+        return rename_result, rpy_result
+    
+    # 重命名映射直接取自计划
+    rename_mapping = dict(plan.file_renames)
+    matcher = RenameMatcher(rename_mapping)
+    refs = AssetRefIndex.open(refs_file, index)
+    journal = None
+    
+    def fix_scripts(apply: bool):
+        print("\n=== 扫描RPY文件 ===")
+        with METRICS.phase('scan_rpy'):
+            rpy_updates = scan_rpy_files(rpy_path, rename_mapping, workers, index, in_flight, refs)
+        rpy_result['files'] = len(rpy_updates)
+        rpy_result['lines'] = sum(len(updates['lines']) for updates in rpy_updates.values())
+        if mapping_file and rpy_updates:
+            write_rpy_mapping(mapping_file, rpy_updates, plan_file, log_file)
+        if not rpy_updates:
+            print("未发现需要更新的RPY文件")
+            rpy_result['status'] = 'nothing_to_update'
+        elif not apply:
+            print(f"发现 {rpy_result['files']} 个RPY文件需要更新，共 {rpy_result['lines']} 行")
+            rpy_result['status'] = 'dry_run'
+        else:
+            if journal is not None:
+                # 继续执行时从执行日志文件夹读取修改摘要，映射来自其中的计划
+                write_rpy_mapping(journal.mapping_file, rpy_updates, journal.plan_file, None)
+            updated = apply_rpy_updates(rpy_updates, matcher, in_flight, journal)
+            rpy_result['updated_files'], rpy_result['updated_lines'] = updated
+            rpy_result['status'] = 'updated'
+    
+    def rename_assets():
+        print("\n=== 执行文件和文件夹重命名 ===")
+        report = execute_renames(target_path, plan, threads, journal)
+        print_rename_report(report)
+        rename_result['renamed'] = report['renamed_folders'] + report['renamed_files']
+        rename_result['failures'] = report['failures']
+        rename_result['status'] = 'renamed'
+    
+    try:
+        if dry_run:
+            fix_scripts(apply=False)
+            rename_result['status'] = 'dry_run'
+            print("预演模式，不执行重命名和RPY更新")
+        elif confirm is not None and not confirm(log_file):
+            print("操作已取消")
+            rename_result['status'] = 'cancelled'
+            rpy_result['status'] = 'cancelled'
+        else:
+            if journal_dir:
+                journal = Journal.create(journal_dir, target_path, rpy_path)
+                write_plan_file(plan, journal.plan_file)
+            if paths_overlap(target_path, rpy_path):
+                print("RPY目录与目标文件夹重叠，先更新RPY文件再重命名")
+                fix_scripts(apply=True)
+                rename_assets()
+            else:
+                # RPY文件的扫描和改写在后台线程中进行，与重命名同时执行
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    scripts = executor.submit(fix_scripts, True)
+                    rename_assets()
+                    scripts.result()
+            if journal is not None:
+                journal.close(complete=True)
+                journal = None
+    except Exception as e:
+        print(f"处理失败: {e}")
+        for result in (rename_result, rpy_result):
+            if result['status'] not in RENAME_OK_STATUSES + FIX_OK_STATUSES:
+                result['status'] = 'error'
+                result['error'] = str(e)
+    finally:
+        if journal is not None:
+            journal.close()
+        save_indexes(index, refs)
+    return rename_result, rpy_result
+
+def resume_journal(journal_dir: str = JOURNAL_DIR, threads: int = 1, in_flight: int = 0) -> dict:
+    """
+    根据执行日志继续上一次被中断的执行：跳过已完成的RPY改写和重命名，只处理剩下的部分
+    计划和RPY更新映射都从执行日志文件夹中读取，不重新扫描目标文件夹
+    结果状态：resumed / nothing_to_resume / error
+    """
+    result = {'journal': journal_dir, 'status': 'error', 'renamed': 0, 'failures': [],
+              'rpy_files_updated': 0, 'rpy_lines_updated': 0}
+    try:
+        state = read_journal(journal_dir)
+    except Exception as e:
+        print(f"读取执行日志失败: {e}")
+        result['error'] = str(e)
+        return result
+    if state is None:
+        print(f"没有找到执行日志: {journal_dir}")
+        result['error'] = f"没有找到执行日志: {journal_dir}"
+        return result
+    if state['complete']:
+        print("上一次执行已经全部完成，没有需要继续的操作")
+        result['status'] = 'nothing_to_resume'
+        return result
+    
+    header = state['header']
+    journal = Journal.reopen(journal_dir)
+    complete = False
+    try:
+        if header['rpy']:
+            print("\n=== 继续更新RPY文件 ===")
+            content = load_rpy_updates(journal.mapping_file) if os.path.exists(journal.mapping_file) else None
+            if content is not None:
+                rename_mapping = load_rename_mapping(content['log_file'], content['plan_file'])
+                all_updates = content['files']
+            else:
+                # 中断时还没有扫描完RPY文件（也就还没有改写），或映射文件无法读取，按执行日志中的计划重新扫描；
+                # 已改写的文件中不再有旧引用，重新扫描不会重复替换
+                if os.path.exists(journal.mapping_file):
+                    print("执行日志中的RPY更新映射无法使用，按计划重新扫描RPY文件")
+                rename_mapping = load_rename_mapping_from_plan(journal.plan_file)
+                all_updates = scan_rpy_files(header['rpy'], rename_mapping, in_flight=in_flight)
+            # 映射文件中的路径相对于当初的工作目录
+            rpy_updates = {}
+            for file_path, updates in all_updates.items():
+                file_path = os.path.normpath(os.path.join(header['cwd'], file_path))
+                if file_path not in state['rewritten']:
+                    rpy_updates[file_path] = updates
+            print(f"跳过了 {len(all_updates) - len(rpy_updates)} 个上次已更新的RPY文件")
+            if rpy_updates and rename_mapping:
+                files, lines = apply_rpy_updates(rpy_updates, RenameMatcher(rename_mapping),
+                                                         in_flight, journal)
+                result.update(rpy_files_updated=files, rpy_lines_updated=lines)
+        
+        if header['target'] and os.path.exists(journal.plan_file):
+            print("\n=== 继续执行文件和文件夹重命名 ===")
+            done = set(state['renames'])
+            report = execute_renames(header['target'], load_plan_file(journal.plan_file), threads, journal, done)
+            print_rename_report(report)
+            result['renamed'] = report['renamed_folders'] + report['renamed_files']
+            result['failures'] = report['failures']
+        complete = True
+    except Exception as e:
+        print(f"继续执行失败: {e}")
+        result['error'] = str(e)
+    finally:
+        journal.close(complete)
+    if complete:
+        result['status'] = 'resumed'
+    return result
+
+# 批量处理报告格式
+BATCH_REPORT_FORMAT = 'cn2en-batch-report'
+BATCH_REPORT_VERSION = 1
+
+def load_projects(projects_file: str) -> List[dict]:
+    """
+    读取批量处理的项目列表（JSON 数组，或带 "projects" 键的对象）
+    每个项目包含 name、target，可选 rpy、output_dir、dict；相对路径相对于项目列表文件所在的文件夹
+    output_dir 默认为 cn2en_output/<name>
+    """
+    with open(projects_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('projects')
+    if not isinstance(data, list):
+        raise ValueError("项目列表应为 JSON 数组")
+    
+    base_dir = os.path.dirname(os.path.abspath(projects_file))
+    projects = []
+    names = set()
+    for number, item in enumerate(data, 1):
+        if not isinstance(item, dict) or not item.get('name') or not item.get('target'):
+            raise ValueError(f"第 {number} 个项目缺少 name 或 target")
+        name = item['name']
+        if name in names:
+            raise ValueError(f"项目名称重复: {name}")
+        names.add(name)
+        project = {'name': name}
+        for key in ('target', 'rpy', 'output_dir', 'dict'):
+            if item.get(key):
+                project[key] = os.path.join(base_dir, item[key])
+        project.setdefault('output_dir', os.path.join(base_dir, 'cn2en_output', name))
+        projects.append(project)
+    return projects
+
+def run_project(project: dict, dict_file: str = DICT_FILE, dry_run: bool = False, threads: int = 1,
+                incremental: bool = False) -> dict:
+    """
+    处理一个项目：重命名资源文件夹，有 rpy 时同时更新RPY文件中的引用（见 run_pipeline）
+    计划、日志、映射、索引（incremental 时）和控制台输出（cn2en_run.log）都写在项目的 output_dir 中，
+    字典和性能指标都是本项目独立的，可以在多个进程中同时运行
+    """
+    output_dir = project['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    plan_file = os.path.join(output_dir, PLAN_FILE)
+    log_file = os.path.join(output_dir, LOG_FILE)
+    index_file = os.path.join(output_dir, INDEX_FILE) if incremental else None
+    
+    METRICS.reset(project['name'])
+    result = {'name': project['name'], 'status': 'error', 'output_dir': output_dir}
+    with open(os.path.join(output_dir, 'cn2en_run.log'), 'w', encoding='utf-8') as run_log, \
+            redirect_stdout(run_log):
+        try:
+            with METRICS.phase('total'):
+                if project.get('rpy'):
+                    rename_result, rpy_result = run_pipeline(
+                        project['target'], project['rpy'], project.get('dict', dict_file), plan_file, log_file,
+                        os.path.join(output_dir, MAPPING_FILE), index_file, workers=1,
+                        threads=threads, dry_run=dry_run)
+                    result['rpy'] = rpy_result
+                else:
+                    rename_result = run_rename(project['target'], project.get('dict', dict_file),
+                                               plan_file, log_file, index_file, dry_run, threads=threads)
+                result['rename'] = rename_result
+                result['status'] = rename_result['status']
+                for step in (rename_result, result.get('rpy', {})):
+                    if step.get('status') == 'error':
+                        result['status'] = 'error'
+                        result['error'] = step.get('error', "处理失败")
+        except Exception as e:
+            print(f"处理项目失败: {e}")
+            result['status'] = 'error'
+            result['error'] = str(e)
+    result['metrics'] = METRICS.to_dict()
+    return result
+
+def run_batch(projects: List[dict], dict_file: str = DICT_FILE, dry_run: bool = False,
+              jobs: Optional[int] = None, threads: int = 1, incremental: bool = False) -> dict:
+    """
+    用多个进程并行处理多个项目，每个项目在独立的进程状态中运行
+    jobs 为并行的进程数（None 表示使用全部CPU），threads 为每个项目执行重命名的线程数，
+    incremental 时每个项目在 output_dir 中保存增量索引，返回汇总报告，项目顺序与输入相同
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    results = [None] * len(projects)
+    if projects:
+        with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(projects)))) as executor:
+            futures = {executor.submit(run_project, project, dict_file, dry_run, threads, incremental): number
+                       for number, project in enumerate(projects)}
+            for future in as_completed(futures):
+                number = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'name': projects[number]['name'], 'status': 'error', 'error': str(e)}
+                results[number] = result
+                print(f"[{result['name']}] {result['status']}"
+                      + (f": {result['error']}" if 'error' in result else ''))
+    
+    failed = sum(1 for result in results if result['status'] not in RENAME_OK_STATUSES)
+    return {
+        'format': BATCH_REPORT_FORMAT,
+        'version': BATCH_REPORT_VERSION,
+        'dry_run': dry_run,
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'renamed': sum(result.get('rename', {}).get('renamed', 0) for result in results),
+        'rpy_lines_updated': sum(result.get('rpy', {}).get('updated_lines', 0) for result in results),
+        'projects': results,
+    }
+
@@ -6,187 +6,489 @@
 """
 
 import os
-import json
-from typing import Dict, List
+import re
+import sys
+import time
+import itertools
+import shutil
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from common import (DICT_FILE, JOURNAL_DIR, LOG_FILE, METRICS, PLAN_FILE, CompiledDictionary,
+                    FileStateIndex, Journal, PlanEntry, PlanWriter, RenamePlan, check_journal, entry_to_record,
+                    iter_plan_file, load_plan_file, read_dictionary, read_journal, read_plan_summary,
+                    write_plan_file)
 
 # 全局变量 - 从空字典开始，只包含实际扫描到的汉字
 CHINESE_TO_PINYIN = {}
+# 词语拼音表（多音字按词语确定读音，PhraseTable），由字典旁边的词语文件加载
+PHRASE_TO_PINYIN = None
 
-def load_dictionary(dict_file: str) -> Dict[str, str]:
-    """从JSON文件加载字典"""
-    global CHINESE_TO_PINYIN
-    if os.path.exists(dict_file):
-        try:
-            with open(dict_file, 'r', encoding='utf-8') as f:
-                CHINESE_TO_PINYIN = json.load(f)
-                print(f"已加载字典文件: {dict_file}")
-                print(f"字典中包含 {len(CHINESE_TO_PINYIN)} 个字符")
-                return CHINESE_TO_PINYIN
-        except Exception as e:
-            print(f"加载字典文件失败: {e}")
-            CHINESE_TO_PINYIN = {}
-    else:
-        print(f"字典文件不存在: {dict_file}")
-        CHINESE_TO_PINYIN = {}
+def load_dictionary(dict_file: str) -> Mapping:
+    """加载字典到全局变量（自动使用编译缓存），字典旁边有词语文件时一并加载"""
+    global CHINESE_TO_PINYIN, PHRASE_TO_PINYIN
+    CHINESE_TO_PINYIN = read_dictionary(dict_file)
+    PHRASE_TO_PINYIN = read_phrases(phrase_file_path(dict_file))
     return CHINESE_TO_PINYIN
 
+# 词语文件：与字典放在同一文件夹，每行一个词语和它的拼音，用空白分隔，# 开头的行是注释
+PHRASE_FILE = "chinese_phrases.txt"
+
+def phrase_file_path(dict_file: str) -> str:
+    """字典对应的词语文件路径"""
+    return os.path.join(os.path.dirname(dict_file), PHRASE_FILE)
+
+def is_phrase(text: str) -> bool:
+    """是否为两个字以上、全部由汉字组成的词语"""
+    return len(text) > 1 and CHINESE_CHAR_PATTERN.sub('', text) == ''
+
+def read_phrases(phrase_file: str) -> 'PhraseTable':
+    """
+    逐行流式读取词语文件，建成紧凑的词语表（PhraseTable）；文件不存在时返回空的词语表
+    无法识别的行跳过，同一词语出现多次时以最后一次为准。
+    读取时临时用 dict 去重，建表后即释放，之后只保留紧凑的数组
+    """
+    phrases = {}
+    if not os.path.exists(phrase_file):
+        return PhraseTable()
+    skipped = 0
+    try:
+        with METRICS.phase('load_phrases'), open(phrase_file, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 1)
+                if len(parts) != 2 or not is_phrase(parts[0]):
+                    skipped += 1
+                    continue
+                # 拼音中的空格去掉，与文件名中删除空格的规则一致
+                phrases[parts[0]] = ''.join(parts[1].split())
+        print(f"已加载词语文件: {phrase_file}，共 {len(phrases)} 个词语")
+        if skipped:
+            print(f"词语文件中有 {skipped} 行无法识别，已跳过")
+    except Exception as e:
+        print(f"加载词语文件失败: {e}")
+        return PhraseTable()
+    with METRICS.phase('build_phrases'):
+        return PhraseTable(phrases)
+
+# 要删除的中文符号、省略号和空格
+SYMBOLS_TO_REMOVE = {
+    '，', '。', '？', '！', '：', '；', '、', '"', '"', ''', ''', 
+    '【', '】', '（', '）', '〔', '〕', '《', '》', '〈', '〉',
+    '…', '——', '～', '·', '＋', '－', '＝', '＜', '＞',
+    '　',  # 全角空格
+    '／', '＼', '｜', '＃', '＄', '％', '＆', '＊',
+    '￥', '＠', '＾', '｀', '｛', '｝', '［', '］',
+    ' '   # 半角空格
+}
+
+# 中文字符范围
+CHINESE_CHAR_PATTERN = re.compile('[\u4e00-\u9fff]')
+
+class PhraseTable:
+    """紧凑字典树形式的词语表，按正向最长匹配替换为拼音"""
+
+    def __init__(self, phrases: Optional[Mapping] = None):
+        # 节点按层序编号：labels[i] 为节点 i 的字，其子节点为 first[i] 到 first[i + 1] - 1（按字排序），
+        # values[i] 为词语拼音的序号（不是词语结尾时为 -1），拼音首尾相接保存在 pinyin 中，offsets 为各段的起点
+        self.labels = array('I', [0])
+        self.values = array('i', [-1])
+        self.first = array('I')
+        self.offsets = array('I', [0])
+        pieces = []
+        keys = sorted(phrases) if phrases else []
+        # 队列中的每一项是一个节点覆盖的词语范围 [lo, hi) 和节点深度；范围内的词语前 depth 个字相同，
+        # 恰好等于这个前缀的词语（如果有）排在最前面
+        queue = deque([(0, len(keys), 0)])
+        while queue:
+            lo, hi, depth = queue.popleft()
+            self.first.append(len(self.labels))
+            if lo < hi and len(keys[lo]) == depth:
+                lo += 1
+            while lo < hi:
+                key = keys[lo]
+                prefix = key[:depth + 1]
+                # 下一个字不同的第一个词语，即这一组子节点的结尾
+                group_end = bisect_left(keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo, hi)
+                self.labels.append(ord(prefix[-1]))
+                if len(key) == depth + 1:
+                    self.values.append(len(self.offsets) - 1)
+                    pieces.append(phrases[key])
+                    self.offsets.append(self.offsets[-1] + len(phrases[key]))
+                else:
+                    self.values.append(-1)
+                queue.append((lo, group_end, depth + 1))
+                lo = group_end
+        self.first.append(len(self.labels))
+        self.pinyin = ''.join(pieces)
+        # 第一层（词语的首字）最多只有几千个节点，用 dict 直接定位，省去最常见的一次二分查找
+        self.root = {chr(self.labels[i]): i for i in range(self.first[0], self.first[1])}
+        self.start_pattern = re.compile('[' + ''.join(sorted(self.root)) + ']') if self.root else None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _pinyin(self, value: int) -> str:
+        return self.pinyin[self.offsets[value]:self.offsets[value + 1]]
+
+    def items(self):
+        """依次产生 (词语, 拼音)"""
+        stack = [(0, '')]
+        while stack:
+            node, prefix = stack.pop()
+            if self.values[node] >= 0:
+                yield prefix, self._pinyin(self.values[node])
+            for child in range(self.first[node + 1] - 1, self.first[node] - 1, -1):
+                stack.append((child, prefix + chr(self.labels[child])))
+
+    def match(self, text: str, start: int) -> Tuple[int, Optional[str]]:
+        """从 start 开始的最长词语，返回 (结尾位置, 拼音)，没有时返回 (start, None)"""
+        node = self.root.get(text[start]) if start < len(text) else None
+        if node is None:
+            return start, None
+        labels = self.labels
+        first = self.first
+        values = self.values
+        best_end = start
+        best_value = -1
+        for pos in range(start + 1, len(text)):
+            lo, hi = first[node], first[node + 1]
+            if lo == hi:
+                break
+            code = ord(text[pos])
+            node = bisect_left(labels, code, lo, hi)
+            if node == hi or labels[node] != code:
+                break
+            if values[node] >= 0:
+                best_end = pos + 1
+                best_value = values[node]
+        if best_value < 0:
+            return start, None
+        return best_end, self._pinyin(best_value)
+
+    def replace(self, text: str) -> str:
+        """把文本中的词语替换为拼音，其余字符不变"""
+        if self.start_pattern is None:
+            return text
+        found = self.start_pattern.search(text)
+        if found is None:
+            return text
+        
+        pieces = []
+        pos = 0
+        start = found.start()
+        end = len(text) - 1
+        while start < end:
+            match_end, pinyin = self.match(text, start)
+            if pinyin is None:
+                start += 1
+                continue
+            pieces.append(text[pos:start])
+            pieces.append(pinyin)
+            pos = start = match_end
+        if not pieces:
+            return text
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+class FilenameNormalizer:
+    """
+    文件名标准化器
+    由字典一次性构建 str.translate 转换表（中文转拼音、删除符号和空格），
+    并用有界的 LRU 缓存保存已标准化的路径组件，同名的父文件夹只计算一次
+    有词语时先按最长匹配把词语转换为拼音，剩下的字再逐字转换；
+    词语来自 phrases 参数和字典中多于一个字的键
+    """
+
+    def __init__(self, dictionary: Dict[str, str], cache_size: int = 65536,
+                 phrases: Optional[Mapping] = None):
+        self.dictionary = dictionary
+        dict_phrases = {}
+        if not isinstance(dictionary, CompiledDictionary):
+            dict_phrases = {key: pinyin for key, pinyin in dictionary.items() if is_phrase(key) and pinyin}
+        self.phrase_source = phrases
+        if isinstance(phrases, PhraseTable) and not dict_phrases:
+            table = phrases
+        else:
+            # 字典中的词语与词语表合并，词语表优先
+            if phrases:
+                dict_phrases.update(phrases.items())
+            table = PhraseTable(dict_phrases)
+        self.phrases = table if len(table) else None
+        table = {}
+        for char, pinyin in dictionary.items():
+            if len(char) == 1 and '\u4e00' <= char <= '\u9fff':
+                table[ord(char)] = pinyin
+        # 符号的删除优先于字典转换
+        for symbol in SYMBOLS_TO_REMOVE:
+            if len(symbol) == 1:
+                table[ord(symbol)] = None
+        self.table = table
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, filename: str) -> str:
+        # 分离文件名和扩展名（与 os.path.splitext 对单个路径组件的结果相同）
+        dot = filename.rfind('.')
+        if dot > 0 and filename[:dot].lstrip('.'):
+            name_part, ext_part = filename[:dot], filename[dot:]
+        else:
+            name_part, ext_part = filename, ''
+        # 先去掉英文省略号，再一次性完成转换和删除（中文省略号在转换表中删除）
+        if '...' in name_part:
+            name_part = name_part.replace('...', '')
+        if self.phrases is not None:
+            name_part = self.phrases.replace(name_part)
+        return name_part.translate(self.table) + ext_part
+
+    def normalize_many(self, filenames) -> List[str]:
+        """批量标准化文件名"""
+        normalize = self.normalize
+        return [normalize(filename) for filename in filenames]
+
+    def cache_info(self):
+        return self.normalize.cache_info()
+
+# 与当前字典对应的标准化器，字典被重新加载后自动重建
+_NORMALIZER = None
+
+def get_normalizer() -> FilenameNormalizer:
+    """获取当前字典对应的文件名标准化器"""
+    global _NORMALIZER
+    if (_NORMALIZER is None or _NORMALIZER.dictionary is not CHINESE_TO_PINYIN
+            or _NORMALIZER.phrase_source is not PHRASE_TO_PINYIN):
+        _NORMALIZER = FilenameNormalizer(CHINESE_TO_PINYIN, phrases=PHRASE_TO_PINYIN)
+    return _NORMALIZER
+
 def normalize_filename(filename: str) -> str:
     """
     将文件名中的中文字符转换为拼音，去掉中文符号、省略号和空格
     保留文件扩展名不变
     """
-    global CHINESE_TO_PINYIN
-    
-    # 分离文件名和扩展名
-    name_part, ext_part = os.path.splitext(filename)
-    
-    # 定义要删除的中文符号、省略号和空格
-    symbols_to_remove = {
-        '，', '。', '？', '！', '：', '；', '、', '"', '"', ''', ''', 
-        '【', '】', '（', '）', '〔', '〕', '《', '》', '〈', '〉',
-        '…', '——', '～', '·', '＋', '－', '＝', '＜', '＞',
-        '　',  # 全角空格
-        '／', '＼', '｜', '＃', '＄', '％', '＆', '＊',
-        '￥', '＠', '＾', '｀', '｛', '｝', '［', '］',
-        ' '   # 半角空格
-    }
-    
-    # 英文省略号
-    ellipsis = {'...', '…'}
+    return get_normalizer().normalize(filename)
+
+def extract_chinese_characters(text: str) -> set:
+    """从文本中提取所有中文字符"""
+    return set(CHINESE_CHAR_PATTERN.findall(text))
+
+def iter_tree(target_path: str, dir_index: Optional[dict] = None):
+    """
+    用 os.scandir 遍历目标文件夹，顺序与 os.walk 相同
+    依次产生 (相对路径, 名称, 是否文件夹, 深度)，同一文件夹下先文件夹后文件
     
-    result = []
-    i = 0
-    while i < len(name_part):
-        char = name_part[i]
-        
-        # 检查是否是省略号（英文或中文）
-        if char == '.' and i + 2 < len(name_part) and name_part[i:i+3] == '...':
-            # 跳过英文省略号
-            i += 3
-            continue
-        elif char == '…':
-            # 跳过中文省略号
-            i += 1
-            continue
+    提供 dir_index 时为增量模式：修改时间未变、且路径和其中文件名都不含中文的文件夹
+    不再列出内容，直接使用索引中记录的子文件夹，其中的文件也不再产生
+    """
+    visited = set()
+    # 栈中保存 (绝对路径, 相对路径, 深度)
+    stack = [(target_path, '', 0)]
+    while stack:
+        dir_path, rel_dir, depth = stack.pop()
         
-        # 检查是否是需要删除的符号或空格
-        if char in symbols_to_remove:
-            # 跳过符号和空格
-            i += 1
-            continue
+        record = None
+        if dir_index is not None:
+            visited.add(rel_dir)
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            record = dir_index.get(rel_dir)
+            if record is not None and (record['mtime_ns'] != mtime_ns or not record['clean']):
+                record = None
         
-        # 处理中文字符
-        if '\u4e00' <= char <= '\u9fff':  # 中文字符
-            pinyin = CHINESE_TO_PINYIN.get(char, char)  # 如果没有拼音，保持原字符
-            result.append(pinyin)
+        if record is not None:
+            # 文件夹内容未变化，直接使用索引中的子文件夹
+            subdir_names = record['dirs']
+            file_names = []
+            METRICS.count('dirs_from_index')
         else:
-            # 保留英文、数字和英文符号
-            result.append(char)
-        
-        i += 1
+            dirs = []
+            file_names = []
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            dirs.append(entry)
+                        else:
+                            file_names.append(entry.name)
+            except OSError:
+                continue
+            METRICS.count('dirs_listed')
+            
+            subdir_names = []
+            for entry in dirs:
+                # 与 os.walk 一样不进入符号链接指向的文件夹
+                try:
+                    walk_into = not entry.is_symlink()
+                except OSError:
+                    walk_into = False
+                subdir_names.append([entry.name, walk_into])
+            
+            if dir_index is not None:
+                clean = (CHINESE_CHAR_PATTERN.search(rel_dir) is None and
+                         not any(CHINESE_CHAR_PATTERN.search(name) for name in file_names))
+                dir_index[rel_dir] = {'mtime_ns': mtime_ns, 'dirs': subdir_names, 'clean': clean}
+
+        subdirs = []
+        for name, walk_into in subdir_names:
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            yield rel_path, name, True, depth
+            if walk_into:
+                subdirs.append((os.path.join(dir_path, name), rel_path, depth + 1))
+        for name in file_names:
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            yield rel_path, name, False, depth
+
+        # 反向入栈，保证按原顺序先序遍历
+        stack.extend(reversed(subdirs))
     
-    # 重新组合文件名和扩展名
-    return ''.join(result) + ext_part
+    # 删除已经不存在的文件夹的记录
+    if dir_index is not None:
+        for rel_dir in [rel_dir for rel_dir in dir_index if rel_dir not in visited]:
+            del dir_index[rel_dir]
 
-def extract_chinese_characters(text: str) -> set:
-    """从文本中提取所有中文字符"""
-    chinese_chars = set()
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':  # 中文字符范围
-            chinese_chars.add(char)
-    return chinese_chars
-
-def generate_preview_log(target_path: str, log_file: str):
-    """生成预转换日志，供用户预览"""
-    global CHINESE_TO_PINYIN
-    
-    preview_content = []
-    preview_content.append("=== 文件和文件夹重命名预览 ===\n")
-    
-    # 检查字典完整性
-    missing_chars = []
-    for root, dirs, files in os.walk(target_path):
-        # 检查文件夹名中的中文字符
-        for dir_name in dirs:
-            chinese_chars = extract_chinese_characters(dir_name)
-            for char in chinese_chars:
-                if char not in CHINESE_TO_PINYIN:
-                    missing_chars.append(char)
-        
-        # 检查文件名中的中文字符
-        for file in files:
-            chinese_chars = extract_chinese_characters(file)
-            for char in chinese_chars:
-                if char not in CHINESE_TO_PINYIN:
-                    missing_chars.append(char)
-    
-    if missing_chars:
-        preview_content.append(f"警告：字典中缺少以下字符的拼音：{', '.join(set(missing_chars))}\n")
-        preview_content.append("请先完善字典后再进行转换！\n\n")
-    
-    # 构建完整的重命名映射
-    def normalize_path(path: str) -> str:
-        """标准化路径中的所有组件"""
-        parts = path.split(os.sep)
-        normalized_parts = []
-        for part in parts:
-            if part:  # 跳过空字符串
-                normalized_parts.append(normalize_filename(part))
-        return os.sep.join(normalized_parts)
-    
-    # 收集所有需要重命名的项目
-    folder_renames = []
-    file_renames = []
-    
-    # 扫描要重命名的文件夹
-    for root, dirs, files in os.walk(target_path):
-        for dir_name in dirs:
-            # 构建完整的文件夹路径
-            full_dir_path = os.path.join(root, dir_name)
-            relative_path = os.path.relpath(full_dir_path, target_path)
+def iter_subtree(target_path: str, rel_path: str):
+    """产生目标文件夹中的一个条目，是文件夹时接着产生其中的全部内容，格式与 iter_tree 相同"""
+    path = os.path.join(target_path, rel_path)
+    is_dir = os.path.isdir(path)
+    depth = rel_path.count(os.sep)
+    yield rel_path, os.path.basename(rel_path), is_dir, depth
+    if is_dir and not os.path.islink(path):
+        for sub_rel, name, sub_is_dir, sub_depth in iter_tree(path):
+            yield os.path.join(rel_path, sub_rel), name, sub_is_dir, depth + 1 + sub_depth
+
+def scan_tree(target_path: str, index: Optional[FileStateIndex] = None,
+              normalizer: Optional[FilenameNormalizer] = None, subtree: Optional[str] = None) -> RenamePlan:
+    """
+    单次遍历目标文件夹，生成重命名计划
+    提供 index 时为增量模式，只处理新增或有变化的文件夹中的文件
+    提供 normalizer 时使用它及其字典，否则使用全局字典
+    指定 subtree（相对路径）时只处理该条目及其中的内容，不使用 index（监视模式中处理新出现的条目）
+    """
+    plan = RenamePlan(target_path)
+    if normalizer is None:
+        normalizer = get_normalizer()
+    dictionary = normalizer.dictionary
+    has_phrases = normalizer.phrases is not None
+    normalize = normalizer.normalize
+    cache_before = normalizer.cache_info()
+    scanned = 0
+    # 每个文件夹的标准化路径及其路径中是否含中文，子项直接复用，避免对同一父路径重复标准化
+    dir_info = {'': ('', False)}
+    
+    if subtree is None:
+        dir_index = index.tree(target_path) if index is not None else None
+        entries = iter_tree(target_path, dir_index)
+    else:
+        parent_rel = os.path.dirname(subtree)
+        if parent_rel:
+            dir_info[parent_rel] = (os.sep.join(normalize(part) for part in parent_rel.split(os.sep)),
+                                    CHINESE_CHAR_PATTERN.search(parent_rel) is not None)
+        entries = iter_subtree(target_path, subtree)
+    with METRICS.phase('scan_tree'):
+        for rel_path, name, is_dir, depth in entries:
+            scanned += 1
+            parent_rel = os.path.dirname(rel_path)
+            parent_new_rel, parent_has_chinese = dir_info[parent_rel]
             
-            # 检查相对路径中是否包含中文字符
-            chinese_chars = extract_chinese_characters(relative_path)
-            if chinese_chars:
-                # 计算标准化后的相对路径
-                new_relative_path = normalize_path(relative_path)
-                if relative_path != new_relative_path:
-                    folder_renames.append((relative_path, new_relative_path))
-    
-    # 扫描要重命名的文件
-    for root, dirs, files in os.walk(target_path):
-        for file in files:
-            # 构建完整的文件路径
-            full_file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(full_file_path, target_path)
+            chinese_chars = extract_chinese_characters(name)
+            missing = [char for char in chinese_chars if char not in dictionary]
             
-            # 检查相对路径中是否包含中文字符（包括目录和文件名）
-            chinese_chars = extract_chinese_characters(relative_path)
-            if chinese_chars:
-                # 计算标准化后的相对路径
-                new_relative_path = normalize_path(relative_path)
-                if relative_path != new_relative_path:
-                    file_renames.append((relative_path, new_relative_path))
-    
-    # 输出文件夹重命名预览
-    for old_path, new_path in folder_renames:
-        preview_content.append(f"文件夹: {old_path} -> {new_path}\n")
-    
-    # 输出文件重命名预览
-    for old_path, new_path in file_renames:
-        preview_content.append(f"文件: {old_path} -> {new_path}\n")
-    
-    folder_rename_count = len(folder_renames)
-    file_rename_count = len(file_renames)
+            has_chinese = parent_has_chinese or bool(chinese_chars)
+            if is_dir or has_chinese:
+                normalized = normalize(name)
+                new_rel_path = parent_new_rel + os.sep + normalized if parent_rel else normalized
+            if missing:
+                # 已经按词语转换的字不算缺失
+                if has_phrases:
+                    missing = [char for char in missing if char in normalized]
+                plan.missing_chars.update(missing)
+            if is_dir:
+                dir_info[rel_path] = (new_rel_path, has_chinese)
+            
+            if has_chinese:
+                new_name = normalized if chinese_chars else name
+                plan.entries.append(PlanEntry(rel_path, name, is_dir, depth, new_name, new_rel_path))
+    
+    cache_after = normalizer.cache_info()
+    METRICS.count('entries_scanned', scanned)
+    METRICS.count('entries_planned', len(plan.entries))
+    METRICS.count('normalize_cache_hits', cache_after.hits - cache_before.hits)
+    METRICS.count('normalize_cache_misses', cache_after.misses - cache_before.misses)
+    return plan
+
+def write_log_view(records, summary: dict, log_file: str):
+    """
+    生成供人阅读的预览日志
+    records 需要先给出所有文件夹记录，再给出所有文件记录
+    """
+    with open(log_file, 'w', encoding='utf-8') as f:
+        f.write("=== 文件和文件夹重命名预览 ===\n")
+        
+        # 检查字典完整性
+        if summary['missing_chars']:
+            counts = summary.get('missing_counts')
+            if counts:
+                chars = [f"{char}({counts.get(char, 0)})" for char in summary['missing_chars']]
+            else:
+                chars = summary['missing_chars']
+            f.write(f"警告：字典中缺少以下字符的拼音：{', '.join(chars)}\n")
+            f.write("请先完善字典后再进行转换！\n\n")
+        
+        for record in records:
+            if record['old'] == record['new']:
+                continue
+            label = '文件夹' if record['type'] == 'folder' else '文件'
+            f.write(f"{label}: {record['old']} -> {record['new']}\n")
+        
+        f.write(f"\n总计需要重命名的文件夹: {summary['folders']}\n")
+        f.write(f"总计需要重命名的文件: {summary['files']}\n")
+
+def write_log_from_plan_file(plan_file: str, log_file: str):
+    """由计划文件生成预览日志"""
+    records = itertools.chain(iter_plan_file(plan_file, 'folder'), iter_plan_file(plan_file, 'file'))
+    write_log_view(records, read_plan_summary(plan_file), log_file)
+
+def generate_preview_log(target_path: str, log_file: Optional[str], plan: Optional[RenamePlan] = None,
+                         plan_file: Optional[str] = None):
+    """
+    生成重命名计划文件和预转换日志，供用户预览
+    指定 plan_file 时日志由计划文件生成；log_file 为 None 时不生成日志
+    """
+    if plan is None:
+        plan = scan_tree(target_path)
     
-    preview_content.append(f"\n总计需要重命名的文件夹: {folder_rename_count}\n")
-    preview_content.append(f"总计需要重命名的文件: {file_rename_count}\n")
+    folder_rename_count = len(plan.folder_renames)
+    file_rename_count = len(plan.file_renames)
+    missing_chars = plan.missing_chars
     
-    # 保存预览日志
+    # 保存计划文件和预览日志
     try:
-        with open(log_file, 'w', encoding='utf-8') as f:
-            f.writelines(preview_content)
-        print(f"预览日志已保存到: {log_file}")
+        if plan_file:
+            with METRICS.phase('write_plan'):
+                write_plan_file(plan, plan_file)
+            print(f"重命名计划已保存到: {plan_file}")
+        if log_file:
+            with METRICS.phase('write_log'):
+                if plan_file:
+                    write_log_from_plan_file(plan_file, log_file)
+                else:
+                    records = [entry_to_record(entry) for entry in plan.entries if entry.is_dir]
+                    records += [entry_to_record(entry) for entry in plan.entries if not entry.is_dir]
+                    summary = {'folders': folder_rename_count, 'files': file_rename_count,
+                               'missing_chars': sorted(missing_chars)}
+                    write_log_view(records, summary, log_file)
+            print(f"预览日志已保存到: {log_file}")
         print(f"发现 {folder_rename_count} 个需要重命名的文件夹")
         print(f"发现 {file_rename_count} 个需要重命名的文件")
         return (folder_rename_count > 0 or file_rename_count > 0), len(missing_chars) == 0
@@ -194,112 +496,505 @@ def generate_preview_log(target_path: str, log_file: str):
         print(f"保存预览日志失败: {e}")
         return False, False
 
-def rename_files(target_path: str):
-    """实际执行文件和文件夹重命名"""
-    global CHINESE_TO_PINYIN
-    
-    renamed_folders = 0
-    renamed_files = 0
-    
-    # 先收集所有需要重命名的文件夹，按深度排序（深度大的先处理）
-    folders_to_rename = []
-    for root, dirs, files in os.walk(target_path):
-        for dir_name in dirs:
-            chinese_chars = extract_chinese_characters(dir_name)
-            if chinese_chars:
-                old_dir_path = os.path.join(root, dir_name)
-                new_dir_name = normalize_filename(dir_name)
-                new_dir_path = os.path.join(root, new_dir_name)
-                
-                if old_dir_path != new_dir_path:
-                    # 计算深度（路径分隔符的数量）
-                    depth = old_dir_path.count(os.sep)
-                    folders_to_rename.append((depth, old_dir_path, new_dir_path, dir_name, new_dir_name))
-    
-    # 按深度降序排序，先处理深层文件夹
-    folders_to_rename.sort(reverse=True)
+# 流式预览时打印进度的间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+def stream_preview(target_path: str, plan_file: str, log_file: Optional[str],
+                   index: Optional[FileStateIndex] = None,
+                   normalizer: Optional[FilenameNormalizer] = None,
+                   progress_interval: Optional[float] = PROGRESS_INTERVAL) -> dict:
+    """
+    流式预览：边遍历边把记录写入计划文件，不在内存中保存计划，适合上百万条目的目录树
+    计划文件中文件夹和文件记录按发现顺序交错写入，预览日志仍然先列文件夹后列文件（由计划文件分两次读出）
+    缺失的字去重后记录出现次数；progress_interval 为 None 时不打印进度
+    返回汇总记录（folders、files、missing_chars、missing_counts）
     
-    # 重命名文件夹
-    for depth, old_dir_path, new_dir_path, old_name, new_name in folders_to_rename:
+    内存占用与目录树大小无关：父文件夹的标准化路径只缓存上一个，遍历栈只保存待处理的子文件夹，
+    只有单个文件夹中的文件名列表和使用增量索引时的索引本身与规模有关
+    """
+    if normalizer is None:
+        normalizer = get_normalizer()
+    dictionary = normalizer.dictionary
+    has_phrases = normalizer.phrases is not None
+    normalize = normalizer.normalize
+    cache_before = normalizer.cache_info()
+    missing_counts = {}        # type: Dict[str, int]
+    scanned = 0
+    planned = 0
+    # iter_tree 连续产生同一文件夹中的条目，只缓存上一个父文件夹的 (相对路径, 标准化路径, 是否含中文)
+    last_parent = ('', '', False)
+    started = last_report = time.perf_counter()
+    
+    dir_index = index.tree(target_path) if index is not None else None
+    writer = PlanWriter(plan_file, target_path)
+    try:
+        with METRICS.phase('scan_tree'):
+            for rel_path, name, is_dir, depth in iter_tree(target_path, dir_index):
+                scanned += 1
+                parent_rel = os.path.dirname(rel_path)
+                if parent_rel != last_parent[0]:
+                    last_parent = (parent_rel,
+                                   os.sep.join(normalize(part) for part in parent_rel.split(os.sep)),
+                                   CHINESE_CHAR_PATTERN.search(parent_rel) is not None)
+                _, parent_new_rel, parent_has_chinese = last_parent
+                
+                chinese_chars = extract_chinese_characters(name)
+                has_chinese = parent_has_chinese or bool(chinese_chars)
+                if has_chinese:
+                    normalized = normalize(name)
+                    missing = [char for char in chinese_chars if char not in dictionary]
+                    # 已经按词语转换的字不算缺失
+                    if missing and has_phrases:
+                        missing = [char for char in missing if char in normalized]
+                    for char in missing:
+                        missing_counts[char] = missing_counts.get(char, 0) + 1
+                    new_rel_path = parent_new_rel + os.sep + normalized if parent_rel else normalized
+                    new_name = normalized if chinese_chars else name
+                    writer.write(PlanEntry(rel_path, name, is_dir, depth, new_name, new_rel_path))
+                    planned += 1
+                
+                if progress_interval is not None and scanned % 1000 == 0:
+                    now = time.perf_counter()
+                    if now - last_report >= progress_interval:
+                        last_report = now
+                        print(f"已扫描 {scanned} 个条目，{planned} 个需要处理，"
+                              f"缺少拼音的字 {len(missing_counts)} 个（{now - started:.1f} 秒）", flush=True)
+    finally:
+        writer.close(missing_counts.keys(), dict(sorted(missing_counts.items())))
+    
+    cache_after = normalizer.cache_info()
+    METRICS.count('entries_scanned', scanned)
+    METRICS.count('entries_planned', planned)
+    METRICS.count('normalize_cache_hits', cache_after.hits - cache_before.hits)
+    METRICS.count('normalize_cache_misses', cache_after.misses - cache_before.misses)
+    if progress_interval is not None:
+        print(f"扫描完成：共 {scanned} 个条目，{planned} 个需要处理")
+    print(f"重命名计划已保存到: {plan_file}")
+    
+    if log_file:
+        with METRICS.phase('write_log'):
+            write_log_from_plan_file(plan_file, log_file)
+        print(f"预览日志已保存到: {log_file}")
+    return read_plan_summary(plan_file)
+
+def current_rel_path(rel_path: str, moved: Optional[Dict[str, str]]) -> str:
+    """计划中的相对路径在部分文件夹已经重命名后的实际位置，moved 为已重命名文件夹的原相对路径到新名称"""
+    if not moved:
+        return rel_path
+    parts = rel_path.split(os.sep)
+    current = list(parts)
+    for i in range(len(parts)):
+        new_name = moved.get(os.sep.join(parts[:i + 1]))
+        if new_name is not None:
+            current[i] = new_name
+    return os.sep.join(current)
+
+def _rename_entries(target_path: str, entries: List[PlanEntry],
+                    moved: Optional[Dict[str, str]] = None) -> List[Tuple[PlanEntry, Optional[str]]]:
+    """
+    按顺序重命名一组条目，返回 (条目, 错误信息) 列表
+    继续执行时 moved 为已重命名的文件夹；原名称已不存在而新名称存在的条目视为在中断前已经完成
+    """
+    results = []
+    for entry in entries:
+        old_path = os.path.join(target_path, current_rel_path(entry.rel_path, moved))
+        new_path = os.path.join(os.path.dirname(old_path), entry.new_name)
         try:
-            os.rename(old_dir_path, new_dir_path)
-            print(f"已重命名文件夹: {old_name} -> {new_name}")
-            renamed_folders += 1
+            os.rename(old_path, new_path)
+            results.append((entry, None))
+        except FileNotFoundError as e:
+            if moved is not None and os.path.lexists(new_path):
+                results.append((entry, None))
+            else:
+                results.append((entry, str(e)))
         except Exception as e:
-            print(f"重命名文件夹失败: {old_name} -> {new_name}, 错误: {e}")
-    
-    # 重命名文件（需要重新遍历，因为文件夹路径可能已经改变）
-    for root, dirs, files in os.walk(target_path):
-        for file in files:
-            chinese_chars = extract_chinese_characters(file)
-            if chinese_chars:
-                old_path = os.path.join(root, file)
-                new_name = normalize_filename(file)
-                new_path = os.path.join(root, new_name)
-                
-                if old_path != new_path:
-                    try:
-                        os.rename(old_path, new_path)
-                        print(f"已重命名文件: {file} -> {new_name}")
-                        renamed_files += 1
-                    except Exception as e:
-                        print(f"重命名文件失败: {file} -> {new_name}, 错误: {e}")
-    
-    print(f"\n总计重命名了 {renamed_folders} 个文件夹")
-    print(f"总计重命名了 {renamed_files} 个文件")
-    return renamed_folders + renamed_files
+            results.append((entry, str(e)))
+    return results
 
-def main():
-    """主函数"""
-    print("=== 音频文件重命名工具 ===")
+def execute_renames(target_path: str, plan: RenamePlan, workers: int = 1,
+                    journal: Optional[Journal] = None, done: Optional[set] = None) -> dict:
+    """
+    执行重命名计划，返回报告：重命名的文件夹数、文件数，以及每个失败条目的路径、新名称和错误信息
+    提供 journal 时把每个完成的条目记录到执行日志；继续执行时 done 为已完成条目的原相对路径，这些条目直接跳过
     
-    # 1. 获取目标文件夹路径
-    target_path = input("请输入目标文件夹路径: ").strip().strip('"')
+    每个文件夹在其中所有要重命名的条目都完成之后才重命名，因此执行任何一次重命名时
+    上层文件夹都还是原名，直接使用计划中的原路径即可。workers 大于 1 时用线程池执行，
+    不同文件夹中的条目和互不相关的子树同时进行，适合每次重命名都要一次网络往返的 SMB/NFS。
+    同一文件夹下新名称相同的条目合成一个任务按原顺序执行，结果与逐个执行相同
+    """
+    moved = None
+    remaining = plan.entries
+    if done is not None:
+        # 已完成的文件夹中的条目都已完成（失败的除外），这些条目要按文件夹的新名称找到
+        moved = {entry.rel_path: entry.new_name for entry in remaining if entry.is_dir and entry.rel_path in done}
+        remaining = [entry for entry in remaining if entry.rel_path not in done]
+    
+    # 按 (上层文件夹, 新名称) 分组，文件夹在前（深的先、同深度按路径倒序），文件按计划顺序
+    folders = [entry for entry in remaining if entry.is_dir and entry.new_name != entry.name]
+    folders.sort(key=lambda entry: (entry.depth, entry.rel_path), reverse=True)
+    files = [entry for entry in remaining if not entry.is_dir and entry.new_name != entry.name]
+    groups = {}
+    for entry in itertools.chain(folders, files):
+        groups.setdefault((os.path.dirname(entry.rel_path), entry.new_name), []).append(entry)
+    tasks = list(groups.values())
+    
+    # 每个文件夹所在的任务，以及每个任务还要等待完成的条目数
+    folder_task = {}
+    for task_id, entries in enumerate(tasks):
+        for entry in entries:
+            if entry.is_dir:
+                folder_task[entry.rel_path] = task_id
+    pending = [0] * len(tasks)
+    
+    def blocking_task(entry: PlanEntry) -> Optional[int]:
+        """最近一层要重命名的上层文件夹所在的任务"""
+        rel_dir = os.path.dirname(entry.rel_path)
+        while rel_dir:
+            task_id = folder_task.get(rel_dir)
+            if task_id is not None:
+                return task_id
+            rel_dir = os.path.dirname(rel_dir)
+        return None
+    
+    blockers = {}
+    for entries in tasks:
+        for entry in entries:
+            task_id = blocking_task(entry)
+            blockers[entry.rel_path] = task_id
+            if task_id is not None:
+                pending[task_id] += 1
+    
+    report = {'renamed_folders': 0, 'renamed_files': 0, 'failures': []}
+    if done is not None:
+        report['skipped'] = len(plan.entries) - len(remaining)
+    ready = deque(task_id for task_id in range(len(tasks)) if pending[task_id] == 0)
+    
+    def finish(results: List[Tuple[PlanEntry, Optional[str]]]):
+        """记录一个任务的结果，并放出所有条目都已完成的上层文件夹任务"""
+        for entry, error in results:
+            kind = '文件夹' if entry.is_dir else '文件'
+            if error is None:
+                print(f"已重命名{kind}: {entry.name} -> {entry.new_name}")
+                report['renamed_folders' if entry.is_dir else 'renamed_files'] += 1
+                if journal is not None:
+                    journal.record({'op': 'rename', 'path': entry.rel_path, 'new_name': entry.new_name,
+                                    'is_dir': entry.is_dir})
+            else:
+                print(f"重命名{kind}失败: {entry.name} -> {entry.new_name}, 错误: {error}")
+                report['failures'].append({'path': entry.rel_path, 'new_name': entry.new_name,
+                                           'is_dir': entry.is_dir, 'error': error})
+            task_id = blockers[entry.rel_path]
+            if task_id is not None:
+                pending[task_id] -= 1
+                if pending[task_id] == 0:
+                    ready.append(task_id)
+    
+    with METRICS.phase('rename'):
+        if workers <= 1:
+            while ready:
+                finish(_rename_entries(target_path, tasks[ready.popleft()], moved))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                running = set()
+                while ready or running:
+                    while ready:
+                        running.add(executor.submit(_rename_entries, target_path, tasks[ready.popleft()],
+                                                     moved))
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future.result())
+    
+    # 失败条目按计划顺序排列
+    order = {entry.rel_path: number for number, entry in enumerate(plan.entries)}
+    report['failures'].sort(key=lambda failure: order[failure['path']])
+    
+    METRICS.count('rename_syscalls', report['renamed_folders'] + report['renamed_files'] + len(report['failures']))
+    METRICS.count('rename_failures', len(report['failures']))
+    return report
+
+def rename_files(target_path: str, plan: Optional[RenamePlan] = None, workers: int = 1):
+    """实际执行文件和文件夹重命名，workers 大于 1 时用线程池并行执行"""
+    if plan is None:
+        plan = scan_tree(target_path)
+    
+    report = execute_renames(target_path, plan, workers)
+    print_rename_report(report)
+    return report['renamed_folders'] + report['renamed_files']
+
+def print_rename_report(report: dict):
+    if report.get('skipped'):
+        print(f"\n跳过了 {report['skipped']} 个上次已完成的条目")
+    print(f"\n总计重命名了 {report['renamed_folders']} 个文件夹")
+    print(f"总计重命名了 {report['renamed_files']} 个文件")
+    if report['failures']:
+        print(f"有 {len(report['failures'])} 个条目重命名失败")
+
+# 视为成功的重命名结果状态
+RENAME_OK_STATUSES = ('renamed', 'dry_run', 'nothing_to_rename')
+
+def prepare_rename(target_path: str, dict_file: str = DICT_FILE, plan_file: Optional[str] = PLAN_FILE,
+                   log_file: Optional[str] = LOG_FILE,
+                   index_file: Optional[str] = None,
+                   stream: bool = False) -> Tuple[dict, Optional[RenamePlan], Optional[FileStateIndex]]:
+    """
+    检查路径、加载字典、扫描目标文件夹并生成计划和预览日志，返回 (结果字典, 计划, 索引)
+    没有需要重命名的条目或不能继续时计划为 None，原因记录在结果状态中
+    stream 时使用流式预览，计划只写入计划文件（未指定时为 PLAN_FILE），返回的计划总是 None，
+    是否可以继续以结果状态是否为 planned 为准
+    字典只在本次调用中使用，不修改全局字典
+    """
+    if stream and not plan_file:
+        plan_file = PLAN_FILE
+    result = {
+        'target': target_path,
+        'status': 'error',
+        'folders': 0,
+        'files': 0,
+        'renamed': 0,
+        'failures': [],
+        'missing_chars': [],
+        'plan_file': plan_file,
+        'log_file': log_file,
+    }
     
     if not os.path.exists(target_path):
         print(f"错误：路径不存在: {target_path}")
-        return
-    
-    # 字典文件和日志文件路径
-    dict_file = "chinese_dictionary.json"
-    log_file = "rename_log.txt"
-    
-    # 2. 加载字典
-    load_dictionary(dict_file)
+        result['error'] = f"路径不存在: {target_path}"
+        return result, None, None
     
-    if not CHINESE_TO_PINYIN:
+    dictionary = read_dictionary(dict_file)
+    if not dictionary:
         print("错误：字典文件为空或不存在，请先准备好字典文件")
-        return
+        result['error'] = f"字典文件为空或不存在: {dict_file}"
+        return result, None, None
     
-    # 3. 生成预转换日志
+    # 扫描目标文件夹并生成预转换日志
     print("\n=== 生成预转换日志 ===")
-    has_files, dict_complete = generate_preview_log(target_path, log_file)
+    index = FileStateIndex(index_file) if index_file else None
+    phrases = read_phrases(phrase_file_path(dict_file))
+    normalizer = FilenameNormalizer(dictionary, phrases=phrases)
+    if stream:
+        plan = None
+        try:
+            summary = stream_preview(target_path, plan_file, log_file, index, normalizer)
+        except Exception as e:
+            print(f"保存预览日志失败: {e}")
+            result['error'] = str(e)
+            return result, None, None
+        print(f"发现 {summary['folders']} 个需要重命名的文件夹")
+        print(f"发现 {summary['files']} 个需要重命名的文件")
+        has_files = summary['folders'] > 0 or summary['files'] > 0
+        dict_complete = not summary['missing_chars']
+        result.update(folders=summary['folders'], files=summary['files'],
+                      missing_chars=summary['missing_chars'], missing_counts=summary['missing_counts'])
+    else:
+        plan = scan_tree(target_path, index, normalizer)
+        has_files, dict_complete = generate_preview_log(target_path, log_file, plan, plan_file)
+        result.update(folders=len(plan.folder_renames), files=len(plan.file_renames),
+                      missing_chars=sorted(plan.missing_chars))
+    if index is not None:
+        with METRICS.phase('save_index'):
+            index.save()
     
     if not has_files:
         print("没有需要重命名的文件和文件夹")
-        return
+        result['status'] = 'nothing_to_rename'
+        return result, None, index
     
     if not dict_complete:
         print("字典不完整，请先完善字典文件")
-        return
+        result['status'] = 'incomplete_dictionary'
+        return result, None, index
+    
+    result['status'] = 'planned'
+    return result, plan, index
+
+def run_rename(target_path: str, dict_file: str = DICT_FILE, plan_file: Optional[str] = PLAN_FILE,
+               log_file: Optional[str] = LOG_FILE, index_file: Optional[str] = None,
+               dry_run: bool = False, confirm=None, threads: int = 1, stream: bool = False,
+               journal_dir: Optional[str] = None) -> dict:
+    """
+    非交互的重命名接口：生成重命名计划和预览日志，确认后执行重命名，返回结果字典
+    confirm 为确认回调（参数为日志文件路径，返回 True 时继续），为 None 时直接执行；
+    dry_run 时只生成计划和日志；threads 为执行重命名的线程数
+    stream 时使用流式预览，确认执行后才从计划文件读回计划
+    指定 journal_dir 时把完成的重命名记录到执行日志，中断后可以用 resume_journal 继续、用 rollback_journal 撤销；
+    该文件夹中有未完成的执行日志时不开始新的执行
+    重命名失败的条目记录在结果的 failures 中
+    结果状态：renamed / dry_run / nothing_to_rename / incomplete_dictionary / cancelled / error
+    """
+    if not dry_run and not check_journal(journal_dir):
+        return {'target': target_path, 'status': 'error', 'folders': 0, 'files': 0, 'renamed': 0,
+                'failures': [], 'missing_chars': [], 'plan_file': plan_file, 'log_file': log_file,
+                'error': f"上一次执行没有完成: {journal_dir}"}
+    
+    result, plan, _ = prepare_rename(target_path, dict_file, plan_file, log_file, index_file, stream)
+    if result['status'] != 'planned':
+        return result
+    
+    if dry_run:
+        print("预演模式，不执行重命名")
+        result['status'] = 'dry_run'
+        return result
     
-    # 4. 用户确认是否继续
-    print(f"\n请查看预转换日志: {log_file}")
-    choice = input("是否继续进行文件和文件夹重命名？(y/n): ").strip().lower()
-    if choice != 'y':
+    if confirm is not None and not confirm(log_file):
         print("操作已取消")
-        return
+        result['status'] = 'cancelled'
+        return result
     
-    # 5. 执行文件重命名
+    # 执行文件重命名
     print("\n=== 执行文件和文件夹重命名 ===")
-    renamed_count = rename_files(target_path)
+    if plan is None:
+        plan = load_plan_file(result['plan_file'])
+    journal = None
+    if journal_dir:
+        journal = Journal.create(journal_dir, target_path)
+        write_plan_file(plan, journal.plan_file)
+    try:
+        report = execute_renames(target_path, plan, threads, journal)
+    finally:
+        if journal is not None:
+            journal.close(complete=sys.exc_info()[0] is None)
+    print_rename_report(report)
+    result['renamed'] = report['renamed_folders'] + report['renamed_files']
+    result['failures'] = report['failures']
+    result['status'] = 'renamed'
+    return result
+
+def confirm_rename(log_file: Optional[str]) -> bool:
+    """在控制台询问是否执行重命名"""
+    if log_file:
+        print(f"\n请查看预转换日志: {log_file}")
+    return input("是否继续进行文件和文件夹重命名？(y/n): ").strip().lower() == 'y'
+
+def unjournaled_renames(target_path: str, plan_file: str,
+                        renames: Dict[str, dict]) -> Iterator[Tuple[PlanEntry, str]]:
+    """
+    依次产生计划中已经完成但没有记入执行日志的重命名（重命名后、写入记录前被中断）和它所在的文件夹，
+    与继续执行时的判断相同：原名称已不存在而新名称存在。上层文件夹按已记录的重命名确定位置
+    条目按深度从浅到深检查，每个条目都在调用方处理完上一个之后才检查：
+    上层文件夹先恢复原名称，其中的条目才能按原路径找到
+    """
+    moved = {path: record['new_name'] for path, record in renames.items() if record['is_dir']}
+    entries = [entry for entry in load_plan_file(plan_file).entries
+               if entry.rel_path not in renames and entry.new_name != entry.name]
+    entries.sort(key=lambda entry: entry.depth)
+    for entry in entries:
+        parent = os.path.join(target_path, current_rel_path(os.path.dirname(entry.rel_path), moved))
+        if (not os.path.lexists(os.path.join(parent, entry.name))
+                and os.path.lexists(os.path.join(parent, entry.new_name))):
+            yield entry, parent
+
+def _undo_rename(parent: str, rel_path: str, new_name: str) -> bool:
+    """
+    把 parent 中的 new_name 改回原名称，返回是否执行了重命名；
+    新名称已不存在而原名称存在时视为已经撤销（撤销后、写入记录前被中断）
+    """
+    old_path = os.path.join(parent, os.path.basename(rel_path))
+    new_path = os.path.join(parent, new_name)
+    try:
+        os.rename(new_path, old_path)
+        return True
+    except FileNotFoundError:
+        if os.path.lexists(old_path):
+            return False
+        raise
+
+def rollback_journal(journal_dir: str = JOURNAL_DIR) -> dict:
+    """
+    根据执行日志撤销上一次执行：按相反顺序把重命名改回原名称，再用备份恢复改写过的RPY文件
+    执行日志中缺少的最后几条重命名按计划和文件系统的实际状态找出，先行撤销；
+    每个撤销的条目都记入执行日志，撤销中断或部分失败后可以再次运行，已撤销的条目不会重复处理
+    全部撤销成功后删除执行日志文件夹中的日志和备份
+    结果状态：rolled_back / nothing_to_rollback / error
+    """
+    result = {'journal': journal_dir, 'status': 'error', 'restored': 0, 'rpy_restored': 0, 'failures': []}
+    try:
+        state = read_journal(journal_dir)
+    except Exception as e:
+        print(f"读取执行日志失败: {e}")
+        result['error'] = str(e)
+        return result
+    if state is None:
+        print(f"没有找到执行日志: {journal_dir}")
+        result['status'] = 'nothing_to_rollback'
+        return result
+    
+    header = state['header']
+    journal = Journal.reopen(journal_dir)
+    failures = result['failures']
+    print("\n=== 撤销重命名 ===")
+    try:
+        with METRICS.phase('rollback'):
+            if header['target'] and os.path.exists(journal.plan_file):
+                for entry, parent in unjournaled_renames(header['target'], journal.plan_file, state['renames']):
+                    try:
+                        _undo_rename(parent, entry.rel_path, entry.new_name)
+                        print(f"已撤销执行日志中缺少的重命名: {entry.new_name} -> {entry.name}")
+                        result['restored'] += 1
+                    except Exception as e:
+                        print(f"撤销重命名失败: {entry.rel_path}, 错误: {e}")
+                        failures.append({'path': entry.rel_path, 'error': str(e)})
+            
+            # 完成顺序中子项总在上层文件夹之前，倒序撤销时上层文件夹先恢复原名称；
+            # 继续执行时才完成的子项可能在上层文件夹之后，按仍保持新名称的文件夹找到它们
+            moved = {path: record['new_name'] for path, record in state['renames'].items() if record['is_dir']}
+            for record in reversed(list(state['renames'].values())):
+                rel_path = record['path']
+                if record['is_dir']:
+                    moved.pop(rel_path, None)
+                parent = os.path.join(header['target'], current_rel_path(os.path.dirname(rel_path), moved))
+                try:
+                    if _undo_rename(parent, rel_path, record['new_name']):
+                        result['restored'] += 1
+                    journal.record({'op': 'undo', 'path': rel_path})
+                except Exception as e:
+                    print(f"撤销重命名失败: {rel_path}, 错误: {e}")
+                    failures.append({'path': rel_path, 'error': str(e)})
+            
+            for file_path, name in state['backups'].items():
+                backup_path = os.path.join(journal.backup_dir, name)
+                try:
+                    # 备份在恢复时被移走，不存在说明已经恢复过
+                    if os.path.exists(backup_path):
+                        os.replace(backup_path, file_path)
+                        print(f"已恢复RPY文件: {file_path}")
+                        result['rpy_restored'] += 1
+                    journal.record({'op': 'restore', 'path': file_path})
+                except Exception as e:
+                    print(f"恢复RPY文件失败: {file_path}, 错误: {e}")
+                    failures.append({'path': file_path, 'error': str(e)})
+    finally:
+        journal.close()
+    
+    print(f"\n总计撤销了 {result['restored']} 个重命名，恢复了 {result['rpy_restored']} 个RPY文件")
+    if failures:
+        print(f"有 {len(failures)} 个条目撤销失败，执行日志已保留: {journal_dir}")
+        return result
+    for path in (journal.path, journal.plan_file, journal.mapping_file):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(journal.backup_dir, ignore_errors=True)
+    result['status'] = 'rolled_back'
+    return result
+
+def interactive() -> int:
+    """交互模式：在控制台输入路径并确认"""
+    print("=== 音频文件重命名工具 ===")
     
-    if renamed_count == 0:
-        print("没有文件或文件夹被重命名")
-    else:
-        print(f"重命名完成！如需修复RPY文件，请运行 python fix_rpy.py")
+    # 获取目标文件夹路径
+    target_path = input("请输入目标文件夹路径: ").strip().strip('"')
     
-    print("\n=== 操作完成 ===")
+    result = run_rename(target_path, confirm=confirm_rename, journal_dir=JOURNAL_DIR)
+    if result['status'] == 'renamed':
+        if result['renamed'] == 0:
+            print("没有文件或文件夹被重命名")
+        else:
+            print(f"重命名完成！如需修复RPY文件，请运行 python fix_rpy.py")
+        print("\n=== 操作完成 ===")
+    return 0 if result['status'] in RENAME_OK_STATUSES else 1
 
 if __name__ == "__main__":
-    main()
+    # 命令行入口在 cli.py 中：它要同时调用本模块、fix_rpy、镜像和监视模式
+    from cli import main
+    sys.exit(main())
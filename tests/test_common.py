@@ -0,0 +1,161 @@
+"""
+common.py 的回归测试
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import common  # noqa: E402
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+
+    def path(self, *parts):
+        return os.path.join(self.work, *parts)
+
+class CompiledDictionaryTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dictionary = {'爱': 'ai', '你': 'ni', '好': 'hao', '绿': 'lü'}
+        self.dict_file = self.path('dictionary.json')
+        self.write_dictionary(self.dictionary)
+        self.cache_file = common.compiled_dictionary_path(self.dict_file)
+        common.METRICS.reset()
+
+    def write_dictionary(self, dictionary):
+        with open(self.dict_file, 'w', encoding='utf-8') as f:
+            json.dump(dictionary, f, ensure_ascii=False)
+
+    def counters(self):
+        return (common.METRICS.counters.get('dictionary_cache_hits', 0),
+                common.METRICS.counters.get('dictionary_cache_misses', 0))
+
+    def test_lookup(self):
+        compiled = common.CompiledDictionary.from_dict(self.dictionary)
+        self.assertEqual(dict(compiled.items()), self.dictionary)
+        self.assertEqual(len(compiled), 4)
+        self.assertEqual(compiled['绿'], 'lü')
+        self.assertNotIn('他', compiled)
+        self.assertNotIn('爱你', compiled)
+        self.assertIsNone(compiled.get('a'))
+        with self.assertRaises(KeyError):
+            compiled['他']
+
+    def test_cache_round_trip(self):
+        first = common.load_compiled_dictionary(self.dict_file)
+        self.assertTrue(os.path.exists(self.cache_file))
+        second = common.load_compiled_dictionary(self.dict_file)
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertIsInstance(second, common.CompiledDictionary)
+        self.assertEqual(dict(second.items()), dict(first.items()))
+        self.assertEqual(dict(second.items()), self.dictionary)
+
+    def test_stale_cache_rebuilt(self):
+        common.load_compiled_dictionary(self.dict_file)
+        self.write_dictionary(dict(self.dictionary, 他='ta'))
+        self.assertEqual(common.load_compiled_dictionary(self.dict_file)['他'], 'ta')
+        self.assertEqual(self.counters(), (0, 2))
+
+    def test_touched_json_uses_digest(self):
+        common.load_compiled_dictionary(self.dict_file)
+        stat = os.stat(self.dict_file)
+        os.utime(self.dict_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(dict(common.load_compiled_dictionary(self.dict_file).items()), self.dictionary)
+        self.assertEqual(self.counters(), (1, 1))
+        # 缓存记录了新的修改时间，之后不再计算哈希
+        with open(self.cache_file, 'rb') as f:
+            _, mtime_ns, _, _ = common.CompiledDictionary.from_bytes(f.read())
+        self.assertEqual(mtime_ns, stat.st_mtime_ns + 10 ** 9)
+
+    def test_truncated_cache_rejected(self):
+        common.load_compiled_dictionary(self.dict_file)
+        with open(self.cache_file, 'rb') as f:
+            data = f.read()
+        for broken in (data[:-1], data + b'x', data[:common.COMPILED_DICT_HEADER.size + 2], b'CNPY'):
+            with self.subTest(size=len(broken)):
+                with open(self.cache_file, 'wb') as f:
+                    f.write(broken)
+                self.assertEqual(dict(common.load_compiled_dictionary(self.dict_file).items()), self.dictionary)
+                with open(self.cache_file, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_phrase_keys_not_compiled(self):
+        self.write_dictionary(dict(self.dictionary, 角色='jiaose'))
+        dictionary = common.load_compiled_dictionary(self.dict_file)
+        self.assertIsInstance(dictionary, dict)
+        self.assertEqual(dictionary['角色'], 'jiaose')
+
+    def test_read_dictionary_missing(self):
+        self.assertEqual(common.read_dictionary(self.path('missing.json')), {})
+
+class PlanFileTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.plan = common.RenamePlan(self.work)
+        self.plan.entries = [
+            common.PlanEntry('图片', '图片', True, 0, 'tupian', 'tupian'),
+            common.PlanEntry('图片/学校.png', '学校.png', False, 1, 'xuexiao.png', 'tupian/xuexiao.png'),
+            common.PlanEntry('图片/a.png', 'a.png', False, 1, 'a.png', 'tupian/a.png'),
+            common.PlanEntry('图片/背景', '背景', True, 1, 'beijing', 'tupian/beijing'),
+        ]
+        self.plan.missing_chars = {'界'}
+        self.plan_file = self.path('plan.jsonl')
+
+    def test_round_trip(self):
+        common.write_plan_file(self.plan, self.plan_file)
+        loaded = common.load_plan_file(self.plan_file)
+        self.assertEqual(loaded.target_path, os.path.abspath(self.work))
+        # 先文件夹后文件
+        self.assertEqual(loaded.entries, [self.plan.entries[i] for i in (0, 3, 1, 2)])
+        self.assertEqual(loaded.missing_chars, {'界'})
+        self.assertEqual(common.read_plan_summary(self.plan_file),
+                         {'type': 'end', 'folders': 2, 'files': 2, 'missing_chars': ['界']})
+
+    def test_record_type_skips_other_lines(self):
+        common.write_plan_file(self.plan, self.plan_file)
+        with open(self.plan_file, encoding='utf-8') as f:
+            lines = f.readlines()
+        # 文件夹记录不做 JSON 解析，损坏的文件夹记录不影响读取文件记录
+        lines.insert(1, '{"type": "folder", broken\n')
+        with open(self.plan_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        self.assertEqual([record['old'] for record in common.iter_plan_file(self.plan_file, 'file')],
+                         ['图片/学校.png', '图片/a.png'])
+        with self.assertRaises(ValueError):
+            list(common.iter_plan_file(self.plan_file))
+
+    def test_summary_of_large_plan(self):
+        self.plan.entries = [common.PlanEntry(f'图片{i}.png', f'图片{i}.png', False, 0, f'tupian{i}.png',
+                                              f'tupian{i}.png') for i in range(500)]
+        self.plan.missing_chars = {chr(0x4e00 + i) for i in range(2000)}
+        common.write_plan_file(self.plan, self.plan_file)
+        summary = common.read_plan_summary(self.plan_file)
+        self.assertEqual(summary['files'], 500)
+        self.assertEqual(len(summary['missing_chars']), 2000)
+
+    def test_invalid_plans(self):
+        common.write_plan_file(self.plan, self.plan_file)
+        with open(self.plan_file, encoding='utf-8') as f:
+            lines = f.readlines()
+        with open(self.plan_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines[:-1])
+        with self.assertRaises(ValueError):
+            common.read_plan_summary(self.plan_file)
+        with open(self.plan_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'format': common.PLAN_FORMAT, 'version': common.PLAN_VERSION + 1}) + '\n')
+        with self.assertRaises(ValueError):
+            common.load_plan_file(self.plan_file)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,353 @@
+"""
+fix_rpy.py 的回归测试
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import common  # noqa: E402
+import fix_rpy  # noqa: E402
+
+class RpyTestCase(unittest.TestCase):
+    """在临时文件夹中准备RPY文件"""
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+
+    def write(self, rel_path, content, encoding='utf-8', newline=None):
+        path = os.path.join(self.work, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding=encoding, newline=newline) as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+class ScanFilesTestCase(RpyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mapping = {f'图片/角色{i}.png': f'tupian/jiaose{i}.png' for i in range(40)}
+        self.mapping['角色1.png'] = 'jiaose1.png'
+        for i in range(3 * fix_rpy.PARALLEL_MIN_FILES):
+            lines = [f'show "图片/角色{(i + j) % 50}.png"  # 角色1.png\n' for j in range(i * 5)]
+            if i % 4 == 0:
+                lines.append('label start:\n')
+            self.write(f'脚本{i % 3}/{i}.rpy', ''.join(lines))
+
+    def test_process_pool_matches_serial(self):
+        serial = fix_rpy.scan_rpy_files(self.work, self.mapping, workers=1)
+        self.assertGreater(len(serial), fix_rpy.PARALLEL_MIN_FILES)
+        parallel = fix_rpy.scan_rpy_files(self.work, self.mapping, workers=2)
+        # 内容和顺序都与串行扫描相同
+        self.assertEqual(list(parallel.items()), list(serial.items()))
+
+    def test_pipelined_matches_serial(self):
+        serial = fix_rpy.scan_rpy_files(self.work, self.mapping, workers=1)
+        pipelined = fix_rpy.scan_rpy_files(self.work, self.mapping, in_flight=4)
+        self.assertEqual(list(pipelined.items()), list(serial.items()))
+
+    def test_pipelined_rewrite_matches_serial(self):
+        matcher = fix_rpy.RenameMatcher(self.mapping)
+        updates = fix_rpy.scan_rpy_files(self.work, self.mapping)
+        serial_dir = os.path.join(self.work, 'serial')
+        shutil.copytree(self.work, serial_dir)
+        serial_updates = {os.path.join(serial_dir, os.path.relpath(path, self.work)): summary
+                          for path, summary in updates.items()}
+        self.assertEqual(fix_rpy.apply_rpy_updates(updates, matcher, in_flight=4),
+                         fix_rpy.apply_rpy_updates(serial_updates, matcher))
+        for path in updates:
+            self.assertEqual(self.read(path), self.read(os.path.join(serial_dir, os.path.relpath(path, self.work))))
+
+    def test_split_by_size(self):
+        paths = fix_rpy.list_rpy_files(self.work)
+        chunks = fix_rpy.split_by_size(paths, 4)
+        self.assertEqual(sorted(path for chunk in chunks for path in chunk), sorted(paths))
+        totals = [sum(os.path.getsize(path) for path in chunk) for chunk in chunks]
+        self.assertLessEqual(max(totals) - min(totals), max(os.path.getsize(path) for path in paths))
+        # 文件比组数少时不产生空组
+        self.assertEqual(len(fix_rpy.split_by_size(paths[:2], 4)), 2)
+
+class RenameMatcherTestCase(unittest.TestCase):
+
+    def replace(self, mapping, line):
+        new_line, count = fix_rpy.RenameMatcher(mapping).replace_bytes(line.encode('utf-8'))
+        return new_line.decode('utf-8'), count
+
+    def test_longest_key_wins(self):
+        mapping = {'学校.png': 'xuexiao.png', '背景/学校.png': 'beijing/xuexiao.png'}
+        self.assertEqual(self.replace(mapping, 'scene "背景/学校.png"'), ('scene "beijing/xuexiao.png"', 1))
+        self.assertEqual(self.replace(mapping, 'scene "图片/学校.png"'), ('scene "图片/xuexiao.png"', 1))
+
+    def test_key_prefix_of_another(self):
+        mapping = {'立绘': 'lihui', '立绘1.png': 'lihui1.png', '立绘10.png': 'lihui10.png'}
+        self.assertEqual(self.replace(mapping, '"立绘10.png" "立绘1.png" "立绘2.png"'),
+                         ('"lihui10.png" "lihui1.png" "lihui2.png"', 3))
+
+    def test_matching_resumes_after_match(self):
+        # 替换后的内容不再参与匹配，重叠部分只替换一次
+        self.assertEqual(self.replace({'甲乙': 'A', '乙丙': 'B'}, '甲乙丙乙丙'), ('A丙B', 2))
+
+    def test_no_match(self):
+        self.assertEqual(self.replace({'学校.png': 'xuexiao.png'}, 'scene "学校.jpg"'), ('scene "学校.jpg"', 0))
+        self.assertEqual(self.replace({}, '学校.png'), ('学校.png', 0))
+        self.assertTrue(fix_rpy.RenameMatcher({}).empty)
+        self.assertIsNone(fix_rpy.RenameMatcher({}).search_bytes(b'abc'))
+
+    def test_all_non_ascii(self):
+        self.assertTrue(fix_rpy.RenameMatcher({'学校.png': 'xuexiao.png'}).all_non_ascii)
+        self.assertFalse(fix_rpy.RenameMatcher({'学校.png': 'xuexiao.png', 'a.png': 'b.png'}).all_non_ascii)
+
+class ScanFileTestCase(RpyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.matcher = fix_rpy.RenameMatcher({'学校.png': 'xuexiao.png', '背景/学校.png': 'beijing/xuexiao.png'})
+
+    def test_summary(self):
+        path = self.write('a.rpy', 'label start:\n    scene "背景/学校.png"\n    "学校.png 学校.png"\n    "其它"\n')
+        self.assertEqual(fix_rpy.scan_rpy_file(path, self.matcher), {
+            'lines': [2, 3], 'replacements': [['背景/学校.png', 'beijing/xuexiao.png', 1],
+                                              ['学校.png', 'xuexiao.png', 2]]})
+        self.assertIsNone(fix_rpy.scan_rpy_file(self.write('b.rpy', '"其它.png"\n'), self.matcher))
+        self.assertIsNone(fix_rpy.scan_rpy_file(self.write('c.rpy', ''), self.matcher))
+
+    def test_ascii_file_skipped(self):
+        path = self.write('a.rpy', 'label start:\n    scene bg\n')
+        stats = {}
+        state = {}
+        self.assertIsNone(fix_rpy.scan_rpy_file(path, self.matcher, state, stats))
+        self.assertEqual(stats, {'rpy_bytes_read': os.path.getsize(path), 'rpy_ascii_skipped': 1})
+        self.assertTrue(state['ascii_only'])
+        self.assertEqual(state['size'], os.path.getsize(path))
+
+    def test_large_file_uses_mmap(self):
+        line = 'scene "背景/学校.png"\n' + 'x' * 100 + '\n'
+        count = fix_rpy.MMAP_THRESHOLD // len(line.encode('utf-8')) + 1
+        path = self.write('large.rpy', line * count)
+        self.assertGreaterEqual(os.path.getsize(path), fix_rpy.MMAP_THRESHOLD)
+        updates = fix_rpy.scan_rpy_file(path, self.matcher)
+        self.assertEqual(updates['lines'], list(range(1, 2 * count, 2)))
+        self.assertEqual(updates['replacements'], [['背景/学校.png', 'beijing/xuexiao.png', count]])
+
+class RenameMappingTestCase(RpyTestCase):
+
+    def test_plan_preferred_over_log(self):
+        plan = common.RenamePlan(self.work)
+        plan.entries = [common.PlanEntry('图片', '图片', True, 0, 'tupian', 'tupian'),
+                        common.PlanEntry('图片/学校.png', '学校.png', False, 1, 'xuexiao.png', 'tupian/xuexiao.png'),
+                        common.PlanEntry('a.png', 'a.png', False, 0, 'a.png', 'a.png')]
+        plan_file = os.path.join(self.work, 'plan.jsonl')
+        common.write_plan_file(plan, plan_file)
+        log_file = self.write('log.txt', '文件: 旧.png -> jiu.png\n')
+        # 只包含实际改变的文件，不包含文件夹
+        self.assertEqual(fix_rpy.load_rename_mapping(log_file, plan_file), {'图片/学校.png': 'tupian/xuexiao.png'})
+        self.assertEqual(fix_rpy.load_rename_mapping(log_file, os.path.join(self.work, 'missing.jsonl')),
+                         {'旧.png': 'jiu.png'})
+        self.assertEqual(fix_rpy.load_rename_mapping(None), {})
+
+class IncrementalScanTestCase(RpyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.index_file = os.path.join(self.work, 'index.json')
+        self.rpy_dir = os.path.join(self.work, 'game')
+        self.mapping = {'学校.png': 'xuexiao.png'}
+        self.refs = self.write('game/refs.rpy', 'scene "学校.png"\n')
+        self.other = self.write('game/other.rpy', '"对话"\n')
+        self.ascii = self.write('game/ascii.rpy', 'label start:\n')
+
+    def scan(self, mapping=None):
+        """用保存的索引扫描一次，返回 (结果, 实际扫描的文件数)"""
+        common.METRICS.reset()
+        index = common.FileStateIndex(self.index_file)
+        updates = fix_rpy.scan_rpy_files(self.rpy_dir, mapping or self.mapping, index=index)
+        index.save()
+        return updates, common.METRICS.counters['rpy_files_scanned']
+
+    def test_unchanged_files_skipped(self):
+        first, scanned = self.scan()
+        self.assertEqual(list(first), [self.refs])
+        self.assertEqual(scanned, 3)
+        # 上次有需要更新的行的文件每次都重新扫描
+        second, scanned = self.scan()
+        self.assertEqual(second, first)
+        self.assertEqual(scanned, 1)
+
+    def test_changed_file_rescanned(self):
+        self.scan()
+        with open(self.other, 'a', encoding='utf-8') as f:
+            f.write('show "学校.png"\n')
+        updates, scanned = self.scan()
+        self.assertEqual(sorted(updates), sorted([self.refs, self.other]))
+        self.assertEqual(scanned, 2)
+
+    def test_mapping_change(self):
+        self.scan()
+        # 映射变了，含非ASCII字符的文件重新扫描，纯ASCII的文件仍然跳过
+        updates, scanned = self.scan({'对话': 'duihua'})
+        self.assertEqual(list(updates), [self.other])
+        self.assertEqual(scanned, 2)
+        # 映射中有纯ASCII的关键字时纯ASCII的文件也要重新扫描
+        updates, scanned = self.scan({'对话': 'duihua', 'start': 'begin'})
+        self.assertEqual(sorted(updates), sorted([self.other, self.ascii]))
+        self.assertEqual(scanned, 3)
+
+    def test_deleted_file_pruned(self):
+        self.scan()
+        os.remove(self.other)
+        self.scan()
+        with open(self.index_file, encoding='utf-8') as f:
+            self.assertEqual(sorted(json.load(f)['rpy']), sorted([self.refs, self.ascii]))
+
+class RewriteFileTestCase(RpyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.matcher = fix_rpy.RenameMatcher({'学校.png': 'xuexiao.png'})
+
+    def test_bytes_kept(self):
+        original = '\ufefflabel start:\r\n\tscene "学校.png"\r\n    "学校.png" # 学校.png\r\n"对话"'
+        path = self.write('a.rpy', original, newline='')
+        os.chmod(path, 0o640)
+        self.assertEqual(fix_rpy.rewrite_rpy_file(path, self.matcher), (2, 3))
+        self.assertEqual(self.read(path), original.replace('学校.png', 'xuexiao.png').encode('utf-8'))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.work), ['a.rpy'])
+
+    def test_non_utf8_file(self):
+        # 按字节处理，不是 UTF-8 的文件也不会解码失败，其余字节原样保留
+        path = self.write('a.rpy', '"对话" "a.png"\n', encoding='gbk')
+        self.assertEqual(fix_rpy.rewrite_rpy_file(path, fix_rpy.RenameMatcher({'a.png': 'b.png'})), (1, 1))
+        self.assertEqual(self.read(path), '"对话" "b.png"\n'.encode('gbk'))
+
+    def test_unchanged_file_not_replaced(self):
+        path = self.write('a.rpy', 'label start:\n    "对话"\n')
+        before = os.stat(path)
+        self.assertEqual(fix_rpy.rewrite_rpy_file(path, self.matcher), (0, 0))
+        after = os.stat(path)
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+        self.assertEqual(os.listdir(self.work), ['a.rpy'])
+
+    def test_output_path(self):
+        path = self.write('a.rpy', 'scene "学校.png"\n')
+        output = os.path.join(self.work, 'out.rpy')
+        self.assertEqual(fix_rpy.rewrite_rpy_file(path, self.matcher, output), (1, 1))
+        self.assertEqual(self.read(path), 'scene "学校.png"\n'.encode('utf-8'))
+        self.assertEqual(self.read(output), b'scene "xuexiao.png"\n')
+        # 没有替换时也写入输出文件
+        other = self.write('b.rpy', 'label start:\n')
+        self.assertEqual(fix_rpy.rewrite_rpy_file(other, self.matcher, output), (0, 0))
+        self.assertEqual(self.read(output), b'label start:\n')
+
+    def test_error_leaves_original(self):
+        class FailingMatcher:
+            def replace_bytes(self, line):
+                if b'fail' in line:
+                    raise RuntimeError('fail')
+                return line.replace('学校'.encode('utf-8'), b'xuexiao'), 1
+
+        original = 'scene "学校.png"\nfail\n'
+        path = self.write('a.rpy', original)
+        with self.assertRaises(RuntimeError):
+            fix_rpy.rewrite_rpy_file(path, FailingMatcher())
+        self.assertEqual(self.read(path), original.encode('utf-8'))
+        self.assertEqual(os.listdir(self.work), ['a.rpy'])
+
+class RunOrderedTestCase(unittest.TestCase):
+
+    def test_order_and_bound(self):
+        lock = threading.Lock()
+        outstanding = [0, 0]
+        consumed = []
+
+        def work(number, delay):
+            with lock:
+                outstanding[0] += 1
+                outstanding[1] = max(outstanding[1], outstanding[0])
+            time.sleep(delay)
+            return number
+
+        def consume(number):
+            # 已完成但还没交给 consume 的结果也计入 in_flight
+            with lock:
+                outstanding[0] -= 1
+            consumed.append(number)
+
+        delays = [((number * 7) % 5) * 0.002 for number in range(40)]
+        fix_rpy.run_ordered(work, list(enumerate(delays)), 3, consume)
+        self.assertEqual(consumed, list(range(40)))
+        self.assertLessEqual(outstanding[1], 3)
+        self.assertEqual(outstanding[0], 0)
+
+class AssetRefIndexTestCase(RpyTestCase):
+
+    SCRIPT = ('label start:\n'
+              '    scene "images/学校.png"  # 以前是 "images/学校.png"\n'
+              "    show expression 'images/学校.png' as bg\n"
+              '    "我在学校.png旁边"\n'
+              '    play music "audio/主题.ogg"\n')
+
+    def setUp(self):
+        super().setUp()
+        self.rpy_dir = os.path.join(self.work, 'game')
+        self.script = self.write('game/script.rpy', self.SCRIPT)
+        self.mapping = {'images/学校.png': 'images/xuexiao.png', '学校.png': 'xuexiao.png'}
+        self.refs = fix_rpy.AssetRefIndex(common.FileStateIndex())
+
+    def test_scan_asset_refs(self):
+        state, refs = fix_rpy.scan_asset_refs(self.script)
+        # 注释中的字符串和不以资源扩展名结尾的字符串不记录
+        self.assertEqual(refs, [[2, 'images/学校.png'], [3, 'images/学校.png'], [5, 'audio/主题.ogg']])
+        self.assertEqual(state['size'], os.path.getsize(self.script))
+
+    def test_rewrite_only_literals(self):
+        updates = fix_rpy.scan_rpy_files(self.rpy_dir, self.mapping, refs=self.refs)
+        self.assertEqual(updates[self.script]['lines'], [2, 3])
+        self.assertEqual(fix_rpy.apply_rpy_updates(updates, fix_rpy.RenameMatcher(self.mapping)), (1, 2))
+        # 注释和对话中的文字保持不变
+        self.assertEqual(self.read(self.script), self.SCRIPT.replace(
+            'scene "images/学校.png"', 'scene "images/xuexiao.png"').replace(
+            "'images/学校.png'", "'images/xuexiao.png'").encode('utf-8'))
+
+    def test_refresh_parses_changed_files(self):
+        other = self.write('game/other.rpy', 'scene "学校.png"\n')
+        common.METRICS.reset()
+        self.refs.refresh(self.rpy_dir)
+        self.assertEqual(common.METRICS.counters['rpy_refs_parsed'], 2)
+        with open(other, 'a', encoding='utf-8') as f:
+            f.write('show "立绘.png"\n')
+        common.METRICS.reset()
+        self.refs.refresh(self.rpy_dir)
+        self.assertEqual(common.METRICS.counters['rpy_refs_parsed'], 1)
+        self.assertEqual(self.refs.files[other]['refs'], [[1, '学校.png'], [2, '立绘.png']])
+        os.remove(other)
+        self.refs.refresh(self.rpy_dir)
+        self.assertEqual(list(self.refs.files), [self.script])
+
+    def test_unknown_type_falls_back_to_full_scan(self):
+        mapping = dict(self.mapping, **{'我在学校': 'wozaixuexiao'})
+        self.assertEqual(fix_rpy.scan_rpy_files(self.rpy_dir, mapping, refs=self.refs),
+                         fix_rpy.scan_rpy_files(self.rpy_dir, mapping))
+        self.assertEqual(self.refs.files, {})
+
+    def test_queries(self):
+        self.refs.refresh(self.rpy_dir)
+        self.assertEqual(self.refs.where_used(os.path.join('game', 'images', '学校.png')),
+                         [('images/学校.png', self.script, 2), ('images/学校.png', self.script, 3)])
+        self.write('game/images/学校.png', '')
+        self.assertEqual(self.refs.missing(self.rpy_dir), [('audio/主题.ogg', [(self.script, 5)])])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+执行日志的回归测试：中断后继续、中断后回滚、日志尾部丢失时回滚、回滚本身被中断后再次回滚
+中断通过子进程在第 N 次 os.rename 之后 os._exit 模拟，与进程被杀死时一样不会执行任何清理
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import common  # noqa: E402
+import pipeline  # noqa: E402
+import rename  # noqa: E402
+
+# 测试用的小字典，编译缓存写在临时文件夹中
+DICTIONARY = {'图': 'tu', '片': 'pian', '角': 'jiao', '色': 'se', '表': 'biao', '情': 'qing',
+              '立': 'li', '绘': 'hui', '背': 'bei', '景': 'jing'}
+FOLDERS = ['图片', '图片/角色', '图片/角色/表情', '背景']
+SCRIPT = ('image a = "图片/角色/立绘1.png"\n'
+          'image b = "图片/角色/表情/立绘2.png"  # 图片/角色/立绘0.png\n'
+          'scene bg = "背景/立绘0.png"\n')
+
+# 在子进程中运行，第 CRASH_AT 次 os.rename 之后立即退出
+CRASH_SCRIPT = '''
+import os, sys
+sys.path.insert(0, {root!r})
+import pipeline, rename
+real_rename = os.rename
+count = [0]
+def crashing_rename(src, dst):
+    real_rename(src, dst)
+    count[0] += 1
+    if count[0] == {crash_at}:
+        os._exit(3)
+os.rename = crashing_rename
+{call}
+'''
+
+def snapshot(root):
+    """目录树中所有路径和RPY文件的内容"""
+    result = []
+    for dir_path, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(dir_path, name)
+            result.append(os.path.relpath(path, root))
+            if name.endswith('.rpy'):
+                with open(path, encoding='utf-8') as f:
+                    result.append(f.read())
+    return sorted(result)
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.game = os.path.join(self.work, 'game')
+        self.journal_dir = os.path.join(self.work, 'journal')
+        self.dict_file = os.path.join(self.work, 'dictionary.json')
+        with open(self.dict_file, 'w', encoding='utf-8') as f:
+            json.dump(DICTIONARY, f, ensure_ascii=False)
+        for folder in FOLDERS:
+            os.makedirs(os.path.join(self.game, folder))
+            for i in range(3):
+                open(os.path.join(self.game, folder, f'立绘{i}.png'), 'w').close()
+        with open(os.path.join(self.game, 'script.rpy'), 'w', encoding='utf-8') as f:
+            f.write(SCRIPT)
+        self.original = snapshot(self.game)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def pipeline_call(self):
+        return (f'pipeline.run_pipeline({self.game!r}, {self.game!r}, {self.dict_file!r}, '
+                f'journal_dir={self.journal_dir!r})')
+
+    def run_crashing(self, call, crash_at):
+        """在子进程中执行 call，第 crash_at 次重命名之后退出；返回退出码"""
+        code = CRASH_SCRIPT.format(root=ROOT, crash_at=crash_at, call=call)
+        process = subprocess.run([sys.executable, '-c', code], cwd=self.work,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return process.returncode
+
+    def run_pipeline(self):
+        rename_result, rpy_result = pipeline.run_pipeline(self.game, self.game, self.dict_file,
+                                                          journal_dir=self.journal_dir)
+        self.assertEqual(rename_result['status'], 'renamed')
+        self.assertEqual(rpy_result['status'], 'updated')
+
+    def expected_result(self):
+        """不中断时执行的结果"""
+        expected_dir = os.path.join(self.work, 'expected')
+        shutil.copytree(self.game, expected_dir)
+        pipeline.run_pipeline(expected_dir, expected_dir, self.dict_file)
+        return snapshot(expected_dir)
+
+    def rename_count(self):
+        """不中断时一共执行的重命名次数"""
+        normalizer = rename.FilenameNormalizer(rename.read_dictionary(self.dict_file))
+        plan = rename.scan_tree(self.game, normalizer=normalizer)
+        return sum(1 for entry in plan.entries if entry.new_name != entry.name)
+
+    def test_resume_after_crash(self):
+        expected = self.expected_result()
+        total = self.rename_count()
+        self.assertGreater(total, 5)
+        for crash_at in (1, total // 2, total - 1):
+            with self.subTest(crash_at=crash_at):
+                self.assertEqual(self.run_crashing(self.pipeline_call(), crash_at), 3)
+                self.assertNotEqual(snapshot(self.game), expected)
+                result = pipeline.resume_journal(self.journal_dir)
+                self.assertEqual(result['status'], 'resumed', result)
+                self.assertEqual(snapshot(self.game), expected)
+                # 恢复原状，准备下一次中断
+                self.assertEqual(rename.rollback_journal(self.journal_dir)['status'], 'rolled_back')
+                self.assertEqual(snapshot(self.game), self.original)
+
+    def test_resume_with_corrupt_mapping(self):
+        expected = self.expected_result()
+        mapping_file = os.path.join(self.journal_dir, common.Journal.MAPPING_NAME)
+        for content in ('{"files": ', '{"format": "other", "version": 1}'):
+            with self.subTest(content=content):
+                self.assertEqual(self.run_crashing(self.pipeline_call(), 2), 3)
+                self.assertTrue(os.path.exists(mapping_file))
+                with open(mapping_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                result = pipeline.resume_journal(self.journal_dir)
+                self.assertEqual(result['status'], 'resumed', result)
+                self.assertEqual(snapshot(self.game), expected)
+                self.assertEqual(rename.rollback_journal(self.journal_dir)['status'], 'rolled_back')
+
+    def test_rollback_after_crash(self):
+        total = self.rename_count()
+        for crash_at in (1, total // 2, total - 1):
+            with self.subTest(crash_at=crash_at):
+                self.assertEqual(self.run_crashing(self.pipeline_call(), crash_at), 3)
+                result = rename.rollback_journal(self.journal_dir)
+                self.assertEqual(result['status'], 'rolled_back', result)
+                self.assertEqual(snapshot(self.game), self.original)
+
+    def test_rollback_with_lost_journal_tail(self):
+        journal_file = os.path.join(self.journal_dir, common.Journal.JOURNAL_NAME)
+        for drop in (1, 3, 6, 10):
+            with self.subTest(drop=drop):
+                self.run_pipeline()
+                with open(journal_file, encoding='utf-8') as f:
+                    records = [line for line in f if json.loads(line).get('op') != 'end']
+                renames = [i for i, line in enumerate(records) if json.loads(line).get('op') == 'rename']
+                lost = set(renames[-drop:])
+                with open(journal_file, 'w', encoding='utf-8') as f:
+                    f.writelines(line for i, line in enumerate(records) if i not in lost)
+                result = rename.rollback_journal(self.journal_dir)
+                self.assertEqual(result['status'], 'rolled_back', result)
+                self.assertEqual(snapshot(self.game), self.original)
+
+    def test_interrupted_rollback(self):
+        total = self.rename_count()
+        call = f'rename.rollback_journal({self.journal_dir!r})'
+        for crash_at in (1, total // 2, total):
+            with self.subTest(crash_at=crash_at):
+                self.run_pipeline()
+                self.assertEqual(self.run_crashing(call, crash_at), 3)
+                result = rename.rollback_journal(self.journal_dir)
+                self.assertEqual(result['status'], 'rolled_back', result)
+                self.assertEqual(snapshot(self.game), self.original)
+
+if __name__ == '__main__':
+    unittest.main()
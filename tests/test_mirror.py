@@ -0,0 +1,95 @@
+"""
+mirror.py 的回归测试：镜像内容、增量更新和删除过期的镜像文件
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fix_rpy  # noqa: E402
+import mirror  # noqa: E402
+
+DICTIONARY = {'图': 'tu', '片': 'pian', '背': 'bei', '景': 'jing', '学': 'xue', '校': 'xiao', '新': 'xin'}
+
+def list_tree(root):
+    return sorted(os.path.relpath(os.path.join(dir_path, name), root)
+                  for dir_path, dirs, files in os.walk(root) for name in dirs + files)
+
+class MirrorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.game = os.path.join(self.work, 'game')
+        self.mirror = os.path.join(self.work, 'mirror')
+        self.dict_file = os.path.join(self.work, 'dictionary.json')
+        with open(self.dict_file, 'w', encoding='utf-8') as f:
+            json.dump(DICTIONARY, f, ensure_ascii=False)
+        os.makedirs(os.path.join(self.game, '图片', '背景'))
+        for rel_path in ('图片/背景/学校.png', '图片/a.png', 'b.png'):
+            with open(os.path.join(self.game, rel_path), 'w') as f:
+                f.write(rel_path)
+        self.script = os.path.join(self.game, 'script.rpy')
+        with open(self.script, 'w', encoding='utf-8') as f:
+            f.write('scene bg = "图片/背景/学校.png"\n')
+        self.source = list_tree(self.game)
+
+    def run_mirror(self):
+        result = mirror.run_mirror(self.game, self.mirror, self.dict_file, rpy_path=self.game,
+                                   plan_file=None, log_file=None, threads=2)
+        self.assertEqual(result['status'], 'mirrored', result)
+        self.assertEqual(result['failures'], [])
+        return result
+
+    def test_mirror_contents(self):
+        result = self.run_mirror()
+        self.assertEqual(list_tree(self.mirror), ['b.png', 'script.rpy', 'tupian', 'tupian/a.png',
+                                                  'tupian/beijing', 'tupian/beijing/xuexiao.png'])
+        with open(os.path.join(self.mirror, 'script.rpy'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'scene bg = "tupian/beijing/xuexiao.png"\n')
+        with open(os.path.join(self.mirror, 'tupian/beijing/xuexiao.png')) as f:
+            self.assertEqual(f.read(), '图片/背景/学校.png')
+        self.assertEqual((result['placed'], result['rpy_rewritten']), (4, 1))
+        # 源文件夹和RPY文件保持不变
+        self.assertEqual(list_tree(self.game), self.source)
+        with open(self.script, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'scene bg = "图片/背景/学校.png"\n')
+
+    def test_incremental_and_prune(self):
+        self.run_mirror()
+        result = self.run_mirror()
+        self.assertEqual((result['placed'], result['unchanged'], result['removed']), (0, 4, 0))
+
+        # 不是本工具放置的文件不会被删除
+        stray = os.path.join(self.mirror, 'tupian', 'stray.txt')
+        open(stray, 'w').close()
+        os.remove(os.path.join(self.game, '图片', '背景', '学校.png'))
+        open(os.path.join(self.game, '新.png'), 'w').close()
+        result = self.run_mirror()
+        # 新文件和因映射变化而重新改写的RPY文件
+        self.assertEqual((result['placed'], result['unchanged'], result['removed']), (2, 2, 1))
+        self.assertFalse(os.path.exists(os.path.join(self.mirror, 'tupian', 'beijing')))
+        self.assertTrue(os.path.exists(os.path.join(self.mirror, 'xin.png')))
+        self.assertTrue(os.path.exists(stray))
+
+    def test_mapping_change_rewrites_rpy(self):
+        self.run_mirror()
+        state = mirror.load_mirror_state(self.mirror)
+        open(os.path.join(self.game, '新.png'), 'w').close()
+        result = self.run_mirror()
+        # 映射变了，内容没变的RPY文件也要重新改写，其它文件保持不变
+        self.assertEqual((result['placed'], result['rpy_rewritten'], result['unchanged']), (2, 1, 3))
+        self.assertNotEqual(mirror.load_mirror_state(self.mirror)['mapping_digest'], state['mapping_digest'])
+
+    def test_state_uses_mapping_digest(self):
+        self.run_mirror()
+        mapping = {'图片/a.png': 'tupian/a.png', '图片/背景/学校.png': 'tupian/beijing/xuexiao.png'}
+        self.assertEqual(mirror.load_mirror_state(self.mirror)['mapping_digest'], fix_rpy.mapping_digest(mapping))
+
+if __name__ == '__main__':
+    unittest.main()
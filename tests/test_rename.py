@@ -0,0 +1,235 @@
+"""
+rename.py 的回归测试
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import common  # noqa: E402
+import rename  # noqa: E402
+
+DICTIONARY = {'角': 'jue', '色': 'shai', '扮': 'ban', '演': 'yan', '快': 'kuai', '乐': 'yue', '立': 'li', '绘': 'hui'}
+
+class PhraseTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.phrases = {'角色': 'jiaose', '角色扮演': 'jiaosebanyan', '快乐': 'kuaile'}
+        self.table = rename.PhraseTable(self.phrases)
+
+    def test_longest_match(self):
+        self.assertEqual(self.table.match('角色扮演', 0), (4, 'jiaosebanyan'))
+        self.assertEqual(self.table.match('角色扮', 0), (2, 'jiaose'))
+        self.assertEqual(self.table.match('x角色', 1), (3, 'jiaose'))
+        self.assertEqual(self.table.match('角', 0), (0, None))
+        self.assertEqual(self.table.match('色', 0), (0, None))
+
+    def test_replace(self):
+        self.assertEqual(self.table.replace('角色扮演_快乐_角色.png'), 'jiaosebanyan_kuaile_jiaose.png')
+        self.assertEqual(self.table.replace('快快乐乐'), '快kuaile乐')
+        self.assertEqual(self.table.replace('立绘'), '立绘')
+        self.assertEqual(rename.PhraseTable().replace('角色'), '角色')
+
+    def test_items(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(dict(self.table.items()), self.phrases)
+
+    def test_normalizer_uses_phrases(self):
+        normalizer = rename.FilenameNormalizer(dict(DICTIONARY, **{'立绘': 'lihui2'}), phrases=self.table)
+        # 词语优先于逐字转换，字典中的词语与词语表合并
+        self.assertEqual(normalizer.normalize('角色扮演 立绘.png'), 'jiaosebanyanlihui2.png')
+        self.assertEqual(normalizer.normalize('角 色.png'), 'jueshai.png')
+
+    def test_read_phrases(self):
+        work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work)
+        phrase_file = os.path.join(work, rename.PHRASE_FILE)
+        with open(phrase_file, 'w', encoding='utf-8') as f:
+            f.write('# 词语 拼音\n角色 jiaose\n快乐\tkuaile\n无法识别的行\n角色 juese\n')
+        table = rename.read_phrases(phrase_file)
+        self.assertEqual(dict(table.items()), {'角色': 'juese', '快乐': 'kuaile'})
+        self.assertEqual(len(rename.read_phrases(os.path.join(work, 'missing.txt'))), 0)
+
+class IncrementalScanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.target = os.path.join(self.work, 'game')
+        for rel_path in ('clean/sub/a.png', 'clean/b.png', '立绘/角色.png'):
+            path = os.path.join(self.target, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+        self.index_file = os.path.join(self.work, 'index.json')
+        self.normalizer = rename.FilenameNormalizer(DICTIONARY)
+
+    def scan(self):
+        """用保存的索引扫描一次，返回 (计划中的路径, 从索引中取得的文件夹数)"""
+        common.METRICS.reset()
+        index = common.FileStateIndex(self.index_file)
+        plan = rename.scan_tree(self.target, index=index, normalizer=self.normalizer)
+        index.save()
+        return [entry.rel_path for entry in plan.entries], common.METRICS.counters.get('dirs_from_index', 0)
+
+    def full_scan(self):
+        return [entry.rel_path for entry in rename.scan_tree(self.target, normalizer=self.normalizer).entries]
+
+    def test_unchanged_folders_from_index(self):
+        first, from_index = self.scan()
+        self.assertEqual(first, self.full_scan())
+        self.assertEqual(from_index, 0)
+        second, from_index = self.scan()
+        self.assertEqual(second, first)
+        # 目标文件夹本身、clean 和 clean/sub 中的文件名不含中文且没有变化，不再列出内容
+        self.assertEqual(from_index, 3)
+
+    def test_changed_folder_listed_again(self):
+        self.scan()
+        open(os.path.join(self.target, 'clean', 'sub', '快乐.png'), 'w').close()
+        paths, from_index = self.scan()
+        self.assertIn(os.path.join('clean', 'sub', '快乐.png'), paths)
+        self.assertEqual(paths, self.full_scan())
+        self.assertEqual(from_index, 2)
+        # 有中文文件名的文件夹之后每次都重新列出
+        self.assertEqual(self.scan()[1], 2)
+
+    def test_unreadable_index_rebuilt(self):
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            f.write('{"version": 0}')
+        self.assertEqual(self.scan()[0], self.full_scan())
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            f.write('{')
+        self.assertEqual(self.scan()[0], self.full_scan())
+
+def build_tree(root, rel_paths):
+    for rel_path in rel_paths:
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(rel_path)
+
+def read_tree(root):
+    """目录树中所有文件的相对路径和内容"""
+    result = {}
+    for dir_path, dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dir_path, name)
+            with open(path, encoding='utf-8') as f:
+                result[os.path.relpath(path, root)] = f.read()
+    return result
+
+class ExecuteRenamesTestCase(unittest.TestCase):
+
+    FILES = ['角色/快乐/立绘{}.png'.format(i) for i in range(5)] + [
+        '角色/快乐/扮演/角色.png', '角色/演.png', '角色/角色.png', '角色/角 色.png', '快乐/a.png', '快乐/扮/演/b.png', 'c.png']
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.normalizer = rename.FilenameNormalizer(DICTIONARY)
+
+    def run_renames(self, name, workers):
+        target = os.path.join(self.work, name)
+        build_tree(target, self.FILES)
+        plan = rename.scan_tree(target, normalizer=self.normalizer)
+        renamed = []
+        moved_parents = []
+        real_rename = os.rename
+
+        def recording_rename(src, dst):
+            # 重命名时上层文件夹都还是原名称
+            if not os.path.isdir(os.path.dirname(src)):
+                moved_parents.append(src)
+            renamed.append(os.path.relpath(src, target))
+            real_rename(src, dst)
+
+        rename.os.rename = recording_rename
+        try:
+            report = rename.execute_renames(target, plan, workers)
+        finally:
+            rename.os.rename = real_rename
+        self.assertEqual(moved_parents, [])
+        return report, read_tree(target), renamed, plan
+
+    def test_threads_match_serial(self):
+        serial_report, serial_tree, serial_renamed, _ = self.run_renames('serial', 1)
+        threaded_report, threaded_tree, threaded_renamed, plan = self.run_renames('threaded', 8)
+        self.assertEqual(threaded_report, serial_report)
+        self.assertEqual(sorted(threaded_renamed), sorted(serial_renamed))
+        self.assertEqual(serial_report['failures'], [])
+        self.assertEqual(set(threaded_tree), set(serial_tree))
+        self.assertIn(os.path.join('jueshai', 'kuaiyue', 'banyan', 'jueshai.png'), threaded_tree)
+        # 同一文件夹下新名称相同的条目按计划顺序执行，与逐个执行一样后一个覆盖前一个
+        same_name = [entry.rel_path for entry in plan.entries
+                     if os.path.dirname(entry.rel_path) == '角色' and entry.new_name == 'jueshai.png']
+        self.assertEqual(len(same_name), 2)
+        self.assertEqual(threaded_tree[os.path.join('jueshai', 'jueshai.png')], same_name[-1])
+
+    def test_children_before_folder(self):
+        _, _, renamed, _ = self.run_renames('order', 4)
+        for number, rel_path in enumerate(renamed):
+            for later in renamed[number + 1:]:
+                self.assertFalse(later.startswith(os.path.join(rel_path, '')), (rel_path, later))
+
+    def test_failures_reported(self):
+        target = os.path.join(self.work, 'failures')
+        build_tree(target, self.FILES)
+        plan = rename.scan_tree(target, normalizer=self.normalizer)
+        # 新名称已被非空文件夹占用，文件夹无法重命名，其中的条目仍然完成
+        build_tree(target, ['kuaiyue/x.png'])
+        report = rename.execute_renames(target, plan, 4)
+        self.assertEqual([failure['path'] for failure in report['failures']], ['快乐'])
+        self.assertTrue(os.path.exists(os.path.join(target, '快乐', 'ban', 'yan', 'b.png')))
+
+class StreamPreviewTestCase(unittest.TestCase):
+
+    FILES = ['角色/快乐/立绘1.png', '角色/快乐/扮演/界.png', '角色/演.png', '快乐/a.png', '界面/b.png', 'c.png']
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.target = os.path.join(self.work, 'game')
+        build_tree(self.target, self.FILES)
+        self.normalizer = rename.FilenameNormalizer(DICTIONARY)
+
+    def path(self, name):
+        return os.path.join(self.work, name)
+
+    def read(self, name):
+        with open(self.path(name), encoding='utf-8') as f:
+            return f.read()
+
+    def test_same_plan_and_log_as_scan(self):
+        summary = rename.stream_preview(self.target, self.path('stream.jsonl'), self.path('stream.txt'),
+                                        normalizer=self.normalizer, progress_interval=None)
+        plan = rename.scan_tree(self.target, normalizer=self.normalizer)
+        rename.generate_preview_log(self.target, self.path('plan.txt'), plan, self.path('plan.jsonl'))
+        streamed = common.load_plan_file(self.path('stream.jsonl'))
+        self.assertEqual(sorted(streamed.entries), sorted(plan.entries))
+        self.assertEqual((summary['folders'], summary['files']), (len(plan.folder_renames), len(plan.file_renames)))
+        # 缺失的字去重并记录出现次数
+        self.assertEqual(summary['missing_chars'], ['界', '面'])
+        self.assertEqual(summary['missing_counts'], {'界': 2, '面': 1})
+        # 预览日志只有缺失字的写法不同
+        self.assertEqual(self.read('stream.txt'), self.read('plan.txt').replace('界, 面', '界(2), 面(1)'))
+        self.assertIn('界(2), 面(1)', self.read('stream.txt'))
+
+    def test_stream_rename(self):
+        dict_file = self.path('dictionary.json')
+        with open(dict_file, 'w', encoding='utf-8') as f:
+            json.dump(dict(DICTIONARY, 界='jie', 面='mian'), f, ensure_ascii=False)
+        expected = os.path.join(self.work, 'expected')
+        shutil.copytree(self.target, expected)
+        result = rename.run_rename(expected, dict_file, self.path('plan.jsonl'), None)
+        self.assertEqual(result['status'], 'renamed', result)
+        result = rename.run_rename(self.target, dict_file, self.path('stream.jsonl'), None, stream=True)
+        self.assertEqual(result['status'], 'renamed', result)
+        self.assertEqual(read_tree(self.target), read_tree(expected))
+
+if __name__ == '__main__':
+    unittest.main()
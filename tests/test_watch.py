@@ -0,0 +1,77 @@
+"""
+watch.py 的回归测试：在后台线程中监视临时文件夹，检查新出现的条目和RPY文件的处理
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import watch  # noqa: E402
+
+DICTIONARY = {'图': 'tu', '片': 'pian', '学': 'xue', '校': 'xiao'}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "监视模式只支持 Linux")
+class WatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work)
+        self.game = os.path.join(self.work, 'game')
+        os.makedirs(self.game)
+        self.dict_file = os.path.join(self.work, 'dictionary.json')
+        self.write_dictionary(DICTIONARY)
+        self.script = os.path.join(self.game, 'script.rpy')
+        with open(self.script, 'w', encoding='utf-8') as f:
+            f.write('scene bg = "图片/学校.png"\n')
+        self.watcher = watch.Watcher(self.game, self.game, self.dict_file, debounce=0.05, max_delay=0.2,
+                                     plan_file=os.path.join(self.work, 'plan.jsonl'), log_file=None)
+        self.stop = threading.Event()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.watcher.run, args=(self.stop, ready))
+        self.thread.start()
+        self.addCleanup(self.thread.join)
+        self.addCleanup(self.stop.set)
+        self.assertTrue(ready.wait(10))
+
+    def write_dictionary(self, dictionary):
+        with open(self.dict_file, 'w', encoding='utf-8') as f:
+            json.dump(dictionary, f, ensure_ascii=False)
+
+    def read_script(self):
+        with open(self.script, encoding='utf-8') as f:
+            return f.read()
+
+    def test_new_folder(self):
+        folder = os.path.join(self.game, '图片')
+        os.makedirs(folder)
+        open(os.path.join(folder, '学校.png'), 'w').close()
+        self.assertTrue(wait_for(lambda: os.path.exists(os.path.join(self.game, 'tupian', 'xuexiao.png'))))
+        self.assertTrue(wait_for(lambda: self.read_script() == 'scene bg = "tupian/xuexiao.png"\n'))
+
+    def test_skipped_until_dictionary_updated(self):
+        path = os.path.join(self.game, '新.png')
+        open(path, 'w').close()
+        self.assertTrue(wait_for(lambda: path in self.watcher.skipped))
+        self.assertTrue(os.path.exists(path))
+        self.write_dictionary(dict(DICTIONARY, **{'新': 'xin'}))
+        self.assertTrue(wait_for(lambda: os.path.exists(os.path.join(self.game, 'xin.png'))))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.watcher.skipped, set())
+
+if __name__ == '__main__':
+    unittest.main()
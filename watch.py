@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视模式（仅 Linux）
+用 inotify 监视资源文件夹和RPY目录：新出现或移入的中文名文件和文件夹立即转换为拼音，
+并只改写有变化的RPY文件和引用了被重命名资源的RPY文件
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import fix_rpy
+from common import DICT_FILE, LOG_FILE, METRICS, PLAN_FILE, RenamePlan, read_dictionary
+from pipeline import run_pipeline
+from rename import (RENAME_OK_STATUSES, FilenameNormalizer, current_rel_path, execute_renames, phrase_file_path,
+                    read_phrases, run_rename, scan_tree)
+
+# inotify 事件（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+# 最后一个事件之后等待多久没有新事件才开始处理（秒），以及第一个事件之后最多等待多久
+DEBOUNCE = 0.2
+MAX_DELAY = 0.8
+# 没有待处理事件时每次等待的时间（秒），用于响应停止请求
+IDLE_TIMEOUT = 0.5
+
+class Inotify:
+    """通过 ctypes 调用 libc 的 inotify 接口"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._rm_watch.restype = ctypes.c_int
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code == errno.ENOSPC:
+                raise OSError(code, "inotify 监视数量达到上限，请增大 /proc/sys/fs/inotify/max_user_watches")
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float) -> List[Tuple[int, int, int, str]]:
+        """等待最多 timeout 秒，返回 (wd, mask, cookie, 名称) 列表"""
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def has_non_ascii(file_path: str) -> bool:
+    """文件中是否有非ASCII字节（只有这样的RPY文件才可能引用中文名资源）"""
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                if fix_rpy.NON_ASCII_PATTERN.search(block):
+                    return True
+    except OSError:
+        pass
+    return False
+
+def is_temp_file(name: str) -> bool:
+    """本工具改写RPY文件时使用的临时文件（见 fix_rpy.rewrite_rpy_file）"""
+    return name.startswith('.') and name.endswith('.tmp')
+
+class Watcher:
+    """
+    监视目标文件夹（和不在其中的RPY目录），标准化器、RPY文件列表和累计的重命名映射都保存在内存中
+
+    事件先合并去抖：最后一个事件之后 debounce 秒没有新事件，或第一个事件之后已过 max_delay 秒时一起处理。
+    新出现或移入的条目只处理它本身（文件夹则连同其中的内容），已经转换过的部分不再遍历；
+    有变化的RPY文件用累计的重命名映射改写，其它含非ASCII字符的RPY文件只用本批的映射改写，
+    改写前先扫描，只有确实引用了被重命名资源的文件才会被改写。
+    本工具自己的重命名和改写产生的事件会被忽略；
+    因字典中缺少拼音而跳过的条目在字典或词语文件更新后自动重新处理
+
+    计划、日志、增量索引、执行日志、RPY更新映射和资源引用索引只用于完整处理（启动时和事件队列溢出时），
+    参数含义与 rename.run_rename / pipeline.run_pipeline 相同
+    """
+
+    def __init__(self, target_path: str, rpy_path: Optional[str] = None, dict_file: str = DICT_FILE,
+                 threads: int = 1, debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY,
+                 plan_file: str = PLAN_FILE, log_file: Optional[str] = LOG_FILE,
+                 index_file: Optional[str] = None, journal_dir: Optional[str] = None,
+                 mapping_file: Optional[str] = None, refs_file: Optional[str] = None,
+                 workers: Optional[int] = 1, in_flight: int = 0):
+        self.target_path = os.path.abspath(target_path)
+        self.rpy_path = os.path.abspath(rpy_path) if rpy_path else None
+        self.dict_file = dict_file
+        self.threads = threads
+        self.plan_file = plan_file
+        self.log_file = log_file
+        self.index_file = index_file
+        self.journal_dir = journal_dir
+        self.mapping_file = mapping_file
+        self.refs_file = refs_file
+        self.workers = workers
+        self.in_flight = in_flight
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.normalizer = None            # type: Optional[FilenameNormalizer]
+        self.inotify = None               # type: Optional[Inotify]
+        self.watches = {}                 # type: Dict[int, str]
+        self.rename_mapping = {}          # type: Dict[str, str]
+        self._matcher = None
+        self.non_ascii_rpy = set()        # type: Set[str]
+        self.pending = set()              # type: Set[str]
+        self.skipped = set()              # type: Set[str]
+        self.dict_stamp = None
+        self.changed_rpy = set()          # type: Set[str]
+        self.moved_from = {}              # type: Dict[int, str]
+        self.expected = set()             # type: Set[str]
+        self.need_rescan = False
+        self.first_event = None           # type: Optional[float]
+        self.last_event = None            # type: Optional[float]
+
+    def roots(self) -> List[str]:
+        """需要监视的文件夹：目标文件夹，以及不在其中的RPY目录"""
+        roots = [self.target_path]
+        if self.rpy_path and not self.in_target(self.rpy_path):
+            roots.append(self.rpy_path)
+        return roots
+
+    def in_target(self, path: str) -> bool:
+        return path == self.target_path or path.startswith(os.path.join(self.target_path, ''))
+
+    def is_script(self, path: str) -> bool:
+        return (self.rpy_path is not None and path.endswith('.rpy')
+                and (path == self.rpy_path or path.startswith(os.path.join(self.rpy_path, ''))))
+
+    @property
+    def matcher(self):
+        """累计的重命名映射对应的匹配器（映射变化后首次用到时重新构建）"""
+        if self._matcher is None:
+            self._matcher = fix_rpy.RenameMatcher(self.rename_mapping)
+        return self._matcher
+
+    def add_watches(self, path: str):
+        """监视 path 及其中的全部文件夹"""
+        for root, dirs, _ in os.walk(path):
+            try:
+                self.watches[self.inotify.add_watch(root)] = root
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                # 文件夹在遍历时已被删除或移走
+                dirs[:] = []
+
+    def remove_watches(self, path: str):
+        prefix = os.path.join(path, '')
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def move_watches(self, old_path: str, new_path: str):
+        """文件夹在监视范围内移动后更新监视路径"""
+        prefix = os.path.join(old_path, '')
+        for wd, watched in self.watches.items():
+            if watched == old_path:
+                self.watches[wd] = new_path
+            elif watched.startswith(prefix):
+                self.watches[wd] = os.path.join(new_path, watched[len(prefix):])
+
+    def full_pass(self) -> bool:
+        """
+        完整处理一次（启动时和事件队列溢出时），并据此更新累计的重命名映射和RPY文件列表
+        返回是否成功；失败时（例如上一次执行没有完成）不更新映射
+        """
+        print("\n=== 完整处理目标文件夹 ===")
+        if self.rpy_path:
+            rename_result, rpy_result = run_pipeline(
+                self.target_path, self.rpy_path, self.dict_file, self.plan_file, self.log_file,
+                self.mapping_file, self.index_file, self.workers, self.threads,
+                in_flight=self.in_flight, journal_dir=self.journal_dir, refs_file=self.refs_file)
+            ok = (rename_result['status'] in RENAME_OK_STATUSES
+                  and rpy_result['status'] in fix_rpy.FIX_OK_STATUSES)
+        else:
+            rename_result = run_rename(self.target_path, self.dict_file, self.plan_file, self.log_file,
+                                       self.index_file, threads=self.threads, journal_dir=self.journal_dir)
+            ok = rename_result['status'] in RENAME_OK_STATUSES
+        if not ok:
+            return False
+        if os.path.exists(self.plan_file):
+            self.rename_mapping.update(fix_rpy.load_rename_mapping_from_plan(self.plan_file))
+            self._matcher = None
+        if self.rpy_path:
+            self.non_ascii_rpy = set(os.path.abspath(path) for path in fix_rpy.list_rpy_files(self.rpy_path)
+                                     if has_non_ascii(path))
+        return True
+
+    def handle(self, wd: int, mask: int, cookie: int, name: str):
+        """记录一个事件，实际处理在去抖之后进行"""
+        if mask & IN_Q_OVERFLOW:
+            self.need_rescan = True
+            self.mark()
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None or not name or is_temp_file(name):
+            return
+        path = os.path.join(directory, name)
+        is_dir = bool(mask & IN_ISDIR)
+
+        if mask & IN_MOVED_FROM:
+            if is_dir:
+                self.moved_from[cookie] = path
+            return
+        if mask & IN_MOVED_TO:
+            old_path = self.moved_from.pop(cookie, None) if is_dir else None
+            if old_path is not None:
+                self.move_watches(old_path, path)
+            elif is_dir:
+                self.add_watches(path)
+            if path in self.expected:
+                # 本工具自己的重命名或改写
+                self.expected.discard(path)
+                return
+            complete = True
+        elif mask & IN_CREATE:
+            if is_dir:
+                self.add_watches(path)
+            # 文件可能还在写入，可以重命名，但RPY文件要等写完（IN_CLOSE_WRITE）再改写
+            complete = is_dir
+        elif mask & IN_CLOSE_WRITE:
+            complete = True
+        else:
+            return
+
+        if complete and self.is_script(path):
+            self.changed_rpy.add(path)
+        if self.in_target(path):
+            self.pending.add(path)
+        self.mark()
+
+    def mark(self):
+        now = time.perf_counter()
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def due(self) -> bool:
+        if self.first_event is None:
+            return False
+        now = time.perf_counter()
+        return now - self.last_event >= self.debounce or now - self.first_event >= self.max_delay
+
+    def wait_timeout(self) -> float:
+        if self.first_event is None:
+            return IDLE_TIMEOUT
+        now = time.perf_counter()
+        return max(0.0, min(self.last_event + self.debounce, self.first_event + self.max_delay) - now)
+
+    def dictionary_stamp(self) -> tuple:
+        """字典和词语文件的大小和修改时间，用于发现字典被修改"""
+        stamp = []
+        for path in (self.dict_file, phrase_file_path(self.dict_file)):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def load_dictionary(self) -> bool:
+        """加载字典和词语文件并重建标准化器，字典为空或不存在时返回 False"""
+        self.dict_stamp = self.dictionary_stamp()
+        dictionary = read_dictionary(self.dict_file)
+        if not dictionary:
+            return False
+        self.normalizer = FilenameNormalizer(dictionary, phrases=read_phrases(phrase_file_path(self.dict_file)))
+        return True
+
+    def retry_skipped(self):
+        """字典或词语文件有变化时重新加载，并把因缺少拼音而跳过的条目放回待处理"""
+        if not self.skipped or self.dictionary_stamp() == self.dict_stamp:
+            return
+        # 字典正在写入时可能暂时无法读取，写完后修改时间再次变化，会重新尝试
+        if not self.load_dictionary():
+            return
+        print(f"字典已更新，重新处理 {len(self.skipped)} 个之前跳过的条目")
+        self.pending.update(self.skipped)
+        self.skipped.clear()
+        self.mark()
+
+    def plan_pending(self) -> RenamePlan:
+        """为新出现的条目生成重命名计划（已在另一个新文件夹中的条目随该文件夹一起处理）"""
+        plan = RenamePlan(self.target_path)
+        tops = []
+        for path in sorted(self.pending, key=len):
+            self.skipped.discard(path)
+            if not os.path.lexists(path):
+                continue
+            if any(path.startswith(os.path.join(top, '')) for top in tops):
+                continue
+            tops.append(path)
+        for path in tops:
+            rel_path = os.path.relpath(path, self.target_path)
+            sub_plan = scan_tree(self.target_path, normalizer=self.normalizer, subtree=rel_path)
+            if sub_plan.missing_chars:
+                print(f"警告：字典中缺少以下字符的拼音，跳过 {rel_path}（补全字典后自动处理）："
+                      f"{', '.join(sorted(sub_plan.missing_chars))}")
+                self.skipped.add(path)
+                continue
+            plan.entries.extend(sub_plan.entries)
+        return plan
+
+    def process(self):
+        """处理一批事件"""
+        first_event = self.first_event
+        self.first_event = self.last_event = None
+        # 上一批自己的操作产生的事件都已经读取过了
+        self.expected.clear()
+        started = time.perf_counter()
+
+        # 移出监视范围的文件夹不再监视
+        for path in self.moved_from.values():
+            self.remove_watches(path)
+        self.moved_from.clear()
+
+        if self.need_rescan:
+            print("事件队列溢出，重新完整处理")
+            self.need_rescan = False
+            self.pending.clear()
+            self.changed_rpy.clear()
+            for root in self.roots():
+                self.add_watches(root)
+            if not self.full_pass():
+                print("完整处理失败，之后的事件仍会处理")
+            return
+
+        plan = self.plan_pending()
+        self.pending.clear()
+        renamed = {}
+        batch_mapping = {}
+        if any(entry.new_name != entry.name for entry in plan.entries):
+            report = execute_renames(self.target_path, plan, self.threads)
+            failed = set(failure['path'] for failure in report['failures'])
+            renamed = {entry.rel_path: entry.new_name for entry in plan.entries
+                       if entry.new_name != entry.name and entry.rel_path not in failed}
+            # 重命名时上层文件夹都还是原名称（见 execute_renames），事件中的路径也是这样
+            for rel_path, new_name in renamed.items():
+                self.expected.add(os.path.join(self.target_path, os.path.dirname(rel_path), new_name))
+            batch_mapping = dict(plan.file_renames)
+            self.rename_mapping.update(batch_mapping)
+            self._matcher = None
+
+        # 本批中被重命名的RPY文件按新路径处理
+        changed_rpy = set()
+        for path in self.changed_rpy:
+            if renamed and self.in_target(path):
+                path = os.path.join(self.target_path,
+                                    current_rel_path(os.path.relpath(path, self.target_path), renamed))
+            if os.path.exists(path):
+                changed_rpy.add(path)
+        self.changed_rpy.clear()
+        if renamed:
+            moved_rpy = set(path for path in self.non_ascii_rpy if not os.path.exists(path))
+            self.non_ascii_rpy -= moved_rpy
+        for path in changed_rpy:
+            if has_non_ascii(path):
+                self.non_ascii_rpy.add(path)
+            else:
+                self.non_ascii_rpy.discard(path)
+
+        rewrites = {}
+        if self.rename_mapping:
+            for path in changed_rpy:
+                rewrites[path] = self.matcher
+        if batch_mapping:
+            batch_matcher = fix_rpy.RenameMatcher(batch_mapping)
+            if batch_matcher.all_non_ascii:
+                candidates = self.non_ascii_rpy
+            else:
+                candidates = [os.path.abspath(path) for path in fix_rpy.list_rpy_files(self.rpy_path)] \
+                    if self.rpy_path else []
+            for path in candidates:
+                rewrites.setdefault(path, batch_matcher)
+
+        updated = 0
+        for path, matcher in sorted(rewrites.items()):
+            try:
+                # 先扫描（纯ASCII和没有引用的文件很快跳过），只改写确实有引用要更新的文件
+                if fix_rpy.scan_rpy_file(path, matcher) is None:
+                    continue
+                changed_lines, replacements = fix_rpy.rewrite_rpy_file(path, matcher)
+            except Exception as e:
+                print(f"更新RPY文件失败 {path}: {e}")
+                continue
+            if replacements:
+                self.expected.add(path)
+                updated += 1
+                print(f"已更新RPY文件: {path}（{changed_lines} 行）")
+
+        finished = time.perf_counter()
+        METRICS.count('watch_batches')
+        METRICS.count('watch_renamed', len(renamed))
+        METRICS.count('watch_rpy_updated', updated)
+        if renamed or updated:
+            print(f"重命名 {len(renamed)} 个，更新 {updated} 个RPY文件，处理耗时 {finished - started:.3f} 秒，"
+                  f"距第一个事件 {finished - first_event:.3f} 秒")
+
+    def run(self, stop: Optional[threading.Event] = None, ready: Optional[threading.Event] = None) -> bool:
+        """
+        开始监视，直到 stop 被设置或按下 Ctrl+C；完成初始处理并开始监视后设置 ready
+        返回 False 表示没有开始监视（字典不可用或初始的完整处理失败）
+        """
+        if not self.load_dictionary():
+            print("错误：字典文件为空或不存在，请先准备好字典文件")
+            return False
+        self.inotify = Inotify()
+        try:
+            # 先开始监视再做完整处理，处理期间出现的条目也不会遗漏
+            for root in self.roots():
+                self.add_watches(root)
+            if not self.full_pass():
+                print("错误：完整处理失败，未开始监视")
+                return False
+            print(f"\n正在监视 {', '.join(self.roots())}（按 Ctrl+C 停止）")
+            if ready is not None:
+                ready.set()
+            while stop is None or not stop.is_set():
+                for event in self.inotify.read_events(self.wait_timeout()):
+                    self.handle(*event)
+                self.retry_skipped()
+                if self.due():
+                    with METRICS.phase('watch_batch'):
+                        self.process()
+        except KeyboardInterrupt:
+            print("\n已停止监视")
+        finally:
+            self.inotify.close()
+        return True
+
+
+def run_watch(target_path: str, rpy_path: Optional[str] = None, dict_file: str = DICT_FILE,
+              threads: int = 1, debounce: float = DEBOUNCE, **options) -> int:
+    """监视模式入口，返回退出码；options 为计划、日志、索引等完整处理使用的参数（见 Watcher）"""
+    if not sys.platform.startswith('linux'):
+        print("错误：监视模式只支持 Linux（inotify）")
+        return 1
+    for path in filter(None, (target_path, rpy_path)):
+        if not os.path.isdir(path):
+            print(f"错误：路径不存在: {path}")
+            return 1
+    try:
+        watcher = Watcher(target_path, rpy_path, dict_file, threads, debounce, max(debounce, MAX_DELAY),
+                          **options)
+        if not watcher.run():
+            return 1
+    except Exception as e:
+        print(f"监视失败: {e}")
+        return 1
+    return 0